@@ -0,0 +1,86 @@
+# run from Model/: python -m benchmarks.bench_aero
+import numpy as np
+from numba import njit
+
+import model_RBird
+from utils.utils import *
+from benchmarks.timing import time_run
+
+# previous path, one (data, meta) table per surface and a lookup per call, for reference
+@njit(cache=True)
+def calc_lift_drag_ref(U,omega,r_b_frame,C_loc_b,Cb_loc, aero_coeffs, rho,A):
+	U_mag, _, alpha, beta, C_loc_stab = stab_frame(U, omega, r_b_frame, C_loc_b)
+	CL, CD = query_periodic_1D(aero_coeffs, alpha*180/pi)
+	Q = 1/2*rho*U_mag**2
+	F = matvec(matmul(Cb_loc, C_loc_stab), np.array([-Q*CD*A, 0.0, -Q*CL*A]))
+	return F, cross(r_b_frame, F)
+
+# per evaluation loops inside numba, so dispatch overhead is not timed
+@njit(cache=True)
+def loop_coeffs_ref(coeffs, i_aeros, alphas):
+	out = np.empty((len(alphas), len(i_aeros), 2))
+	for n in range(len(alphas)):
+		for k in range(len(i_aeros)):
+			out[n,k] = query_periodic_1D(coeffs[i_aeros[k]], alphas[n,k])
+	return out
+
+@njit(cache=True)
+def loop_coeffs_bank(aero_bank, i_aeros, alphas):
+	out = np.empty((len(alphas), len(i_aeros), 2))
+	for n in range(len(alphas)):
+		out[n] = query_aero_bank_batch(aero_bank, i_aeros, alphas[n])
+	return out
+
+@njit(cache=True)
+def loop_lift_drag_ref(coeffs, i_aeros, Us, omegas, r_b_frames, C_loc_bs, Cb_locs, rhos, As):
+	out = np.zeros((len(Us), 6))
+	for n in range(len(Us)):
+		for k in range(len(i_aeros)):
+			F, M = calc_lift_drag_ref(Us[n], omegas[n], r_b_frames[k], C_loc_bs[k], Cb_locs[k], coeffs[i_aeros[k]], rhos[k], As[k])
+			out[n,:3] += F
+			out[n,3:] += M
+	return out
+
+@njit(cache=True)
+def loop_lift_drag_bank(aero_bank, i_aeros, Us, omegas, r_b_frames, C_loc_bs, Cb_locs, rhos, As):
+	out = np.empty((len(Us), 6))
+	for n in range(len(Us)):
+		out[n,:3], out[n,3:] = calc_lift_drag_batch(Us[n], omegas[n], r_b_frames, C_loc_bs, Cb_locs, aero_bank, i_aeros, rhos, As)
+	return out
+
+def main():
+	model = model_RBird.make_default()
+	_, panels, aero_bank, hull, wing_root, _ = model.packed
+	coeffs = tuple(model.loaded[path] for path in model.aero_paths)
+	# every lifting surface of the model, as in calc_force_moments_fused
+	i_aeros = np.concatenate((panels[7], [wing_root[0], wing_root[0], hull[1], hull[2]])).astype(np.int64)
+	n_surfaces = len(i_aeros)
+
+	rng = np.random.default_rng(0)
+	n = 20000
+	alphas = rng.uniform(-180, 180, (n, n_surfaces))
+	Us = np.array([2.0, 0.0, 0.0]) + rng.normal(0, 0.5, (n, 3))
+	omegas = rng.normal(0, 0.5, (n, 3))
+	r_b_frames = rng.normal(0, 0.3, (n_surfaces, 3))
+	C_loc_bs = np.array([np.eye(3)]*n_surfaces)
+	C_loc_bs[:len(panels[6])] = panels[6]
+	Cb_locs = np.ascontiguousarray(np.transpose(C_loc_bs, (0, 2, 1)))
+	rhos = np.full(n_surfaces, model.rho)
+	As = rng.uniform(0.001, 0.01, n_surfaces)
+
+	print(f'{n_surfaces} surfaces, {len(model.aero_paths)} tables, {aero_bank[4]} alpha intervals')
+	print(f'{"lookup":<22}{"ns/eval":>10}{"max diff":>12}')
+	ref = loop_coeffs_ref(coeffs, i_aeros, alphas)
+	lift_drag_args = (i_aeros, Us, omegas, r_b_frames, C_loc_bs, Cb_locs, rhos, As)
+	lift_drag_ref = loop_lift_drag_ref(coeffs, *lift_drag_args)
+	runs = [
+		('coeffs reference', loop_coeffs_ref, (coeffs, i_aeros, alphas), ref),
+		('coeffs bank', loop_coeffs_bank, (aero_bank, i_aeros, alphas), ref),
+		('lift drag reference', loop_lift_drag_ref, (coeffs, *lift_drag_args), lift_drag_ref),
+		('lift drag bank', loop_lift_drag_bank, (aero_bank, *lift_drag_args), lift_drag_ref),
+	]
+	for label, fun, args, expected in runs:
+		tok = time_run(fun, *args)
+		print(f'{label:<22}{tok/n*1e9:>10.1f}{np.max(np.abs(fun(*args) - expected)):>12.2e}')
+
+if __name__ == '__main__': main()
@@ -0,0 +1,40 @@
+# run from Model/: python -m benchmarks.bench_b_series
+import numpy as np
+import sys
+
+# params scripts import each other as top level modules, numba caches are keyed by that module name
+sys.path.append('./params')
+from b_series_coeff import *
+from benchmarks.timing import time_run
+
+# previous path, every power of every term recomputed by broadcasting, for reference
+def b_series_coeff_ref(AE_AO, P_D, J, Z):
+	J = np.atleast_1d(J)
+	KT = np.sum(C_T[:, None] * (J**s_T[:, None]) * (P_D**t_T[:, None]) * (AE_AO**u_T[:, None]) * (Z**v_T[:, None]), axis=0)
+	KQ = np.sum(C_Q[:, None] * (J**s_Q[:, None]) * (P_D**t_Q[:, None]) * (AE_AO**u_Q[:, None]) * (Z**v_Q[:, None]), axis=0)
+	return KT, KQ
+
+def calc_grid_ref(J, P_D, AE_AO, Z):
+	out = np.empty((len(J), len(P_D), len(AE_AO), len(Z), 2))
+	for j in range(len(P_D)):
+		for k in range(len(AE_AO)):
+			for l in range(len(Z)):
+				out[:,j,k,l,0], out[:,j,k,l,1] = b_series_coeff_ref(AE_AO[k], P_D[j], J, Z[l])
+	return out
+
+def main():
+	J = np.linspace(0, b_series_J_max, 100)
+	# design sweep, (P/D, AE/AO, Z) combinations
+	P_D = np.linspace(0.5, 1.4, 10)
+	AE_AO = np.linspace(0.3, 1.05, 6)
+	Z = np.arange(2, 8, dtype=np.float64)
+	n_designs = len(P_D)*len(AE_AO)*len(Z)
+
+	ref = calc_grid_ref(J, P_D, AE_AO, Z)
+	print(f'{n_designs} designs x {len(J)} advance ratios')
+	print(f'{"evaluation":<14}{"total ms":>10}{"ns/point":>10}{"max diff":>12}')
+	for label, fun in [('reference', calc_grid_ref), ('compiled', calc_b_series_grid)]:
+		tok = time_run(fun, J, P_D, AE_AO, Z, repeats=3)
+		print(f'{label:<14}{tok*1e3:>10.2f}{tok/ref[...,0].size*1e9:>10.1f}{np.max(np.abs(fun(J, P_D, AE_AO, Z) - ref)):>12.2e}')
+
+if __name__ == '__main__': main()
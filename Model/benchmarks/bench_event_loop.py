@@ -0,0 +1,71 @@
+# run from Model/: python -m benchmarks.bench_event_loop [--seconds=5]
+import asyncio
+import contextlib
+import os
+import sys
+
+import model_RBird
+from simulation import Simulation
+from sim_worker import SimulationWorker, FrameScheduler, LoopLatency
+from utils.cli_utils import get_arg
+
+step_rate = 20
+
+# previous path, each frame stepped and serialised on the event loop itself, for reference
+async def inline_loop(sim, frames):
+	while True:
+		if sim.get_dt() > 1/step_rate:
+			sim.step()
+			sim.set_telemetry()
+			sim.read_telem()
+			frames[0] += 1
+		await asyncio.sleep(0.01)
+
+async def run(sim, seconds, threaded):
+	latency = LoopLatency(interval=0.002)
+	latency_task = asyncio.create_task(latency.run())
+	frames = [0]
+	if threaded:
+		loop = asyncio.get_running_loop()
+		frame_ready = asyncio.Event()
+		worker = SimulationWorker(sim, FrameScheduler(step_rate), on_publish=lambda build, forced: loop.call_soon_threadsafe(frame_ready.set))
+		async def serialise():
+			while True:
+				await frame_ready.wait()
+				frame_ready.clear()
+				sim.read_telem()
+				frames[0] += 1
+		task = asyncio.create_task(serialise())
+		worker.start()
+		worker.submit(sim.resume)
+	else:
+		sim.resume()
+		task = asyncio.create_task(inline_loop(sim, frames))
+	await asyncio.sleep(seconds)
+	task.cancel()
+	if threaded:
+		await asyncio.to_thread(worker.stop)
+	sim.pause()
+	latency_task.cancel()
+	await asyncio.gather(task, latency_task, return_exceptions=True)
+	return latency.summary(), frames[0]/seconds, sim.elapsed
+
+def main():
+	seconds = get_arg('seconds', 5.0)
+	sys.setswitchinterval(0.001)
+	with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+		sim = Simulation(model_RBird.make_default(dynamic_propulsor=True), method='IMEX')
+
+	print(f'{os.cpu_count()} cpu(s), {seconds:g} s per run, latency of a 2 ms periodic wakeup')
+	print(f'{"method":<10}{"integration":<14}{"frames/s":>10}{"sim s/s":>9}{"mean ms":>9}{"p99 ms":>8}{"max ms":>8}')
+	for method in ['IMEX', 'DOPRI5', 'RK45']:
+		for threaded in (False, True):
+			with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+				sim.method = method
+				sim.reset()
+				sim.step(0.05)		# compile or cache load outside the timed run
+				stats, rate, elapsed = asyncio.run(run(sim, seconds, threaded))
+			print(f'{method:<10}{"worker thread" if threaded else "event loop":<14}{rate:>10.1f}{elapsed/seconds:>9.2f}'
+				f'{stats["mean"]:>9.2f}{stats["p99"]:>8.2f}{stats["window_max"]:>8.2f}')
+
+if __name__ == '__main__': main()
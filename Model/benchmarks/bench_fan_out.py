@@ -0,0 +1,77 @@
+# run from Model/: python -m benchmarks.bench_fan_out [--seconds=3]
+import asyncio
+import contextlib
+import os
+import time
+
+import numpy as np
+
+from server_real_time import Client
+from utils.cli_utils import get_arg
+
+frame_rate = 20
+
+class FakeSocket:
+	# a connection whose sends take delay seconds each, a stalled browser tab backs the transport up the same way
+	def __init__(self, delay, port):
+		self.delay = delay
+		self.remote_address = ('127.0.0.1', port)
+		self.received = []
+
+	async def send(self, message):
+		await asyncio.sleep(self.delay)
+		self.received.append((message, time.perf_counter()))
+
+# previous path, each frame awaited on every socket in turn, frames published meanwhile skipped for everyone
+async def fan_out_sequential(sockets, seconds):
+	published = 0
+	end = time.perf_counter() + seconds
+	deadline = time.perf_counter()
+	while time.perf_counter() < end:
+		now = time.perf_counter()
+		if now >= deadline:
+			deadline += (1 + int((now - deadline)*frame_rate))/frame_rate
+			published += 1
+			for socket in sockets:
+				await socket.send(now)
+		await asyncio.sleep(max(0.0, deadline - time.perf_counter()))
+	return published
+
+async def fan_out_queued(sockets, seconds):
+	clients = [Client(socket) for socket in sockets]
+	for client in clients:
+		client.task = asyncio.create_task(client.run())
+	published = 0
+	end = time.perf_counter() + seconds
+	while time.perf_counter() < end:
+		now = time.perf_counter()
+		published += 1
+		for client in clients:
+			client.send(now, droppable=True)
+		await asyncio.sleep(1/frame_rate)
+	for client in clients:
+		client.task.cancel()
+	await asyncio.gather(*[client.task for client in clients])
+	return published
+
+def get_lag(sockets):
+	# ms from publishing to delivery
+	lags = np.array([received - sent for socket in sockets for sent, received in socket.received])
+	return lags*1e3 if len(lags) else np.zeros(1)
+
+def main():
+	seconds = get_arg('seconds', 3.0)
+	print(f'{frame_rate} Hz for {seconds:g} s, 4 clients with 1 ms sends, plus one stalled at 250 ms per send')
+	print(f'{"fan out":<12}{"stalled":<9}{"frames/s":>9}{"fast lag ms":>12}{"p99":>8}{"max":>8}{"stalled frames/s":>17}')
+	for label, fun in [('sequential', fan_out_sequential), ('queued', fan_out_queued)]:
+		for stalled in (False, True):
+			fast = [FakeSocket(0.001, port) for port in range(4)]
+			slow = [FakeSocket(0.25, 4)] if stalled else []
+			with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+				published = asyncio.run(fun(fast + slow, seconds))
+			lag = get_lag(fast)
+			print(f'{label:<12}{"yes" if stalled else "no":<9}{published/seconds:>9.1f}{np.mean(lag):>12.1f}'
+				f'{np.percentile(lag, 99):>8.1f}{np.max(lag):>8.1f}'
+				f'{(len(slow[0].received)/seconds if stalled else np.nan):>17.1f}')
+
+if __name__ == '__main__': main()
@@ -0,0 +1,92 @@
+# run from Model/: python -m benchmarks.bench_interp
+import numpy as np
+from numba import njit
+
+from utils.param_utils import load_volume_area_data, load_propulsor_data
+from utils.interp_utils import interp_grid, interp_grid_batch, interp_grid_grad, interp_grid_grad_batch, set_cubic, get_ranges
+from benchmarks.timing import time_run
+
+# previous lookup, hard-wired to 3 axes on uniform spacing, for reference
+def load_npz_4D_ref(path_npz, w, x,y,z):
+	data = np.load(path_npz)
+	ranges = [data[x], data[y], data[z]]
+	res = np.array([(max(r) - min(r))/(len(r)-1) for r in ranges])
+	return data[w], (ranges[0], ranges[1], ranges[2], res[0], res[1], res[2],
+				  len(ranges[0])-2, len(ranges[1])-2, len(ranges[2])-2, np.array([min(r) for r in ranges]), res)
+
+@njit(cache=True)
+def trilinear_interp_ref(data, query):
+	x, y, z = query
+	grid_w = data[0]
+	(range_x,range_y,range_z, res_x,res_y,res_z,
+  		i_max_x,i_max_y,i_max_z, min_base,res) = data[1]
+	i_x, i_y, i_z = ((query-min_base)/res).astype(np.int32)
+	i_x = min(max(i_x, 0), i_max_x)
+	i_y = min(max(i_y, 0), i_max_y)
+	i_z = min(max(i_z, 0), i_max_z)
+	d_x = (x - range_x[i_x]) / res_x
+	d_y = (y - range_y[i_y]) / res_y
+	d_z = (z - range_z[i_z]) / res_z
+	c00 = grid_w[i_x][i_y][i_z]*(1-d_x) + grid_w[i_x+1][i_y][i_z]*d_x
+	c01 = grid_w[i_x][i_y][i_z+1]*(1-d_x) + grid_w[i_x+1][i_y][i_z+1]*d_x
+	c10 = grid_w[i_x][i_y+1][i_z]*(1-d_x) + grid_w[i_x+1][i_y+1][i_z]*d_x
+	c11 = grid_w[i_x][i_y+1][i_z+1]*(1-d_x) + grid_w[i_x+1][i_y+1][i_z+1]*d_x
+	c0 = c00*(1-d_y) + c10*d_y
+	c1 = c01*(1-d_y) + c11*d_y
+	return c0*(1-d_z) + c1*d_z
+
+# per point loops inside numba, so dispatch overhead is not timed
+@njit(cache=True)
+def loop_ref(data, queries):
+	out = np.empty((len(queries), data[0].shape[-1]))
+	for i in range(len(queries)):
+		out[i] = trilinear_interp_ref(data, queries[i])
+	return out
+
+@njit(cache=True)
+def loop_grid(table, queries):
+	out = np.empty((len(queries), table[0].shape[1]))
+	for i in range(len(queries)):
+		out[i] = interp_grid(table, queries[i])
+	return out
+
+@njit(cache=True)
+def loop_grid_grad(table, queries):
+	out = np.empty((len(queries), table[0].shape[1]))
+	for i in range(len(queries)):
+		out[i] = interp_grid_grad(table, queries[i])[0]
+	return out
+
+def main():
+	rng = np.random.default_rng(0)
+	n = 200000
+	cases = [
+		('hull', 'params/hull_data_regular_grid.npz', load_volume_area_data, ('grid_results','z_range','pitch_range','roll_range')),
+		('propulsor', 'params/propulsor data/FlipSky-85165-150_B4-70-14_10.npz', load_propulsor_data,
+   			('grid_results','rho_range','vA_range','V_range')),
+	]
+	print(f'{"table":<11}{"lookup":<18}{"ns/query":>10}{"max diff":>12}')
+	for name, path, load, keys in cases:
+		table = load(path)
+		data_ref = load_npz_4D_ref(path, *keys)
+		ranges = get_ranges(table)
+		queries = np.column_stack([rng.uniform(r[0], r[-1], n) for r in ranges])
+		ref = loop_ref(data_ref, queries)
+		out = loop_grid(table, queries)
+		runs = [
+			('reference', loop_ref, data_ref, ref),
+			('grid', loop_grid, table, out),
+			('grid batch', interp_grid_batch, table, out),
+			('grid + gradient', loop_grid_grad, table, out),
+			('grid batch + grad', interp_grid_grad_batch, table, out),
+			('cubic', loop_grid, set_cubic(table, True), out),
+		]
+		for label, fun, data, expected in runs:
+			tok = time_run(fun, data, queries)
+			result = fun(data, queries)
+			result = result[0] if isinstance(result, tuple) else result
+			print(f'{name:<11}{label:<18}{tok/n*1e9:>10.1f}{np.max(np.abs(result - expected)):>12.2e}')
+		# the reference assumed uniform spacing on every axis
+		print(f'{name:<11}{"grid vs reference":<18}{"":>10}{np.max(np.abs(out - ref)):>12.2e}')
+
+if __name__ == '__main__': main()
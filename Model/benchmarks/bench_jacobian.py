@@ -0,0 +1,33 @@
+# run from Model/: python -m benchmarks.bench_jacobian
+import numpy as np
+import time
+from scipy.integrate import solve_ivp
+
+import model_RBird
+
+def main():
+	model = model_RBird.make_default()
+	model.r[2] = model.hull.z0
+	input = np.array([0.05, 30.0])
+	state0 = model.get_state()
+	t_span = (0, 2)
+
+	fun = lambda t, state: model.calc_state_dot_fused(state, input)
+	jac = lambda t, state: model.calc_jacobian(state, input, central=False)
+	# compilation/cache load ahead of timing
+	fun(0, state0)
+	jac(0, state0)
+
+	print(f'{"method":<8}{"jac":<10}{"nfev":>8}{"njev":>8}{"nlu":>8}{"steps":>8}{"wall [s]":>12}')
+	for method in ['Radau', 'BDF']:
+		results = {}
+		for label, jac_arg in [('none', None), ('provided', jac)]:
+			tik = time.perf_counter()
+			sol = solve_ivp(fun, t_span, state0, method=method, jac=jac_arg)
+			tok = time.perf_counter() - tik
+			results[label] = sol
+			print(f'{method:<8}{label:<10}{sol.nfev:>8}{sol.njev:>8}{sol.nlu:>8}{len(sol.t):>8}{tok:>12.4f}')
+		diff = np.max(np.abs(results['none'].y[:,-1] - results['provided'].y[:,-1]))
+		print(f'INFO: {method} final state max difference - {diff:.3e}')
+
+if __name__ == '__main__': main()
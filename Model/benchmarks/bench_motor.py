@@ -0,0 +1,40 @@
+# run from Model/: python -m benchmarks.bench_motor
+import numpy as np
+import time
+from scipy.integrate import solve_ivp
+
+import model_RBird
+import integrators
+
+def main():
+	model = model_RBird.make_default(dynamic_propulsor=True)
+	model.r[2] = model.hull.z0
+	model.U[0] = 5.0
+	input = np.array([0.0, 30.0])
+	state0 = model.get_state()
+	t_end = 2.0
+	packed = model.packed
+
+	# reference on steps well below the electrical time constant L/R
+	ref, _ = integrators.integrate_rk4(state0, input, packed, 1e-5, int(t_end/1e-5))
+	ref = ref[-1]
+
+	runs = {
+		'IMEX 5ms': lambda: integrators.integrate_imex(state0, input, packed, 0.005, int(t_end/0.005), 2)[0][-1],
+		'IMEX 10ms': lambda: integrators.integrate_imex(state0, input, packed, 0.01, int(t_end/0.01), 4)[0][-1],
+		'RK4 2ms': lambda: integrators.integrate_rk4(state0, input, packed, 0.002, int(t_end/0.002))[0][-1],
+		'DOPRI5': lambda: integrators.integrate_dopri5(state0, np.empty(0), input, packed, t_end, 0.0, 1e-3, 1e-6, 10000)[1][-1],
+		'Radau': lambda: solve_ivp(lambda t, state: model.calc_state_dot_fused(state, input), (0, t_end), state0, method='Radau',
+							 jac=lambda t, state: model.calc_jacobian(state, input, central=False)).y[:,-1],
+	}
+
+	print(f'{"method":<12}{"wall [ms]":>12}{"RT factor":>12}{"max err":>12}{"err I [A]":>12}{"err w [rad/s]":>16}')
+	for label, run in runs.items():
+		run()	# compilation/cache load ahead of timing
+		tik = time.perf_counter()
+		state = run()
+		tok = time.perf_counter() - tik
+		err = np.abs(state - ref)
+		print(f'{label:<12}{tok*1e3:>12.2f}{t_end/tok:>12.1f}{np.max(err[:12]):>12.2e}{err[12]:>12.2e}{err[13]:>16.2e}')
+
+if __name__ == '__main__': main()
@@ -0,0 +1,62 @@
+# run from Model/: python -m benchmarks.bench_propulsor
+import numpy as np
+from numba import njit
+
+import model_RBird
+from utils.utils import *
+from components.propulsor import solve_motor_equilibrium, calc_thrust_torque_direct
+from benchmarks.timing import time_run
+
+# per evaluation loops inside numba, so dispatch overhead is not timed
+@njit(cache=True)
+def loop_table(prop_data, queries):
+	out = np.empty((len(queries), 4))
+	for n in range(len(queries)):
+		out[n] = interp_grid(prop_data, queries[n])
+	return out
+
+@njit(cache=True)
+def loop_direct(d, fourier_coeffs, motor, queries, max_iter):
+	# (n, T, Q, I, converged)
+	out = np.empty((len(queries), 5))
+	for n in range(len(queries)):
+		rho, vA, V = queries[n]
+		n_p, T, Q, I, converged = solve_motor_equilibrium(V, rho, vA, d, fourier_coeffs, motor, 1e-9, max_iter)
+		out[n] = (n_p, T, Q, I, 1.0 if converged else 0.0)
+	return out
+
+@njit(cache=True)
+def calc_residuals(d, fourier_coeffs, motor, queries, results):
+	# torque balance of calc_motor_dot at the returned speed, relative to the motor torque scale
+	R, L, Ke, Kt, J, b = motor
+	out = np.empty(len(queries))
+	for n in range(len(queries)):
+		rho, vA, V = queries[n]
+		omega_p = 2*pi*results[n,0]
+		Q = calc_thrust_torque_direct(results[n,0], rho, vA, d, fourier_coeffs)[1]
+		out[n] = abs(Kt*(V - Ke*omega_p)/R - b*omega_p - Q)/(Kt*abs(V)/R + abs(Q) + 1)
+	return out
+
+def main():
+	table = model_RBird.make_default().propulsor
+	direct = model_RBird.make_default(direct_propulsor=True).propulsor
+	d, fourier_coeffs, motor = direct.d, direct.fourier_coeffs, direct.motor
+
+	rng = np.random.default_rng(0)
+	n = 20000
+	# operating points inside the table (rho, vA, V), and beyond it where the table clamps
+	inside = np.stack((rng.choice([0.8, 1.4, 995, 1100], n), rng.uniform(-20, 20, n), rng.uniform(-55, 55, n)), axis=1)
+	outside = np.stack((rng.choice([1.2, 1025], n), rng.uniform(-40, 40, n), rng.uniform(-100, 100, n)), axis=1)
+
+	print(f'{fourier_coeffs.shape[0]} harmonics, table {table.prop_data[0].nbytes/1e6:.1f} MB')
+	print(f'{"evaluation":<26}{"ns/eval":>10}{"max rel residual":>18}{"unconverged":>13}')
+	print(f'{"table":<26}{time_run(loop_table, table.prop_data, inside)/n*1e9:>10.1f}{"-":>18}{"-":>13}')
+	for label, queries in [('inside', inside), ('outside', outside)]:
+		for max_iter in (8, 16, 32):
+			tok = time_run(loop_direct, d, fourier_coeffs, motor, queries, max_iter)
+			results = loop_direct(d, fourier_coeffs, motor, queries, max_iter)
+			residual = calc_residuals(d, fourier_coeffs, motor, queries, results)
+			print(f'{f"direct {label} max_iter={max_iter}":<26}{tok/n*1e9:>10.1f}{np.max(residual):>18.2e}'
+				f'{int(np.sum(results[:,4] == 0)):>13}')
+
+if __name__ == '__main__': main()
@@ -0,0 +1,42 @@
+# run from Model/: python -m benchmarks.bench_scheduler [--seconds=4]
+import contextlib
+import os
+import sys
+import time
+
+import model_RBird
+from simulation import Simulation
+from sim_worker import SimulationWorker, FrameScheduler
+from utils.cli_utils import get_arg
+
+def run(sim, scheduler, seconds):
+	worker = SimulationWorker(sim, scheduler)
+	worker.start()
+	worker.submit(sim.resume)
+	time.sleep(seconds)
+	worker.submit(sim.pause)
+	worker.stop()
+	return scheduler.summary()
+
+def main():
+	seconds = get_arg('seconds', 4.0)
+	sys.setswitchinterval(0.001)
+	with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+		sim = Simulation(model_RBird.make_default(dynamic_propulsor=True), method='IMEX')
+
+	print(f'{os.cpu_count()} cpu(s), {seconds:g} s per run, budget 80% of the tick period')
+	print(f'{"method":<8}{"Hz":>5}{"policy":>10}{"frames":>8}{"ticks":>7}{"dropped":>9}{"overruns":>10}{"jitter p99":>12}'
+		f'{"jitter max":>12}{"compute":>9}{"max":>8}{"rtf":>7}')
+	for method in ['IMEX', 'DOPRI5', 'RK45']:
+		for tick_rate in (20, 100, 400):
+			for policy in ('catch_up', 'drop'):
+				with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+					sim.method = method
+					sim.reset()
+					sim.step(0.05)		# compile or cache load outside the timed run
+					stats = run(sim, FrameScheduler(tick_rate, 0.8, policy), seconds)
+				print(f'{method:<8}{tick_rate:>5}{policy:>10}{stats["frames"]:>8}{stats["ticks"]:>7}{stats["dropped"]:>9}'
+					f'{stats["overruns"]:>10}{stats["jitter_p99"]:>12.2f}{stats["jitter_max"]:>12.2f}'
+					f'{stats["compute_mean"]:>9.2f}{stats["compute_max"]:>8.2f}{stats["real_time_factor"]:>7.2f}')
+
+if __name__ == '__main__': main()
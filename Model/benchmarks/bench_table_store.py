@@ -0,0 +1,89 @@
+# run from Model/: python -m benchmarks.bench_table_store [--workers=4]
+import numpy as np
+import contextlib
+import multiprocessing as mp
+import os
+import time
+
+import model_RBird
+from utils.utils import *
+from utils.cli_utils import get_arg
+from benchmarks.timing import time_run
+
+grid_names = ['hull', 'wing_root', 'hydrostatics', 'propulsor']
+
+def get_grids(model):
+	loaded = model.loaded
+	return {
+		'hull': loaded[model.paths[1]],
+		'wing_root': loaded[model.paths[2]],
+		'hydrostatics': loaded['hydrostatics'][1],
+		'propulsor': loaded[model.paths[4]][0],
+	}
+
+def get_queries(table, n, rng):
+	ranges = get_ranges(table)
+	return np.stack([rng.uniform(r[0], r[-1], n) for r in ranges], axis=1)
+
+def read_mapping(path):
+	# Rss, Pss and private kB of this process' mappings of one file, from /proc/self/smaps
+	path = os.path.abspath(path)
+	totals = {'Rss': 0, 'Pss': 0, 'Private_Clean': 0, 'Private_Dirty': 0}
+	mapped = False
+	with open('/proc/self/smaps') as file:
+		for line in file:
+			fields = line.split()
+			if '-' in fields[0] and len(fields) >= 5 and not fields[0].endswith(':'):
+				mapped = len(fields) >= 6 and fields[5] == path
+			elif mapped and fields[0][:-1] in totals:
+				totals[fields[0][:-1]] += int(fields[1])
+	return totals['Rss'], totals['Pss'], totals['Private_Clean'] + totals['Private_Dirty']
+
+def read_rss():
+	with open('/proc/self/status') as file:
+		for line in file:
+			if line.startswith('VmRSS:'):
+				return int(line.split()[1])
+	return 0
+
+def measure_worker(grid_dtypes):
+	# a worker as in dispersion or trim: the model over the artifact, then every table page touched (worst case)
+	with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+		model = model_RBird.make_default(grid_dtypes=grid_dtypes)
+	for table in get_grids(model).values():
+		float(np.sum(table[0]))
+	time.sleep(0.5)		# every worker alive and mapped while smaps is read
+	return (os.getpid(), *read_mapping(model.artifact_path), read_rss())
+
+def main():
+	workers = get_arg('workers', 4)
+	model = model_RBird.make_default()
+	model_32 = model_RBird.make_default(grid_dtypes={name: 'float32' for name in grid_names})
+	grids, grids_32 = get_grids(model), get_grids(model_32)
+
+	rng = np.random.default_rng(0)
+	n = 20000
+	print(f'{"grid":<14}{"MB f64":>8}{"MB f32":>8}{"ns f64":>9}{"ns f32":>9}{"max rel diff":>14}')
+	for name in grid_names:
+		table, table_32 = grids[name], grids_32[name]
+		queries = get_queries(table, n, rng)
+		tok = time_run(interp_grid_batch, table, queries)
+		tok_32 = time_run(interp_grid_batch, table_32, queries)
+		expected = interp_grid_batch(table, queries)
+		scale = np.maximum(np.max(np.abs(table[0]), axis=0), 1e-12)
+		diff = np.max(np.abs(interp_grid_batch(table_32, queries) - expected)/scale)
+		print(f'{name:<14}{table[0].nbytes/1e6:>8.2f}{table_32[0].nbytes/1e6:>8.2f}{tok/n*1e9:>9.1f}{tok_32/n*1e9:>9.1f}'
+			f'{diff:>14.2e}')
+
+	# spawned, so nothing is inherited from this process, each worker maps the artifact itself
+	print(f'\nartifact mapping per worker ({workers} spawned workers, kB)')
+	print(f'{"grids":<14}{"file":>8}{"Rss":>8}{"Pss":>8}{"private":>9}{"process Rss":>13}')
+	ctx = mp.get_context('spawn')
+	for label, grid_dtypes, artifact in [('float64', None, model.artifact_path),
+		('float32', {name: 'float32' for name in grid_names}, model_32.artifact_path)]:
+		with ctx.Pool(workers) as pool:
+			results = pool.map(measure_worker, [grid_dtypes]*workers)
+		rss, pss, private, process_rss = np.mean([result[1:] for result in results], axis=0)
+		print(f'{label:<14}{os.path.getsize(artifact)/1e3:>8.0f}{rss:>8.0f}{pss:>8.0f}{private:>9.0f}{process_rss:>13.0f}')
+
+if __name__ == '__main__': main()
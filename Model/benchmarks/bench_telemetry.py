@@ -0,0 +1,116 @@
+# run from Model/: python -m benchmarks.bench_telemetry
+import contextlib
+import json
+import os
+
+import numpy as np
+
+import model_RBird
+from simulation import Simulation, telem_channels, get_channel_mask
+from benchmarks.timing import time_mean
+
+# previous path, a nested dict refilled with .tolist() values and dumped every frame, for reference
+def make_telem_ref(model):
+	return {'type': 'telem', 'hull': {'surf': {}}, 'panels': {panel.id: {} for panel in model.panels.values()},
+		'wing_roots': {'0': {}, '1': {}}, 'propulsor': {}}
+
+def set_telemetry_ref(sim, raw_telem):
+	model = sim.model
+	for panel in model.panels.values():
+		panel_telem = raw_telem['panels'][panel.id]
+		panel_telem['alpha'] = panel.alpha
+		panel_telem['beta'] = panel.beta
+		panel_telem['f'] = panel.f
+		panel_telem['one_lower'] = panel.one_lower
+		panel_telem['r_qc_fC'] = panel.r_qc_fC.tolist()
+		panel_telem['U_mag'] = panel.U_mag
+		panel_telem['L'] = panel.L
+		panel_telem['D'] = panel.D
+		panel_telem['F'] = panel.F.tolist()
+		panel_telem['M'] = panel.M.tolist()
+		panel_telem['Cbw'] = panel.Cbw.flatten().tolist()
+
+	hull = model.hull
+	hull_telem = raw_telem['hull']
+	for key, attr in [('alpha', 'alpha'), ('beta', 'beta'), ('area', 'area'), ('vol', 'vol'), ('U_mag', 'U_mag'),
+			('L', 'L_h'), ('D', 'D_h')]:
+		hull_telem[key] = getattr(hull, attr)
+	for key in ['area_center', 'vol_center', 'F_h', 'M_h', 'F_b', 'M_b']:
+		hull_telem[key] = getattr(hull, key).tolist()
+	hull_telem['Cbw'] = hull.Cbw.flatten().tolist()
+	surf_telem = hull_telem['surf']
+	for key in ['alpha', 'beta', 'U_mag', 'L', 'D']:
+		surf_telem[key] = getattr(hull, f'{key}_surf')
+	surf_telem['F'] = hull.F_surf.tolist()
+	surf_telem['M'] = hull.M_surf.tolist()
+	surf_telem['Cbw'] = hull.Cbw_surf.flatten().tolist()
+
+	for wr in model.wing_roots:
+		wr_telem = raw_telem['wing_roots'][str(int(not wr.left))]
+		for key in ['alpha', 'beta', 'area', 'vol', 'U_mag', 'L', 'D']:
+			wr_telem[key] = getattr(wr, key)
+		for key in ['area_center', 'vol_center', 'F_f', 'M_f', 'F_b', 'M_b']:
+			wr_telem[key] = getattr(wr, key).tolist()
+		wr_telem['Cbw'] = wr.Cbw.flatten().tolist()
+
+	p = model.propulsor
+	p_telem = raw_telem['propulsor']
+	for key in ['fp', 'V', 'n', 'T', 'Q', 'I', 'converged']:
+		p_telem[key] = getattr(p, key)
+	p_telem['F'] = p.F.tolist()
+	p_telem['M'] = p.M.tolist()
+	p_telem['Cra_w'] = p.Cra_w.flatten().tolist()
+
+	for key in ['U', 'omega', 'Phi', 'r', 'query']:
+		raw_telem[key] = getattr(model, key).tolist()
+	raw_telem['psi_ra'] = model.psi_ra
+	raw_telem['C0b'] = model.C0b.flatten().tolist()
+	raw_telem['Cra_b'] = model.Cra_b.flatten().tolist()
+	raw_telem['running'] = sim.is_running()
+	raw_telem['rate'] = sim.rate
+	raw_telem['method'] = sim.method
+	raw_telem['solver'] = dict(sim.solver_stats)
+	return json.dumps(raw_telem)
+
+def set_telemetry_fresh(sim, channels):
+	# a new state every frame, so the diagnostics pass runs for the subscribed parts
+	sim.model.diagnostics_key = None
+	sim.set_telemetry(channels)
+
+def main():
+	with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+		sim = Simulation(model_RBird.make_default(dynamic_propulsor=True), method='IMEX')
+		sim.resume()
+		sim.step(0.05)
+		sim.pause()
+	# diagnostics are shared by every path and skipped while the state is unchanged, so only filling is timed
+	sim.set_telemetry()
+	seq, frame, mask = sim.read_frame()
+	raw_telem = make_telem_ref(sim.model)
+	ref = set_telemetry_ref(sim, raw_telem)
+	assert json.loads(ref) == json.loads(sim.read_telem())
+
+	print(f'{len(frame)} values per frame')
+	print(f'{"path":<30}{"us/frame":>10}{"bytes/frame":>13}')
+	print(f'{"reference fill + json":<30}{time_mean(set_telemetry_ref, sim, raw_telem)*1e6:>10.1f}{len(ref.encode()):>13}')
+	print(f'{"fill":<30}{time_mean(sim.set_telemetry)*1e6:>10.1f}{"-":>13}')
+	print(f'{"read frame":<30}{time_mean(sim.read_frame)*1e6:>10.1f}{"-":>13}')
+	for label, dtype, encoding in [('json', 'float32', 'json'), ('binary float64', 'float64', 'binary'),
+			('binary float32', 'float32', 'binary')]:
+		sim.telem_dtype = dtype
+		message = sim.encode_telem(seq, frame, mask, encoding)
+		print(f'{f"encode {label}":<30}{time_mean(sim.encode_telem, seq, frame, mask, encoding)*1e6:>10.1f}'
+			f'{len(message.encode() if isinstance(message, str) else message):>13}')
+	binary = np.frombuffer(message[16:], dtype='<f4')
+	print(f'float32 max rel error {np.max(np.abs(binary - frame)/np.maximum(np.abs(frame), 1e-30)):.1e}')
+
+	# per subscription, diagnostics pass included, the json and binary float32 frame of those channels only
+	print(f'\n{"channels":<30}{"us/frame":>10}{"json bytes":>12}{"binary bytes":>14}')
+	for channels in [telem_channels, ['pose'], ['pose', 'propulsor'], ['hull'], ['panels']]:
+		channel_mask = get_channel_mask(channels)
+		tok = time_mean(set_telemetry_fresh, sim, channel_mask, repeats=500)
+		json_bytes = len(sim.read_telem('json', channel_mask).encode())
+		print(f'{", ".join(channels) if channels != telem_channels else "all":<30}{tok*1e6:>10.1f}{json_bytes:>12}'
+			f'{len(sim.read_telem("binary", channel_mask)):>14}')
+
+if __name__ == '__main__': main()
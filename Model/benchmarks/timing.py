@@ -0,0 +1,22 @@
+import numpy as np
+import time
+
+# shared timers for the benchmarks, each warms the function up once (numba compile, caches) before timing
+
+def time_run(fun, *args, repeats=5):
+	# best of repeats, s
+	fun(*args)
+	best = np.inf
+	for _ in range(repeats):
+		tik = time.perf_counter()
+		fun(*args)
+		best = min(best, time.perf_counter() - tik)
+	return best
+
+def time_mean(fun, *args, repeats=2000):
+	# mean over repeats, s, for calls too short to time one at a time
+	fun(*args)
+	tik = time.perf_counter()
+	for _ in range(repeats):
+		fun(*args)
+	return (time.perf_counter() - tik)/repeats
@@ -1,5 +1,4 @@
 import numpy as np
-from scipy.optimize import root_scalar
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
@@ -7,42 +6,42 @@ if TYPE_CHECKING:
 from utils.utils import *
 
 class Hull:
-	def __init__(self, model: 'Model_6DoF', vol_area_data, hull_aero_coeffs, surf_aero_coeffs):
+	def __init__(self, model: 'Model_6DoF', vol_area_data, i_aero, i_aero_surf):
 		self.model = model
 		
 		self.vol_area_data = vol_area_data
-		self.hull_aero_coeffs = hull_aero_coeffs
-		self.surf_aero_coeffs = surf_aero_coeffs
+		self.i_aero = i_aero
+		self.i_aero_surf = i_aero_surf
 
 		self.area_surf = self.model.get_const('A_surf',True)
 		self.r_surf = self.model.get_const('r_surf_kt') - self.model.r_CM
 
+		# waterline solve, reused from the model's loaded data when the mass properties match
+		waterline_key = (float(self.model.m), float(self.model.rho), *map(float, self.model.r_CM))
+		waterline = self.model.loaded.get('waterline')
+		if waterline is not None and tuple(waterline[0]) == waterline_key:
+			self.z0, self.area0 = waterline[1]
+			return
+		from scipy.optimize import root_scalar
 		disp0 = self.model.m / self.model.rho
 		sol = root_scalar(lambda z: query_volume_area(self.vol_area_data, np.array([z,0,0]), self.model.r_CM)[0] - disp0, bracket=[0,0.2], method='brentq')
 		if sol.converged:
 			self.z0 = sol.root
 			self.area0 = query_volume_area(self.vol_area_data, np.array([self.z0,0,0]), self.model.r_CM)[1]
+			self.model.loaded['waterline'] = (waterline_key, (float(self.z0), float(self.area0)))
 		else:
 			raise Exception(f'initial waterline failed to converge - {sol.flag}')
 	
 	def calc_force_moments(self):
-		(self.vol, self.area, self.vol_center, self.area_center) = calc_volume_area(self.vol_area_data, self.model.query, self.model.r_CM)
+		(self.vol, self.area, self.vol_center, 
+   			self.area_center) = split_volume_area(self.model.vol_area[block_hull], self.model.r_CM)
 		# buoyant force moment
 		self.F_b, self.M_b = calc_buoyancy(self.vol, self.model.rho, self.model.g, self.model.Cb0, self.vol_center)
 		# hull lift & drag force moment
 		(self.U_mag, self.alpha, self.beta, 
    			_, self.Cbw, self.L_h, self.D_h, self.F_h, self.M_h) = calc_lift_drag(self.model.U, self.model.omega, self.area_center,
-																eye3,eye3, self.hull_aero_coeffs, self.model.rho, self.area)
+																eye3,eye3, self.model.aero_bank, self.i_aero, self.model.rho, self.area)
 		# surfaced lift & drag force moment
 		(self.U_mag_surf, self.alpha_surf, self.beta_surf, _, self.Cbw_surf, 
    			self.L_surf, self.D_surf, self.F_surf, self.M_surf) = calc_lift_drag(self.model.U, self.model.omega, self.r_surf,
-																eye3,eye3, self.surf_aero_coeffs, self.model.rho_surf, self.area_surf)
-
-@njit(cache=True)
-def calc_volume_area(vol_area, query, r_CM):
-	mod_query = query.copy()
-	mod_query[2] = abs(query[2])
-	(vol, area, vol_center, area_center) = query_volume_area(vol_area, mod_query, r_CM)
-	vol_center[1] = vol_center[1]*np.copysign(1, query[2])
-	area_center[1] = area_center[1]*np.copysign(1, query[2])
-	return vol, area, vol_center, area_center
\ No newline at end of file
+																eye3,eye3, self.model.aero_bank, self.i_aero_surf, self.model.rho_surf, self.area_surf)
\ No newline at end of file
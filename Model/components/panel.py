@@ -6,7 +6,7 @@ if TYPE_CHECKING:
 from utils.utils import *
 
 class Panel:
-	def __init__(self, model: 'Model_6DoF', id, r_list, aero_coeffs, rear):
+	def __init__(self, model: 'Model_6DoF', id, r_list, i_aero, rear):
 		self.model = model
 		self.id = id
 		self.r_LE_1 = r_list[0]
@@ -14,7 +14,7 @@ class Panel:
 		self.r_TE_1 = r_list[2]
 		self.r_TE_2 = r_list[3]
 
-		self.aero_coeffs = aero_coeffs
+		self.i_aero = i_aero
 		self.rear = rear
 
 		self.r_qc_1 = 3/4 * self.r_LE_1 + 1/4 * self.r_TE_1
@@ -44,12 +44,12 @@ class Panel:
 														 self.s, self.model.C0b)
 		(self.U_mag, self.alpha, self.beta, 
    			self.Cbw, self.Cfw, self.L, self.D, self.F, self.M) = calc_lift_drag(self.model.U, self.model.omega, self.r_qc_fC_body,
-																self.Cfb, self.Cbf, self.aero_coeffs, self.model.rho, self.A)
+																self.Cfb, self.Cbf, self.model.aero_bank, self.i_aero, self.model.rho, self.A)
 
 @njit(cache=True)
 def calc_rot_mats(rear, Cf_ref, Cra_b):
 	if rear:
-		Cf_ref = Cf_ref @ Cra_b
+		Cf_ref = matmul(Cf_ref, Cra_b)
 	Cref_f = np.transpose(Cf_ref)
 	return Cf_ref, Cref_f
 
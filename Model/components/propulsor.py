@@ -6,14 +6,14 @@ if TYPE_CHECKING:
 from utils.utils import *
 
 class Propulsor:
-	def __init__(self, model: 'Model_6DoF', prop_data):
+	def __init__(self, model: 'Model_6DoF', prop_data, thrust_torque_coeffs=None, fourier_coeffs=None):
 		self.model = model
 
 		self.d = self.model.get_const('d')
 
 		self.eta_T = self.model.get_const('eta_T',True)
 		self.eta_T_surf = self.model.get_const('eta_T_surf',True)
-		
+
 		self.w_fs = self.model.get_const('w_fs',True)
 		self.w_f = self.model.get_const('w_f',True)
 
@@ -21,36 +21,231 @@ class Propulsor:
 		self.r_d_1 = self.r_prop - self.d/2*zHat
 		self.r_d_2 = self.r_prop + self.d/2*zHat
 
+		# motor
+		self.R_m = self.model.get_const('R_m',True)
+		self.L_m = self.model.get_const('L_m',True)
+		self.Kt = self.model.get_const('Kt',True)
+		self.Ke = 60/(2*np.pi*self.model.get_const('KV',True))
+		self.J_m = self.model.get_const('J_m',True)
+		self.b = self.Kt*self.model.get_const('I_nl',True)/self.model.get_const('W_nl',True)
+		self.motor = (float(self.R_m), float(self.L_m), float(self.Ke), float(self.Kt), float(self.J_m), float(self.b))
+
 		self.prop_data = prop_data
+		# motor current and shaft speed become states when thrust torque coefficients are given
+		self.thrust_torque_coeffs = thrust_torque_coeffs
+		self.dynamic = thrust_torque_coeffs is not None
+		# otherwise the equilibrium comes from prop_data, or is solved directly from the fourier series when given
+		self.fourier_coeffs = fourier_coeffs
+		self.direct = fourier_coeffs is not None and not self.dynamic
+
+		# whether the direct equilibrium solve converged, tables and states always are
+		self.converged = True
+
+		# default states
+		self.I = 0.0
+		self.omega_p = 0.0
+		self.I_dot = 0.0
+		self.omega_p_dot = 0.0
 
 		# default inputs
 		self.V = 0
 
+	def get_state(self):
+		return np.array([self.I, self.omega_p]) if self.dynamic else np.empty(0)
+	def get_state_dot(self):
+		return np.array([self.I_dot, self.omega_p_dot]) if self.dynamic else np.empty(0)
+	def set_state(self, state):
+		if self.dynamic:
+			self.I = state[0]
+			self.omega_p = state[1]
+
 	def get_input(self):
 		return self.V
 	def set_input(self, input):
 		self.V = input
 
 	def calc_force_moments(self):
-		_, U_p, _,_, self.Cra_w = stab_frame(self.model.U, self.model.omega, 
+		_, U_p, _,_, self.Cra_w = stab_frame(self.model.U, self.model.omega,
 									   ra_to_body(self.r_prop, self.model.Cb_ra, self.model.r_ra), self.model.Cra_b)
 		u_p = U_p[0]
 		self.w = self.w_f + (self.w_fs + self.w_f)*self.model.hull.area/self.model.hull.area0
 		self.vA = u_p*(1-self.w)
 		z_d_2_world = ra_to_world(self.r_d_2, self.model.C0_ra, self.model.r_ra_world)[2]
 		z_d_1_world = ra_to_world(self.r_d_1, self.model.C0_ra, self.model.r_ra_world)[2]
-		(self.fp, self.n, self.T, self.Q, self.I, self.F, self.M) = calc_force_moment(z_d_2_world, z_d_1_world,
-												  self.model.rho_surf, self.model.rho, self.vA, self.V, self.prop_data, 
+		if self.dynamic:
+			(self.fp, self.n, self.T, self.Q, self.F, self.M) = calc_force_moment_dynamic(z_d_2_world, z_d_1_world,
+												  self.model.rho_surf, self.model.rho, self.vA, self.omega_p, self.d,
+												  self.thrust_torque_coeffs, self.eta_T, self.eta_T_surf, self.model.Cb_ra, self.r_prop)
+			self.I_dot, self.omega_p_dot = calc_motor_dot(self.I, self.omega_p, self.V, self.Q, self.motor)
+		elif self.direct:
+			(self.fp, self.n, self.T, self.Q, self.I, self.F, self.M, self.converged) = calc_force_moment_direct(z_d_2_world, z_d_1_world,
+												  self.model.rho_surf, self.model.rho, self.vA, self.V, self.d,
+												  self.fourier_coeffs, self.motor, self.eta_T, self.eta_T_surf, self.model.Cb_ra, self.r_prop)
+		else:
+			(self.fp, self.n, self.T, self.Q, self.I, self.F, self.M) = calc_force_moment(z_d_2_world, z_d_1_world,
+												  self.model.rho_surf, self.model.rho, self.vA, self.V, self.prop_data,
 												  self.eta_T, self.eta_T_surf, self.model.Cb_ra, self.r_prop)
 
 @njit(cache=True)
-def calc_force_moment(z_d_2_world, z_d_1_world, rho_surf,rho, vA,V, prop_data,eta_T,eta_T_surf, Cb_ra, r_prop_body):
+def calc_immersion(z_d_2_world, z_d_1_world, rho_surf,rho, eta_T,eta_T_surf):
 	fp = z_d_2_world / (z_d_2_world - z_d_1_world)
 	fp = clip(fp, 0, 1)
 	rho = rho_surf + (rho - rho_surf)*fp
 	eta_T = eta_T_surf + (eta_T - eta_T_surf)*fp
+	return fp, rho, eta_T
+
+@njit(cache=True)
+def calc_force_moment(z_d_2_world, z_d_1_world, rho_surf,rho, vA,V, prop_data,eta_T,eta_T_surf, Cb_ra, r_prop_body):
+	fp, rho, eta_T = calc_immersion(z_d_2_world, z_d_1_world, rho_surf, rho, eta_T, eta_T_surf)
+
+	n,T,Q,I = interp_grid(prop_data, np.array([rho, vA, V]))
+	F = matvec(Cb_ra, np.array([eta_T*T, 0.0, 0.0]))
+	M = cross(r_prop_body, F)
+	return fp, n, T, Q, I, F, M
+
+@njit(cache=True)
+def calc_force_moment_dynamic(z_d_2_world, z_d_1_world, rho_surf,rho, vA,omega_p,d, thrust_torque_coeffs,
+							  eta_T,eta_T_surf, Cb_ra, r_prop_body):
+	fp, rho, eta_T = calc_immersion(z_d_2_world, z_d_1_world, rho_surf, rho, eta_T, eta_T_surf)
+
+	n = omega_p/(2*pi)
+	T, Q = calc_thrust_torque(n, rho, vA, d, thrust_torque_coeffs)
+	F = matvec(Cb_ra, np.array([eta_T*T, 0.0, 0.0]))
+	M = cross(r_prop_body, F)
+	return fp, n, T, Q, F, M
+
+@njit(cache=True)
+def calc_force_moment_direct(z_d_2_world, z_d_1_world, rho_surf,rho, vA,V,d, fourier_coeffs, motor,
+							 eta_T,eta_T_surf, Cb_ra, r_prop_body):
+	fp, rho, eta_T = calc_immersion(z_d_2_world, z_d_1_world, rho_surf, rho, eta_T, eta_T_surf)
 
-	n,T,Q,I = trilinear_interp(prop_data, np.array([rho, vA, V]))
-	F = Cb_ra @ np.array([eta_T*T, 0, 0])
+	n, T, Q, I, converged = solve_motor_equilibrium(V, rho, vA, d, fourier_coeffs, motor)
+	F = matvec(Cb_ra, np.array([eta_T*T, 0.0, 0.0]))
 	M = cross(r_prop_body, F)
-	return fp, n, T, Q, I, F, M
\ No newline at end of file
+	return fp, n, T, Q, I, F, M, converged
+
+@njit(cache=True)
+def calc_4_quad_coeffs(beta, fourier_coeffs):
+	# C_T^*, C_Q^* and their slopes wrt beta, harmonics by angle addition (one sin cos pair per call)
+	cos_b = cos(beta)
+	sin_b = sin(beta)
+	c = 1.0
+	s = 0.0
+	CT = CQ = dCT = dCQ = 0.0
+	for k in range(fourier_coeffs.shape[0]):
+		A_T, B_T, A_Q, B_Q = fourier_coeffs[k,0], fourier_coeffs[k,1], fourier_coeffs[k,2], fourier_coeffs[k,3]
+		CT += A_T*c + B_T*s
+		CQ += A_Q*c + B_Q*s
+		dCT += k*(B_T*c - A_T*s)
+		dCQ += k*(B_Q*c - A_Q*s)
+		c, s = c*cos_b - s*sin_b, s*cos_b + c*sin_b
+	return CT, CQ, dCT, dCQ
+
+@njit(cache=True)
+def calc_thrust_torque_direct(n, rho, vA, d, fourier_coeffs):
+	# calc_thrust_torque from the fourier series, plus dQ/dn
+	vRot = 0.7*pi*n*d
+	vR2 = vRot**2 + vA**2
+	beta = atan2(vA, vRot+1e-6)
+	CT, CQ, _, dCQ = calc_4_quad_coeffs(beta, fourier_coeffs)
+	dvRot = 0.7*pi*d
+	dbeta = -vA/((vRot+1e-6)**2 + vA**2)*dvRot
+	T = 1/2*CT*rho*(pi/4*d**2)*vR2
+	Q = 1/2*CQ*rho*(pi/4*d**3)*vR2
+	dQ = 1/2*rho*(pi/4*d**3)*(dCQ*dbeta*vR2 + CQ*2*vRot*dvRot)
+	return T, Q, dQ
+
+@njit(cache=True)
+def solve_motor_equilibrium(V, rho, vA, d, fourier_coeffs, motor, tol=1e-9, max_iter=16):
+	# steady state of calc_motor_dot (I_dot = omega_p_dot = 0), the quasi static limit of the dynamic propulsor
+	#	residual Kt*I - b*omega_p - Q falls with omega_p, newton from the no load speed, bisection once a step leaves
+	#	the bracket seen so far, after max_iter torque evaluations a finite bracket is bisected down to tol (64 halvings
+	#	cover any double width), an unbracketed root stops there unconverged
+	#	returns (n, T, Q, I, converged), T and Q evaluated at the returned speed
+	R, L, Ke, Kt, J, b = motor
+	omega_p = V/Ke
+	lo = -np.inf
+	hi = np.inf
+	converged = False
+	for i in range(max_iter + 64):
+		T, Q, dQ = calc_thrust_torque_direct(omega_p/(2*pi), rho, vA, d, fourier_coeffs)
+		f = Kt*(V - Ke*omega_p)/R - b*omega_p - Q
+		if f > 0:
+			lo = omega_p
+		else:
+			hi = omega_p
+		step = max(1.0, abs(omega_p))
+		if abs(f) <= tol*(Kt*abs(V)/R + abs(Q) + 1) or hi - lo <= tol*step:
+			converged = True
+			break
+		bracketed = lo > -np.inf and hi < np.inf
+		if i >= max_iter - 1:
+			if not bracketed:
+				break
+			omega_p = (lo + hi)/2
+			continue
+		df = -Kt*Ke/R - b - dQ/(2*pi)
+		omega_next = omega_p - f/df if df < 0 else omega_p + (step if f > 0 else -step)
+		if not lo < omega_next < hi:
+			if bracketed:
+				omega_next = (lo + hi)/2
+			else:
+				omega_next = lo + step if hi == np.inf else hi - step
+		omega_p = omega_next
+	I = (V - Ke*omega_p)/R
+	return omega_p/(2*pi), T, Q, I, converged
+
+@njit(cache=True)
+def calc_thrust_torque(n, rho, vA, d, thrust_torque_coeffs):
+	# four quadrant propeller, same convention as params/gen_propulsor_data.py
+	vRot = 0.7*pi*n*d
+	vR2 = vRot**2 + vA**2
+	beta = atan2(vA, vRot+1e-6)
+	CT, CQ = query_periodic_1D(thrust_torque_coeffs, beta)
+	T = 1/2*CT*rho*(pi/4*d**2)*vR2
+	Q = 1/2*CQ*rho*(pi/4*d**3)*vR2
+	return T, Q
+
+@njit(cache=True)
+def calc_motor_dot(I, omega_p, V, Q, motor):
+	R, L, Ke, Kt, J, b = motor
+	I_dot = (V - R*I - Ke*omega_p)/L
+	omega_p_dot = (Kt*I - b*omega_p - Q)/J
+	return I_dot, omega_p_dot
+
+@njit(cache=True)
+def step_motor(I, omega_p, V, rho, vA, d, thrust_torque_coeffs, motor, h, n_steps):
+	# motor with the vehicle frozen (rho, vA held), 2 stage L-stable Rosenbrock (Verwer ROS2)
+	#	the electrical pole sits near -R/L, so an explicit step would be bound by it
+	R, L, Ke, Kt, J, b = motor
+	gamma = 1 + 1/sqrt(2)
+	for _ in range(n_steps):
+		# load torque slope by finite differences, the rest of the jacobian is linear
+		d_omega = 1e-6*max(1.0, abs(omega_p))
+		Q = calc_thrust_torque(omega_p/(2*pi), rho, vA, d, thrust_torque_coeffs)[1]
+		Q_p = calc_thrust_torque((omega_p + d_omega)/(2*pi), rho, vA, d, thrust_torque_coeffs)[1]
+		dQ = (Q_p - Q)/d_omega
+
+		# W = I - gamma*h*jac, solved in closed form
+		w11 = 1 + gamma*h*R/L
+		w12 = gamma*h*Ke/L
+		w21 = -gamma*h*Kt/J
+		w22 = 1 + gamma*h*(b + dQ)/J
+		det = w11*w22 - w12*w21
+
+		f1, f2 = calc_motor_dot(I, omega_p, V, Q, motor)
+		k11 = (w22*f1 - w12*f2)/det
+		k12 = (w11*f2 - w21*f1)/det
+
+		I_1 = I + h*k11
+		omega_p_1 = omega_p + h*k12
+		Q_1 = calc_thrust_torque(omega_p_1/(2*pi), rho, vA, d, thrust_torque_coeffs)[1]
+		f1, f2 = calc_motor_dot(I_1, omega_p_1, V, Q_1, motor)
+		f1 -= 2*k11
+		f2 -= 2*k12
+		k21 = (w22*f1 - w12*f2)/det
+		k22 = (w11*f2 - w21*f1)/det
+
+		I += h*(3/2*k11 + 1/2*k21)
+		omega_p += h*(3/2*k12 + 1/2*k22)
+	return I, omega_p
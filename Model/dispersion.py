@@ -0,0 +1,329 @@
+import numpy as np
+import os
+import sys
+import time
+import contextlib
+import warnings
+import multiprocessing as mp
+
+from model_RBird import Model_6DoF
+import model_RBird
+import integrators
+from trim import load_trim_table
+from linearize import state_names
+from utils.param_utils import hash_files, is_fourier_propulsor
+from utils.artifact_utils import load_artifact
+from utils.cli_utils import get_arg
+
+# 1 sigma normal dispersions of model_constants.txt entries
+#	scalars: relative, value*(1 + sigma*N)
+#	vectors (r_ keys): absolute per component (m)
+default_constant_sigmas = {
+	'm': 0.03,
+	'Ixx': 0.1,
+	'Iyy': 0.1,
+	'Izz': 0.1,
+	'r_CM_kt': 0.01,
+	'eta_T': 0.03,
+	'w_f': 0.2,
+	'w_fs': 0.2,
+	'rho': 0.005,
+}
+# 1 sigma relative scale factors of coefficient table columns
+#	CL, CD: every aerodynamic coefficient table, CT, CQ: propeller thrust torque coefficients (dynamic propulsor)
+default_coeff_sigmas = {
+	'CL': 0.05,
+	'CD': 0.1,
+	'CT': 0.05,
+	'CQ': 0.05,
+}
+
+dispersion_cache_root = 'cache/dispersion/'
+
+# run status, on top of the integrator status (0 completed, 1 left the check_state envelope, -1 non-finite)
+status_build_failed = -2
+
+class Scenario:
+	def __init__(self, t_end, input0, dt=0.05, controller=None, state0=None):
+		# open loop at input0 unless a controller is given
+		#	controller: picklable callable (t, state, input) -> input, evaluated every dt
+		#	state0: initial state, trim for input0 (or rest at the waterline) when None
+		self.t_end = t_end
+		self.input0 = np.asarray(input0, dtype=np.float64)
+		self.dt = dt
+		self.controller = controller
+		self.state0 = state0
+		self.n_out = int(round(t_end/dt))
+
+	def get_input(self, t, state, input):
+		if self.controller is None:
+			return input
+		return np.asarray(self.controller(t, state, input), dtype=np.float64)
+
+class HeadingHold:
+	# proportional-derivative rudder on heading error at a fixed voltage
+	def __init__(self, psi_ref, V, k_p=0.5, k_d=0.3, psi_ra_max=15/180*np.pi):
+		self.psi_ref = psi_ref
+		self.V = V
+		self.k_p = k_p
+		self.k_d = k_d
+		self.psi_ra_max = psi_ra_max
+
+	def __call__(self, t, state, input):
+		error = (state[8] - self.psi_ref + np.pi) % (2*np.pi) - np.pi
+		psi_ra = np.clip(self.k_p*error + self.k_d*state[5], -self.psi_ra_max, self.psi_ra_max)
+		return np.array([psi_ra, self.V])
+
+def sample_dispersion(rng, constants, constant_sigmas, coeff_sigmas):
+	# returns (constant overrides, coefficient scale factors)
+	overrides = {}
+	for key, sigma in constant_sigmas.items():
+		if key.startswith('r_'):
+			overrides[key] = constants[key] + sigma*rng.standard_normal(3)
+		else:
+			overrides[key] = constants[key]*(1 + sigma*rng.standard_normal())
+	scales = {key: 1 + sigma*rng.standard_normal() for key, sigma in coeff_sigmas.items()}
+	return overrides, scales
+
+def scale_coeffs(loaded, paths, scales):
+	# scaled copies of the coefficient tables, every other entry (hull, wing root and propulsor grids) stays shared
+	path_aero_coeffs_root, path_propulsor, path_thrust_torque_coeffs = paths[3], paths[4], paths[5]
+	loaded = dict(loaded)
+	for path, entry in loaded.items():
+		if path == path_propulsor and is_fourier_propulsor(path):
+			# harmonics (T-A, T-B, Q-A, Q-B)
+			loaded[path] = entry*np.repeat([scales.get('CT', 1.0), scales.get('CQ', 1.0)], 2)
+			continue
+		if path.startswith(path_aero_coeffs_root):
+			column_scales = (scales.get('CL', 1.0), scales.get('CD', 1.0))
+		elif path == path_thrust_torque_coeffs:
+			column_scales = (scales.get('CT', 1.0), scales.get('CQ', 1.0))
+		else:
+			continue
+		data, meta = entry
+		data = data.copy()
+		data[:,1:3] *= column_scales
+		loaded[path] = (data, meta)
+	return loaded
+
+def build_model(paths, loaded, overrides, scales):
+	# quiet, None when the dispersed constants are rejected
+	with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+		try:
+			return Model_6DoF(*paths, constant_overrides=overrides, loaded=scale_coeffs(loaded, paths, scales))
+		except (Exception, SystemExit):
+			return None
+
+def run_scenario(model: Model_6DoF, scenario: Scenario, state0):
+	# trajectory at every scenario dt, nan after a failure
+	#	returns (trajectory[n_out+1,n_states], status, failure time, last state)
+	dynamic = model.propulsor.dynamic
+	h = 0.005 if dynamic else 0.002
+	n_steps = max(1, int(round(scenario.dt/h)))
+	h = scenario.dt/n_steps
+
+	traj_out = np.full((scenario.n_out+1, model.n_states), np.nan)
+	traj_out[0] = state0
+	state = np.ascontiguousarray(state0, dtype=np.float64)
+	input = scenario.input0.copy()
+	for i in range(scenario.n_out):
+		input = scenario.get_input(i*scenario.dt, state, input)
+		if dynamic:
+			traj, status = integrators.integrate_imex(state, input, model.packed, h, n_steps, 2)
+		else:
+			traj, status = integrators.integrate_rk4(state, input, model.packed, h, n_steps)
+		if status != 0:
+			return traj_out, status, (i*n_steps + len(traj) - 1)*h, traj[-1]
+		state = traj[-1]
+		traj_out[i+1] = state
+	return traj_out, 0, np.nan, state
+
+# worker processes share the parsed files of the nominal model, inherited on fork (pickled once per worker on spawn)
+worker_args = None
+
+def init_worker(paths, loaded, artifact_path, scenario, state0):
+	# the model artifact is mapped again in each worker instead of pickled, its pages stay shared
+	global worker_args
+	if artifact_path is not None:
+		artifact = load_artifact(artifact_path)
+		loaded = {} if artifact is None else artifact[0]
+	worker_args = (paths, loaded, scenario, state0)
+
+def run_samples(samples):
+	paths, loaded, scenario, state0 = worker_args
+	n_states = len(state0)
+	trajs = np.full((len(samples), scenario.n_out+1, n_states), np.nan)
+	statuses = np.zeros(len(samples), dtype=np.int64)
+	t_fails = np.full(len(samples), np.nan)
+	final_states = np.full((len(samples), n_states), np.nan)
+	for k, (overrides, scales) in enumerate(samples):
+		model = build_model(paths, loaded, overrides, scales)
+		if model is None:
+			statuses[k] = status_build_failed
+			continue
+		trajs[k], statuses[k], t_fails[k], final_states[k] = run_scenario(model, scenario, state0)
+	return trajs, statuses, t_fails, final_states
+
+class DispersionStats:
+	# streaming statistics over runs, per output time and state
+	#	mean and variance (Welford, merged per chunk), min/max and survival exactly over every run
+	#	percentiles from a uniform reservoir of n_reservoir trajectories
+	def __init__(self, t, n_states, n_reservoir=256, seed=0):
+		self.t = t
+		self.n_runs = 0
+		self.count = np.zeros(len(t), dtype=np.int64)
+		self.mean = np.zeros((len(t), n_states))
+		self.M2 = np.zeros((len(t), n_states))
+		self.min = np.full((len(t), n_states), np.inf)
+		self.max = np.full((len(t), n_states), -np.inf)
+		self.statuses = {}
+		self.causes = {}
+		self.t_fails = []
+		self.reservoir = np.full((n_reservoir, len(t), n_states), np.nan)
+		self.n_reservoir = 0
+		self.rng = np.random.default_rng(seed)
+
+	def update(self, trajs, statuses, t_fails, final_states):
+		valid = np.isfinite(trajs[...,0])
+		count_b = valid.sum(axis=0)
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore', RuntimeWarning)
+			mean_b = np.nanmean(trajs, axis=0)
+		mean_b = np.where(count_b[:,None] > 0, mean_b, 0.0)
+		M2_b = np.nansum((trajs - mean_b)**2, axis=0)
+		count = self.count + count_b
+		frac = np.divide(count_b, count, out=np.zeros(len(count)), where=count > 0)[:,None]
+		delta = mean_b - self.mean
+		self.mean += delta*frac
+		self.M2 += M2_b + delta**2*(self.count[:,None]*frac)
+		self.count = count
+		self.min = np.fmin(self.min, np.min(np.where(valid[...,None], trajs, np.inf), axis=0))
+		self.max = np.fmax(self.max, np.max(np.where(valid[...,None], trajs, -np.inf), axis=0))
+
+		for traj, status, t_fail, state in zip(trajs, statuses, t_fails, final_states):
+			self.statuses[int(status)] = self.statuses.get(int(status), 0) + 1
+			if status == 1:
+				self.t_fails.append(t_fail)
+				for i, limit in zip(integrators.envelope_index, integrators.envelope_limit):
+					if not abs(state[i]) < limit:
+						self.causes[state_names[i]] = self.causes.get(state_names[i], 0) + 1
+			elif status != 0 and np.isfinite(t_fail):
+				self.t_fails.append(t_fail)
+			# reservoir sampling (algorithm R)
+			if self.n_runs < len(self.reservoir):
+				self.reservoir[self.n_runs] = traj
+				self.n_reservoir += 1
+			else:
+				j = self.rng.integers(0, self.n_runs+1)
+				if j < len(self.reservoir):
+					self.reservoir[j] = traj
+			self.n_runs += 1
+
+	def get_std(self):
+		return np.sqrt(np.divide(self.M2, self.count[:,None]-1, out=np.full(self.M2.shape, np.nan),
+						   where=self.count[:,None] > 1))
+
+	def get_percentiles(self, q=(5, 50, 95)):
+		# [len(q), n_t, n_states], over the surviving reservoir runs at each time
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore', RuntimeWarning)
+			return np.nanpercentile(self.reservoir[:self.n_reservoir], q, axis=0)
+
+	def get_survival(self):
+		return self.count/max(self.n_runs, 1)
+
+	def get_failure_rate(self):
+		return 1 - self.statuses.get(0, 0)/max(self.n_runs, 1)
+
+	def save(self, path, q=(5, 50, 95)):
+		directory = os.path.dirname(path)
+		if directory and not os.path.exists(directory):
+			os.makedirs(directory, exist_ok=True)
+		statuses = np.array(sorted(self.statuses.items()), dtype=np.int64).reshape(-1, 2)
+		causes = np.array(sorted(self.causes.items()), dtype=object).reshape(-1, 2)
+		np.savez(path, t=self.t, n_runs=self.n_runs, count=self.count, mean=self.mean, std=self.get_std(),
+			min=self.min, max=self.max, q=np.asarray(q), percentiles=self.get_percentiles(q), statuses=statuses,
+			cause_names=causes[:,0].astype(str), cause_counts=causes[:,1].astype(np.int64), t_fails=np.array(self.t_fails))
+
+def get_initial_state(model: Model_6DoF, scenario: Scenario):
+	if scenario.state0 is not None:
+		return np.asarray(scenario.state0, dtype=np.float64)
+	trim_table = load_trim_table(model)
+	if trim_table is not None:
+		return trim_table.get_state(scenario.input0[1], scenario.input0[0])
+	print(f'WARNING: no cached trim table, starting from rest at the waterline')
+	state0 = model.get_state()
+	state0[11] = model.hull.z0
+	return state0
+
+def run_dispersion(model: Model_6DoF, scenario: Scenario, n_runs, constant_sigmas=None, coeff_sigmas=None, workers=None,
+				   seed=0, chunk_size=16, n_reservoir=256):
+	# Monte Carlo over dispersed constants and coefficient scales, streaming results into DispersionStats
+	#	samples are drawn up front from per-run seeds, so results do not depend on the worker count
+	constant_sigmas = default_constant_sigmas if constant_sigmas is None else constant_sigmas
+	coeff_sigmas = default_coeff_sigmas if coeff_sigmas is None else coeff_sigmas
+	# only the dynamic (thrust torque table) and direct (fourier series) propulsors read the propeller coefficients
+	if not (model.propulsor.dynamic or model.propulsor.direct):
+		coeff_sigmas = {key: sigma for key, sigma in coeff_sigmas.items() if key not in ('CT', 'CQ')}
+	tik = time.perf_counter()
+	state0 = get_initial_state(model, scenario)
+	rngs = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(n_runs)]
+	samples = [sample_dispersion(rng, model.constants, constant_sigmas, coeff_sigmas) for rng in rngs]
+	chunks = [samples[i:i+chunk_size] for i in range(0, n_runs, chunk_size)]
+
+	stats = DispersionStats(np.arange(scenario.n_out+1)*scenario.dt, len(state0), n_reservoir, seed)
+	workers = min(workers or os.cpu_count() or 1, len(chunks))
+	init_args = (model.paths, model.loaded if model.artifact_path is None else None, model.artifact_path, scenario, state0)
+	if workers <= 1:
+		init_worker(*init_args)
+		for result in map(run_samples, chunks):
+			stats.update(*result)
+			print_progress(stats, n_runs, tik)
+	else:
+		with mp.Pool(workers, initializer=init_worker, initargs=init_args) as pool:
+			for result in pool.imap(run_samples, chunks):
+				stats.update(*result)
+				print_progress(stats, n_runs, tik)
+	print(f'\nINFO: {n_runs} dispersed runs with {workers} worker(s) in {time.perf_counter()-tik:.2f} s, '
+	   f'failure rate {100*stats.get_failure_rate():.1f}%')
+	return stats
+
+def print_progress(stats: DispersionStats, n_runs, tik):
+	print(f'\rINFO: {stats.n_runs}/{n_runs} runs, {100*stats.get_failure_rate():.1f}% failed, '
+	   f'{time.perf_counter()-tik:.1f} s', end='', flush=True)
+
+def dispersion_path(model: Model_6DoF, scenario: Scenario, n_runs, seed, cache_root=dispersion_cache_root):
+	key = hash_files(model.source_paths, model.n_states, scenario.t_end, scenario.dt, scenario.input0,
+				  type(scenario.controller).__name__, n_runs, seed)
+	return os.path.join(cache_root, f'dispersion_{key[:16]}.npz')
+
+def main():
+	dynamic_propulsor = '--dynamic' in sys.argv
+	n_runs = get_arg('n', 200)
+	workers = get_arg('workers', 0) or None
+	seed = get_arg('seed', 0)
+	model = model_RBird.make_default(dynamic_propulsor)
+	V = 0.6*model.V_max
+	controller = HeadingHold(0.0, V) if '--closed' in sys.argv else None
+	scenario = Scenario(get_arg('t_end', 10.0), [0.0, V], controller=controller)
+
+	stats = run_dispersion(model, scenario, n_runs, workers=workers, seed=seed)
+	path = dispersion_path(model, scenario, n_runs, seed)
+	try:
+		stats.save(path)
+		print(f'INFO: saved dispersion statistics "{path}"')
+	except Exception as e:
+		print(f'ERROR: failed to save dispersion statistics - {e}')
+
+	print(f'INFO: status counts {dict(sorted(stats.statuses.items()))}, envelope exits by state {stats.causes}')
+	if stats.t_fails:
+		print(f'INFO: failure time mean {np.mean(stats.t_fails):.2f} s, min {np.min(stats.t_fails):.2f} s')
+	percentiles = stats.get_percentiles()
+	std = stats.get_std()
+	print(f'INFO: final time envelope ({stats.count[-1]} surviving runs)')
+	print(f'{"state":>8}{"mean":>11}{"std":>11}{"p5":>11}{"p50":>11}{"p95":>11}{"min":>11}{"max":>11}')
+	for i in range(len(stats.mean[-1])):
+		print(f'{state_names[i]:>8}{stats.mean[-1,i]:>11.4g}{std[-1,i]:>11.4g}{percentiles[0,-1,i]:>11.4g}'
+		f'{percentiles[1,-1,i]:>11.4g}{percentiles[2,-1,i]:>11.4g}{stats.min[-1,i]:>11.4g}{stats.max[-1,i]:>11.4g}')
+
+if __name__ == '__main__': main()
@@ -0,0 +1,217 @@
+import numpy as np
+
+from utils.utils import *
+from kernel_RBird import calc_state_dot_fused, step_motor_fused
+
+# state envelope, |state[i]| < limit for every (index, limit)
+envelope_index = np.array([0, 1, 2, 3, 4, 5, 6, 7, 11])
+envelope_limit = np.array([
+	20,				# u
+	20,				# v
+	20,				# w
+	2*pi,			# p
+	2*pi,			# q
+	2*pi,			# r
+	60/180*pi,		# phi
+	45/180*pi,		# theta
+	3				# z
+])
+
+@njit(cache=True)
+def check_state(state):
+	for i in range(len(envelope_index)):
+		if not abs(state[envelope_index[i]]) < envelope_limit[i]:
+			return False
+	return True
+
+@njit(cache=True)
+def check_finite(state):
+	for x in state:
+		if not np.isfinite(x):
+			return False
+	return True
+
+# fixed step integrators return (trajectory[n_steps+1,n_states], status)
+#	status: 0 completed, 1 terminated by check_state, -1 non-finite state
+
+@njit(cache=True, nogil=True)
+def integrate_rk4(state0, input, packed, h, n_steps):
+	traj = np.empty((n_steps+1, len(state0)))
+	traj[0] = state0
+	state = state0.copy()
+	for i in range(n_steps):
+		k1 = calc_state_dot_fused(state, input, packed)
+		k2 = calc_state_dot_fused(state + h/2*k1, input, packed)
+		k3 = calc_state_dot_fused(state + h/2*k2, input, packed)
+		k4 = calc_state_dot_fused(state + h*k3, input, packed)
+		state = state + h/6*(k1 + 2*k2 + 2*k3 + k4)
+		traj[i+1] = state
+		if not check_finite(state):
+			return traj[:i+2], -1
+		if not check_state(state):
+			return traj[:i+2], 1
+	return traj, 0
+
+@njit(cache=True, nogil=True)
+def integrate_semi_implicit_euler(state0, input, packed, h, n_steps):
+	traj = np.empty((n_steps+1, len(state0)))
+	traj[0] = state0
+	state = state0.copy()
+	for i in range(n_steps):
+		state_dot = calc_state_dot_fused(state, input, packed)
+		Phi = state[6:9].copy()
+		# velocities (and motor states) first, attitude and position from the updated velocities
+		state[0:6] += h*state_dot[0:6]
+		state[12:] += h*state_dot[12:]
+		state[6:9] += h*matvec(calc_H(Phi), state[3:6])
+		state[9:12] += h*matvec(calc_base_rot_mats(Phi, 0.0, zero3, zero3)[1], state[0:3])
+		traj[i+1] = state
+		if not check_finite(state):
+			return traj[:i+2], -1
+		if not check_state(state):
+			return traj[:i+2], 1
+	return traj, 0
+
+@njit(cache=True, nogil=True)
+def integrate_imex(state0, input, packed, h, n_steps, n_motor_steps):
+	# multirate splitting for the dynamic propulsor (Strang): motor half step, rigid body step, motor half step
+	#	rigid body: explicit RK4 with the motor states frozen
+	#	motor: n_motor_steps L-stable Rosenbrock substeps per half step with the rigid body frozen
+	#	static propulsors reduce to plain RK4
+	n = len(state0)
+	dynamic = n > 12
+	traj = np.empty((n_steps+1, n))
+	traj[0] = state0
+	state = state0.copy()
+	for i in range(n_steps):
+		if dynamic:
+			step_motor_fused(state, input, packed, h/2, n_motor_steps)
+		k1 = calc_state_dot_fused(state, input, packed)
+		k1[12:] = 0.0
+		k2 = calc_state_dot_fused(state + h/2*k1, input, packed)
+		k2[12:] = 0.0
+		k3 = calc_state_dot_fused(state + h/2*k2, input, packed)
+		k3[12:] = 0.0
+		k4 = calc_state_dot_fused(state + h*k3, input, packed)
+		k4[12:] = 0.0
+		state = state + h/6*(k1 + 2*k2 + 2*k3 + k4)
+		if dynamic:
+			step_motor_fused(state, input, packed, h/2, n_motor_steps)
+		traj[i+1] = state
+		if not check_finite(state):
+			return traj[:i+2], -1
+		if not check_state(state):
+			return traj[:i+2], 1
+	return traj, 0
+
+# Dormand-Prince 5(4) tableau
+dp_a = np.array([
+	[0, 0, 0, 0, 0, 0],
+	[1/5, 0, 0, 0, 0, 0],
+	[3/40, 9/40, 0, 0, 0, 0],
+	[44/45, -56/15, 32/9, 0, 0, 0],
+	[19372/6561, -25360/2187, 64448/6561, -212/729, 0, 0],
+	[9017/3168, -355/33, 46732/5247, 49/176, -5103/18656, 0],
+	[35/384, 0, 500/1113, 125/192, -2187/6784, 11/84]
+])
+dp_e = np.array([71/57600, 0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40])
+
+dp_safety = 0.9
+dp_min_factor = 0.2
+dp_max_factor = 10.0
+
+@njit(cache=True)
+def error_norm(err, state, state_new, rtol, atol):
+	acc = 0.0
+	for i in range(len(err)):
+		scale = atol + rtol*max(abs(state[i]), abs(state_new[i]))
+		acc += (err[i]/scale)**2
+	return sqrt(acc/len(err))
+
+@njit(cache=True)
+def select_initial_step(state, state_dot, input, packed, t_span, rtol, atol):
+	# Hairer, Norsett & Wanner, Solving ODEs I, sec. II.4
+	scale = atol + np.abs(state)*rtol
+	d0 = sqrt(np.mean((state/scale)**2))
+	d1 = sqrt(np.mean((state_dot/scale)**2))
+	h0 = 1e-6 if d0 < 1e-5 or d1 < 1e-5 else 0.01*d0/d1
+	h0 = min(h0, t_span)
+	state_dot_1 = calc_state_dot_fused(state + h0*state_dot, input, packed)
+	d2 = sqrt(np.mean(((state_dot_1 - state_dot)/scale)**2))/h0
+	if d1 <= 1e-15 and d2 <= 1e-15:
+		h1 = max(1e-6, h0*1e-3)
+	else:
+		h1 = (0.01/max(d1, d2))**(1/5)
+	return min(100*h0, h1, t_span)
+
+@njit(cache=True, nogil=True)
+def integrate_dopri5(state0, state_dot0, input, packed, t_span, h, rtol, atol, max_steps):
+	# adaptive Dormand-Prince 5(4) with FSAL, landing exactly on t_span
+	#	state_dot0: derivative at state0 if known (FSAL carry-over), empty otherwise
+	#	h: step size to attempt first, <= 0 to select one
+	#	returns (t, trajectory, status, h_next, state_dot_last, n_accepted, n_rejected, nfev)
+	#	status: 0 completed, 1 terminated by check_state, -1 step size underflow or max steps exceeded
+	t_out = np.empty(max_steps+1)
+	n = len(state0)
+	traj = np.empty((max_steps+1, n))
+	t_out[0] = 0.0
+	traj[0] = state0
+
+	nfev = 0
+	if len(state_dot0) == n:
+		state_dot = state_dot0.copy()
+	else:
+		state_dot = calc_state_dot_fused(state0, input, packed)
+		nfev += 1
+	if h <= 0:
+		h = select_initial_step(state0, state_dot, input, packed, t_span, rtol, atol)
+		nfev += 1
+
+	K = np.empty((7, n))
+	state = state0.copy()
+	t = 0.0
+	n_accepted = 0
+	n_rejected = 0
+	while t < t_span:
+		if n_accepted >= max_steps:
+			return t_out[:n_accepted+1], traj[:n_accepted+1], -1, h, state_dot, n_accepted, n_rejected, nfev
+		h_min = 10*np.finfo(np.float64).eps*max(abs(t), 1.0)
+		if h < h_min:
+			return t_out[:n_accepted+1], traj[:n_accepted+1], -1, h, state_dot, n_accepted, n_rejected, nfev
+		h_step = min(h, t_span - t)
+
+		K[0] = state_dot
+		for s in range(1, 6):
+			dstate = np.zeros(n)
+			for j in range(s):
+				dstate += dp_a[s,j]*K[j]
+			K[s] = calc_state_dot_fused(state + h_step*dstate, input, packed)
+		dstate = np.zeros(n)
+		for j in range(6):
+			dstate += dp_a[6,j]*K[j]
+		state_new = state + h_step*dstate
+		K[6] = calc_state_dot_fused(state_new, input, packed)
+		nfev += 6
+
+		err = np.zeros(n)
+		for j in range(7):
+			err += dp_e[j]*K[j]
+		err_norm = error_norm(h_step*err, state, state_new, rtol, atol) if check_finite(state_new) else np.inf
+
+		if err_norm < 1:
+			factor = dp_max_factor if err_norm == 0 else min(dp_max_factor, dp_safety*err_norm**-0.2)
+			# keep the natural step size when the step was shortened to land on t_span
+			if h_step == h:
+				h *= factor
+			t = t + h_step if t_span - t > h_step else t_span
+			state = state_new
+			state_dot = K[6].copy()
+			n_accepted += 1
+			t_out[n_accepted] = t
+			traj[n_accepted] = state
+			if not check_state(state):
+				return t_out[:n_accepted+1], traj[:n_accepted+1], 1, h, state_dot, n_accepted, n_rejected, nfev
+		else:
+			h = h_step*max(dp_min_factor, dp_safety*err_norm**-0.2) if np.isfinite(err_norm) else h_step*dp_min_factor
+			n_rejected += 1
+	return t_out[:n_accepted+1], traj[:n_accepted+1], 0, h, state_dot, n_accepted, n_rejected, nfev
@@ -0,0 +1,317 @@
+import numpy as np
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+	from model_RBird import Model_6DoF
+from utils.utils import *
+from components.panel import calc_rot_mats, calc_submergence
+from components.propulsor import (calc_force_moment, calc_force_moment_dynamic, calc_force_moment_direct, calc_immersion,
+								  calc_motor_dot, step_motor)
+
+# packed layout (struct of arrays), built once per model
+#	body:		(m, g, rho, rho_surf, Ib, Ib_inv, r_CM, r_ra)
+#	panels:		(rear[n], r_qc_1[n,3], r_qc_2[n,3], c1[n], c2[n], s[n], Cf_ref[n,3,3], i_coeffs[n])
+#	aero:		(tables[k,l,2], alpha_min, period, inv_res, n_alpha), see make_aero_bank
+#	grids:		utils.interp_utils tables, see make_grid_table
+#	hull:		(hydrostatics, i_hull, i_surf, area_surf, r_surf, area0), hydrostatics holds the wing roots too
+#	wing_root:	(i_coeffs,)
+#	propulsor:	(prop_data, r_prop, r_d_1, r_d_2, eta_T, eta_T_surf, w_fs, w_f, dynamic, d, thrust_torque_coeffs, motor,
+#				 direct, fourier_coeffs[k,4])
+#	state:		12 rigid body states, plus motor current and shaft speed when the propulsor is dynamic
+
+def pack_model(model: 'Model_6DoF'):
+	body = (float(model.m), float(model.g), float(model.rho), float(model.rho_surf),
+		 np.ascontiguousarray(model.Ib, dtype=np.float64), np.ascontiguousarray(model.Ib_inv, dtype=np.float64),
+		 as_vec3(model.r_CM), as_vec3(model.r_ra))
+
+	panel_list = list(model.panels.values())
+	panels = (
+		np.array([panel.rear for panel in panel_list], dtype=np.bool_),
+		np.array([panel.r_qc_1 for panel in panel_list], dtype=np.float64),
+		np.array([panel.r_qc_2 for panel in panel_list], dtype=np.float64),
+		np.array([panel.c1 for panel in panel_list], dtype=np.float64),
+		np.array([panel.c2 for panel in panel_list], dtype=np.float64),
+		np.array([panel.s for panel in panel_list], dtype=np.float64),
+		np.array([panel.Cf_ref for panel in panel_list], dtype=np.float64),
+		np.array([panel.i_aero for panel in panel_list], dtype=np.int64)
+	)
+
+	h = model.hull
+	hull = (pack_grid(model.hydrostatics), int(h.i_aero), int(h.i_aero_surf),
+		 float(h.area_surf), as_vec3(h.r_surf), float(h.area0))
+
+	wr = model.wing_roots[0]
+	wing_root = (int(wr.i_aero),)
+
+	p = model.propulsor
+	propulsor = (pack_prop_data(p.prop_data), as_vec3(p.r_prop), as_vec3(p.r_d_1), as_vec3(p.r_d_2),
+			  float(p.eta_T), float(p.eta_T_surf), float(p.w_fs), float(p.w_f),
+			  bool(p.dynamic), float(p.d), pack_periodic_1D(p.thrust_torque_coeffs), p.motor,
+			  bool(p.direct), pack_fourier_coeffs(p.fourier_coeffs))
+
+	return body, panels, pack_aero_bank(model.aero_bank), hull, wing_root, propulsor
+
+def pack_aero_bank(aero_bank):
+	tables, alpha_min, period, inv_res, n_alpha = aero_bank
+	return np.ascontiguousarray(tables, dtype=np.float64), float(alpha_min), float(period), float(inv_res), int(n_alpha)
+
+def pack_periodic_1D(data):
+	# static propulsors get a placeholder so both modes share one numba signature
+	if data is None:
+		return np.zeros((2,3)), (2, 0.0, 1.0, 1.0, 0.5)
+	table, (length, input_min, input_max, period, res) = data
+	return np.ascontiguousarray(table, dtype=np.float64), (int(length), float(input_min), float(input_max), float(period), float(res))
+
+def pack_prop_data(table):
+	# direct propulsors have no equilibrium table, a zero grid keeps the numba signature
+	if table is None:
+		table = make_grid_table([np.array([0.0, 1.0])]*3, np.zeros((2,2,2,4)))
+	return pack_grid(table)
+
+def pack_fourier_coeffs(coeffs):
+	if coeffs is None:
+		return np.zeros((1,4))
+	return np.ascontiguousarray(coeffs, dtype=np.float64)
+
+def pack_grid(table):
+	# float32 values stay float32 (see cast_grid), numba specialises the lookups for them
+	values, lo, inv_res, shape, strides, corners, breaks, break_offsets, uniform, cubic = table
+	values_dtype = np.float32 if values.dtype == np.float32 else np.float64
+	return (np.ascontiguousarray(values, dtype=values_dtype), np.ascontiguousarray(lo, dtype=np.float64),
+		 np.ascontiguousarray(inv_res, dtype=np.float64), np.ascontiguousarray(shape, dtype=np.int64),
+		 np.ascontiguousarray(strides, dtype=np.int64), np.ascontiguousarray(corners, dtype=np.int64),
+		 np.ascontiguousarray(breaks, dtype=np.float64), np.ascontiguousarray(break_offsets, dtype=np.int64),
+		 np.ascontiguousarray(uniform, dtype=np.bool_), bool(cubic))
+
+def as_vec3(vec):
+	return np.ascontiguousarray(vec, dtype=np.float64).reshape(3)
+
+@njit(cache=True)
+def calc_force_moments_fused(state, input, packed):
+	body, panels, aero, hull, wing_root, propulsor = packed
+	m, g, rho, rho_surf, Ib, Ib_inv, r_CM, r_ra = body
+
+	U = state[0:3].copy()
+	omega = state[3:6].copy()
+	Phi = state[6:9].copy()
+	r = state[9:12].copy()
+	psi_ra = input[0]
+	V = input[1]
+
+	Cb0, C0b, Cb_ra, Cra_b, C0_ra, r_ra_world = calc_base_rot_mats(Phi, psi_ra, r_ra, r)
+	# hull and both wing roots in one lookup
+	hull_data, i_hull, i_surf, area_surf, r_surf, area0 = hull
+	vol_area = query_hydrostatics(hull_data, calc_base_query(C0b, r_CM, r, Phi))
+
+	F = np.zeros(3)
+	M = np.zeros(3)
+
+	# lifting surfaces: panels, wing roots, hull, surfaced, gathered for one coefficient bank lookup
+	rear, r_qc_1, r_qc_2, c1, c2, s, Cf_ref, i_coeffs = panels
+	n_panels = len(rear)
+	n_surfaces = n_panels + 4
+	r_frames = np.empty((n_surfaces, 3))
+	C_loc_bs = np.empty((n_surfaces, 3, 3))
+	Cb_locs = np.empty((n_surfaces, 3, 3))
+	i_aeros = np.empty(n_surfaces, dtype=np.int64)
+	rhos = np.full(n_surfaces, rho)
+	As = np.empty(n_surfaces)
+
+	# panels
+	for i in range(n_panels):
+		C_loc_bs[i], Cb_locs[i] = calc_rot_mats(rear[i], Cf_ref[i], Cra_b)
+		_, _, As[i], _, r_frames[i] = calc_submergence(rear[i], r_qc_1[i], r_qc_2[i], Cb_ra, C0_ra, r_ra, r_ra_world, r,
+												  c1[i], c2[i], s[i], C0b)
+		i_aeros[i] = i_coeffs[i]
+
+	# wing roots
+	for k, block in enumerate((block_wing_root_L, block_wing_root_R)):
+		vol, area, vol_center, area_center = split_volume_area(vol_area[block], r_CM)
+		F_b, M_b = calc_buoyancy(vol, rho, g, Cb0, vol_center)
+		F += F_b
+		M += M_b
+		i = n_panels + k
+		r_frames[i], C_loc_bs[i], Cb_locs[i], i_aeros[i], As[i] = area_center, eye3, eye3, wing_root[0], area
+
+	# hull
+	vol, area_h, vol_center, area_center = split_volume_area(vol_area[block_hull], r_CM)
+	F_b, M_b = calc_buoyancy(vol, rho, g, Cb0, vol_center)
+	F += F_b
+	M += M_b
+	i = n_panels + 2
+	r_frames[i], C_loc_bs[i], Cb_locs[i], i_aeros[i], As[i] = area_center, eye3, eye3, i_hull, area_h
+	r_frames[i+1], C_loc_bs[i+1], Cb_locs[i+1], i_aeros[i+1], As[i+1] = r_surf, eye3, eye3, i_surf, area_surf
+	rhos[i+1] = rho_surf
+
+	F_a, M_a = calc_lift_drag_batch(U, omega, r_frames, C_loc_bs, Cb_locs, aero, i_aeros, rhos, As)
+	F += F_a
+	M += M_a
+
+	# propulsor
+	vA, z_d_2_world, z_d_1_world = calc_inflow(U, omega, area_h, Cb_ra, Cra_b, C0_ra, r_ra, r_ra_world, hull, propulsor)
+	(prop_data, r_prop, _, _, eta_T, eta_T_surf, _, _, dynamic, d, thrust_torque_coeffs, motor,
+  		direct, fourier_coeffs) = propulsor
+	if dynamic:
+		_, _, _, Q, F_p, M_p = calc_force_moment_dynamic(z_d_2_world, z_d_1_world, rho_surf, rho, vA, state[13], d,
+													  thrust_torque_coeffs, eta_T, eta_T_surf, Cb_ra, r_prop)
+	elif direct:
+		_, _, _, Q, _, F_p, M_p, _ = calc_force_moment_direct(z_d_2_world, z_d_1_world, rho_surf, rho, vA, V, d,
+													 fourier_coeffs, motor, eta_T, eta_T_surf, Cb_ra, r_prop)
+	else:
+		_, _, _, Q, _, F_p, M_p = calc_force_moment(z_d_2_world, z_d_1_world, rho_surf, rho, vA, V, prop_data,
+											  eta_T, eta_T_surf, Cb_ra, r_prop)
+	F += F_p
+	M += M_p
+
+	return F, M, Cb0, C0b, Q
+
+@njit(cache=True)
+def calc_inflow(U, omega, area_h, Cb_ra, Cra_b, C0_ra, r_ra, r_ra_world, hull, propulsor):
+	_, r_prop, r_d_1, r_d_2, _, _, w_fs, w_f, _, _, _, _, _, _ = propulsor
+	_, U_p, _, _, _ = stab_frame(U, omega, ra_to_body(r_prop, Cb_ra, r_ra), Cra_b)
+	w = w_f + (w_fs + w_f)*area_h/hull[5]
+	vA = U_p[0]*(1-w)
+	z_d_2_world = ra_to_world(r_d_2, C0_ra, r_ra_world)[2]
+	z_d_1_world = ra_to_world(r_d_1, C0_ra, r_ra_world)[2]
+	return vA, z_d_2_world, z_d_1_world
+
+@njit(cache=True)
+def calc_propulsor_inflow(state, input, packed):
+	# propeller operating point (rho, vA) only, skips every force but the hull lookup
+	body, _, _, hull, _, propulsor = packed
+	m, g, rho, rho_surf, Ib, Ib_inv, r_CM, r_ra = body
+	Phi = state[6:9].copy()
+	r = state[9:12].copy()
+	Cb0, C0b, Cb_ra, Cra_b, C0_ra, r_ra_world = calc_base_rot_mats(Phi, input[0], r_ra, r)
+	area_h = split_volume_area(query_hydrostatics(hull[0], calc_base_query(C0b, r_CM, r, Phi))[block_hull], r_CM)[1]
+	vA, z_d_2_world, z_d_1_world = calc_inflow(state[0:3].copy(), state[3:6].copy(), area_h, Cb_ra, Cra_b, C0_ra,
+											 r_ra, r_ra_world, hull, propulsor)
+	_, rho_p, _ = calc_immersion(z_d_2_world, z_d_1_world, rho_surf, rho, 1.0, 1.0)
+	return rho_p, vA
+
+@njit(cache=True)
+def step_motor_fused(state, input, packed, h, n_steps):
+	# advances the motor states in place over h with the rigid body states frozen
+	rho_p, vA = calc_propulsor_inflow(state, input, packed)
+	_, _, _, _, _, _, _, _, _, d, thrust_torque_coeffs, motor, _, _ = packed[5]
+	state[12], state[13] = step_motor(state[12], state[13], input[1], rho_p, vA, d, thrust_torque_coeffs, motor,
+								   h/n_steps, n_steps)
+
+@njit(cache=True)
+def calc_state_dot_fused(state, input, packed):
+	m, g, rho, rho_surf, Ib, Ib_inv, r_CM, r_ra = packed[0]
+	F, M, Cb0, C0b, Q = calc_force_moments_fused(state, input, packed)
+	U_dot, omega_dot, Phi_dot, r_dot, _ = calc_state_dot(F,M, Cb0,C0b, m,g, Ib,Ib_inv, state[0:3], state[3:6], state[6:9])
+	state_dot = np.empty(len(state))
+	state_dot[0:3] = U_dot
+	state_dot[3:6] = omega_dot
+	state_dot[6:9] = Phi_dot
+	state_dot[9:12] = r_dot
+	_, _, _, _, _, _, _, _, dynamic, _, _, motor, _, _ = packed[5]
+	if dynamic:
+		state_dot[12], state_dot[13] = calc_motor_dot(state[12], state[13], input[1], Q, motor)
+	return state_dot
+
+jac_rel_step = 6e-6		# ~cbrt(machine epsilon), central differences
+jac_rel_step_fwd = 1.5e-8	# ~sqrt(machine epsilon), forward differences
+jac_fd_columns = np.array([0, 1, 2, 3, 4, 5, 6, 7, 11, 12, 13])
+
+@njit(cache=True, nogil=True)
+def calc_jacobian_fused(state, input, packed, central=True):
+	n = len(state)
+	jac = np.zeros((n,n))
+
+	# force/moment (and motor) rows by finite differences; x, y and psi never enter the forces
+	state_dot_0 = np.zeros(n) if central else calc_state_dot_fused(state, input, packed)
+	for j in jac_fd_columns[:n-3]:
+		state_p = state.copy()
+		if central:
+			h = jac_rel_step*max(1.0, abs(state[j]))
+			state_m = state.copy()
+			state_p[j] += h
+			state_m[j] -= h
+			state_dot_p = calc_state_dot_fused(state_p, input, packed)
+			state_dot_m = calc_state_dot_fused(state_m, input, packed)
+			jac[0:6,j] = (state_dot_p[0:6] - state_dot_m[0:6])/(2*h)
+			jac[12:,j] = (state_dot_p[12:] - state_dot_m[12:])/(2*h)
+		else:
+			h = jac_rel_step_fwd*max(1.0, abs(state[j]))
+			state_p[j] += h
+			state_dot_p = calc_state_dot_fused(state_p, input, packed)
+			jac[0:6,j] = (state_dot_p[0:6] - state_dot_0[0:6])/h
+			jac[12:,j] = (state_dot_p[12:] - state_dot_0[12:])/h
+
+	# kinematic rows analytically
+	U = state[0:3].copy()
+	omega = state[3:6].copy()
+	Phi = state[6:9].copy()
+	jac[6:9,3:6] = calc_H(Phi)
+	jac[6:9,6:9] = calc_H_partials(Phi, omega)
+	jac[9:12,0:3] = calc_base_rot_mats(Phi, 0.0, zero3, zero3)[1]
+	jac[9:12,6:9] = calc_C0b_partials(Phi, U)
+	return jac
+
+@njit(cache=True, nogil=True)
+def calc_input_jacobian_fused(state, input, packed, central=True):
+	# d(state_dot)/d(psi_ra, V) by finite differences
+	jac = np.zeros((len(state),2))
+	state_dot_0 = np.zeros(len(state)) if central else calc_state_dot_fused(state, input, packed)
+	for j in range(2):
+		input_p = input.copy()
+		if central:
+			h = jac_rel_step*max(1.0, abs(input[j]))
+			input_m = input.copy()
+			input_p[j] += h
+			input_m[j] -= h
+			jac[:,j] = (calc_state_dot_fused(state, input_p, packed) - calc_state_dot_fused(state, input_m, packed))/(2*h)
+		else:
+			h = jac_rel_step_fwd*max(1.0, abs(input[j]))
+			input_p[j] += h
+			jac[:,j] = (calc_state_dot_fused(state, input_p, packed) - state_dot_0)/h
+	return jac
+
+batch_threads = os.cpu_count() or 1
+batch_chunk_min = 64
+batch_executor = None
+
+def run_batch(kernel, n, chunk_min, *arrays):
+	# splits the leading axis of every array over the thread pool, kernels must be nogil and fill their outputs
+	global batch_executor
+	n_chunks = min(batch_threads, n // chunk_min)
+	if n_chunks <= 1:
+		kernel(*arrays)
+		return
+	if batch_executor is None:
+		batch_executor = ThreadPoolExecutor(batch_threads, thread_name_prefix='kernel_batch')
+	bounds = np.linspace(0, n, n_chunks+1).astype(np.int64)
+	futures = [batch_executor.submit(kernel, *[array[a:b] if isinstance(array, np.ndarray) else array for array in arrays])
+			for a, b in zip(bounds[:-1], bounds[1:])]
+	for future in futures:
+		future.result()
+
+def calc_state_dot_batch(states, inputs, packed):
+	state_dots = np.empty(states.shape)
+	run_batch(calc_state_dot_range, len(states), batch_chunk_min, states, inputs, packed, state_dots)
+	return state_dots
+
+@njit(cache=True, nogil=True)
+def calc_state_dot_range(states, inputs, packed, state_dots):
+	for i in range(len(states)):
+		state_dots[i] = calc_state_dot_fused(states[i], inputs[i], packed)
+	return state_dots
+
+def calc_linearization_batch(states, inputs, packed, central=True):
+	n = states.shape[1]
+	As = np.empty((len(states), n, n))
+	Bs = np.empty((len(states), n, 2))
+	# a jacobian costs ~20 state derivatives, so much smaller chunks pay off
+	run_batch(calc_linearization_range, len(states), 4, states, inputs, packed, central, As, Bs)
+	return As, Bs
+
+@njit(cache=True, nogil=True)
+def calc_linearization_range(states, inputs, packed, central, As, Bs):
+	for i in range(len(states)):
+		As[i] = calc_jacobian_fused(states[i], inputs[i], packed, central)
+		Bs[i] = calc_input_jacobian_fused(states[i], inputs[i], packed, central)
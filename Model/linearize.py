@@ -0,0 +1,148 @@
+import numpy as np
+import os
+import sys
+import time
+
+from model_RBird import Model_6DoF
+import model_RBird
+from trim import TrimTable, get_trim_table
+
+state_names = ['u','v','w', 'p','q','r', 'phi','theta','psi', 'x','y','z', 'I','omega_p']
+input_names = ['psi_ra','V']
+
+neutral_tol = 1e-6		# eigenvalues below this magnitude are neutral (x, y, psi)
+linear_cache_root = 'cache/linear/'
+
+class LinearTable:
+	def __init__(self, key, V_range, psi_ra_range, states, inputs, converged, A, B, eigvals):
+		self.key = key
+		self.V_range = V_range
+		self.psi_ra_range = psi_ra_range
+		self.states = states				# [n_V, n_psi_ra, n_states], trim points
+		self.inputs = inputs				# [n_V, n_psi_ra, 2]
+		self.converged = converged			# [n_V, n_psi_ra], A, B and eigvals are nan elsewhere
+		self.A = A							# [n_V, n_psi_ra, n_states, n_states]
+		self.B = B							# [n_V, n_psi_ra, n_states, 2]
+		self.eigvals = eigvals				# [n_V, n_psi_ra, n_states], descending real part
+
+	def save(self, path):
+		directory = os.path.dirname(path)
+		if directory and not os.path.exists(directory):
+			os.makedirs(directory, exist_ok=True)
+		np.savez(path, key=self.key, V_range=self.V_range, psi_ra_range=self.psi_ra_range, states=self.states,
+			inputs=self.inputs, converged=self.converged, A=self.A, B=self.B, eigvals=self.eigvals)
+
+	@staticmethod
+	def load(path):
+		data = np.load(path)
+		return LinearTable(str(data['key']), data['V_range'], data['psi_ra_range'], data['states'], data['inputs'],
+					 data['converged'], data['A'], data['B'], data['eigvals'])
+
+	def calc_stability(self):
+		# count of unstable modes and the largest real part per grid point
+		n_unstable = np.where(self.converged, (self.eigvals.real > neutral_tol).sum(axis=-1), -1)
+		max_real = np.where(self.converged, self.eigvals.real.max(axis=-1), np.nan)
+		return n_unstable, max_real
+
+def residualize_motor(A, B):
+	# quasi-steady motor (singular perturbation): eliminates current and shaft speed from a 14 state model
+	#	A_r = A11 - A12 A22^-1 A21, B_r = B1 - A12 A22^-1 B2
+	A11, A12, A21, A22 = A[...,:12,:12], A[...,:12,12:], A[...,12:,:12], A[...,12:,12:]
+	A22_inv_A21 = np.linalg.solve(A22, A21)
+	A22_inv_B2 = np.linalg.solve(A22, B[...,12:,:])
+	return A11 - A12 @ A22_inv_A21, B[...,:12,:] - A12 @ A22_inv_B2
+
+def sort_eigvals(eigvals):
+	order = np.argsort(-eigvals.real, axis=-1, kind='stable')
+	return np.take_along_axis(eigvals, order, axis=-1)
+
+def linearize_trim_table(model: Model_6DoF, table: TrimTable, central=True, rigid_body=False):
+	# A and B at every converged trim point, batched over the kernel thread pool
+	#	rigid_body: residualize the motor states of a dynamic propulsor, giving 12x12 and 12x2
+	tik = time.perf_counter()
+	n_V, n_psi_ra = table.converged.shape
+	inputs = np.empty((n_V, n_psi_ra, 2))
+	inputs[...,0] = table.psi_ra_range[None,:]
+	inputs[...,1] = table.V_range[:,None]
+
+	mask = table.converged
+	As, Bs = model.linearize_batch(table.states[mask], inputs[mask], central)
+	if rigid_body and model.propulsor.dynamic:
+		As, Bs = residualize_motor(As, Bs)
+	n = As.shape[-1]
+
+	A = np.full((n_V, n_psi_ra, n, n), np.nan)
+	B = np.full((n_V, n_psi_ra, n, 2), np.nan)
+	eigvals = np.full((n_V, n_psi_ra, n), np.nan, dtype=np.complex128)
+	A[mask] = As
+	B[mask] = Bs
+	eigvals[mask] = sort_eigvals(np.linalg.eigvals(As))
+	print(f'INFO: linearized {mask.sum()} trim points in {time.perf_counter()-tik:.2f} s')
+	key = f'{table.key}-{"central" if central else "forward"}-{"rigid" if rigid_body else "full"}'
+	return LinearTable(key, table.V_range, table.psi_ra_range, table.states[...,:n], inputs, mask, A, B, eigvals)
+
+def calc_modes(A):
+	# eigenvalue, natural frequency, damping and the dominant states (participation factors) per mode
+	#	complex pairs are listed once, sorted by descending real part
+	eigvals, V = np.linalg.eig(A)
+	try:
+		W = np.linalg.inv(V)
+		participation = np.abs(V*W.T)
+	except np.linalg.LinAlgError:
+		participation = np.abs(V)
+	names = state_names[:len(A)]
+	modes = []
+	for k in np.argsort(-eigvals.real, kind='stable'):
+		eigval = eigvals[k]
+		if eigval.imag < -neutral_tol:
+			continue
+		mag = abs(eigval)
+		p = participation[:,k]/max(participation[:,k].sum(), 1e-300)
+		dominant = [names[i] for i in np.argsort(-p)[:3] if p[i] > 0.1]
+		modes.append({
+			'eigval': eigval,
+			'wn': mag,
+			'zeta': -eigval.real/mag if mag > neutral_tol else np.nan,
+			'type': 'neutral' if mag < neutral_tol else ('unstable' if eigval.real > neutral_tol else 'stable'),
+			'states': dominant
+		})
+	return modes
+
+def print_modes(A):
+	print(f'{"eigenvalue":>26}{"wn [rad/s]":>12}{"zeta":>8}  {"type":<10}states')
+	for mode in calc_modes(A):
+		eigval = mode['eigval']
+		eig_str = f'{eigval.real:.4g}' + (f' +/- {abs(eigval.imag):.4g}j' if abs(eigval.imag) > neutral_tol else '')
+		print(f'{eig_str:>26}{mode["wn"]:>12.4g}{mode["zeta"]:>8.3f}  {mode["type"]:<10}{", ".join(mode["states"])}')
+
+def linear_path(key, cache_root=linear_cache_root):
+	# trim key (sha256 hex) followed by the linearization options
+	return os.path.join(cache_root, f'linear_{key[:16]}{key[64:].replace("-", "_")}.npz')
+
+def main():
+	dynamic_propulsor = '--dynamic' in sys.argv
+	rigid_body = '--rigid' in sys.argv
+	model = model_RBird.make_default(dynamic_propulsor)
+	table = linearize_trim_table(model, get_trim_table(model), rigid_body=rigid_body)
+	path = linear_path(table.key)
+	try:
+		table.save(path)
+		print(f'INFO: saved linearization table "{path}"')
+	except Exception as e:
+		print(f'ERROR: failed to save linearization table - {e}')
+
+	# stability across speed, straight runs
+	j = int(np.argmin(np.abs(table.psi_ra_range)))
+	n_unstable, max_real = table.calc_stability()
+	print(f'{"V [V]":>8}{"u [m/s]":>10}{"unstable":>10}{"max real":>12}')
+	for i, V in enumerate(table.V_range):
+		if not table.converged[i,j]:
+			print(f'{V:>8.2f}{"-":>10}')
+			continue
+		print(f'{V:>8.2f}{table.states[i,j,0]:>10.3f}{n_unstable[i,j]:>10d}{max_real[i,j]:>12.4g}')
+
+	i = int(np.argmax(np.where(table.converged[:,j], table.V_range, -np.inf)))
+	print(f'INFO: modes at V = {table.V_range[i]:.2f} V, psi_ra = {table.psi_ra_range[j]*180/np.pi:.2f} deg')
+	print_modes(table.A[i,j])
+
+if __name__ == '__main__': main()
@@ -1,20 +1,41 @@
 import numpy as np
+import hashlib
+import os
 
 from utils.utils import *
+from utils.artifact_utils import save_artifact, load_artifact
 from components.panel import Panel
 from components.hull import Hull
 from components.propulsor import Propulsor
 from components.wing_root import WingRoot
+from kernel_RBird import (pack_model, calc_state_dot_fused, calc_state_dot_batch, calc_jacobian_fused, calc_input_jacobian_fused,
+						  calc_linearization_batch)
+
+artifact_cache_root = 'cache/model/'
+# component groups of a diagnostics pass, in evaluation order (the propulsor wake reads the hull's wetted area)
+diagnostics_parts = ['panels', 'wing_roots', 'hull', 'propulsor']
 
 class Model_6DoF:
-	def __init__(self, path_constants, path_hull, path_wing_root, path_aero_coeffs_root, path_propulsor):
+	def __init__(self, path_constants, path_hull, path_wing_root, path_aero_coeffs_root, path_propulsor,
+			  path_thrust_torque_coeffs=None, constant_overrides=None, loaded=None):
+		# constructor arguments, for rebuilding the model elsewhere (worker processes), and every file read
+		self.paths = (path_constants, path_hull, path_wing_root, path_aero_coeffs_root, path_propulsor, path_thrust_torque_coeffs)
+		self.source_paths = []
+		# aerodynamic coefficient files in bank order
+		self.aero_paths = []
+		# parsed file contents by path, reused instead of reading when given (read only, shared between models)
+		self.loaded = {} if loaded is None else dict(loaded)
+		# model artifact the loaded data is mapped from, worker processes map it again instead of receiving copies
+		self.artifact_path = None
+		self.constant_overrides = {} if constant_overrides is None else dict(constant_overrides)
 		self.missing_constants = set()
 		self.accessed_constants = set()
 		self.invalid_constants = set()
 		self.init_errors = 0
 		print('INFO: loading constants')
 		try:
-			self.constants = load_constants(path_constants)
+			self.constants = dict(self.__load(path_constants, load_constants))
+			self.constants.update(self.constant_overrides)
 			self.__commit_params()
 		except Exception as e:
 			print(f'ERROR: failed to load constants - {e}')
@@ -29,6 +50,9 @@ class Model_6DoF:
 		# default inputs
 		self.psi_ra = 0
 
+		self.diagnostics_key = None
+		self.diagnostics_done = set()
+
 		make_errors = 0
 		print('INFO: making panels...')
 		make_errors += self.__make_panels(path_aero_coeffs_root)
@@ -37,8 +61,10 @@ class Model_6DoF:
 
 		print('INFO: making wing roots...')
 		make_errors += self.__make_wing_roots(path_wing_root, path_aero_coeffs_root)
+		make_errors += self.__make_hydrostatics(path_hull, path_wing_root)
 		print('INFO: making propulsor...')
-		make_errors += self.__make_propulsor(path_propulsor)
+		make_errors += self.__make_propulsor(path_propulsor, path_thrust_torque_coeffs)
+		make_errors += self.__make_aero_bank()
 		print(f'INFO: components initialized with {make_errors} error(s)')
 		self.init_errors += make_errors
 
@@ -76,7 +102,9 @@ class Model_6DoF:
 			print(f', exiting')
 			exit()
 
+		self.packed = pack_model(self)
 		self.calc_state_dot()
+		self.calc_state_dot_fused(self.get_state(), self.get_input())
 
 	def __commit_params(self):
 		self.m = self.get_const('m',True)
@@ -105,6 +133,27 @@ class Model_6DoF:
 		self.psi_ra_max = self.get_const('psi_ra_max')*np.pi/180
 		self.V_max = self.get_const('V_max')
 
+	def __load(self, path, loader):
+		if path not in self.loaded:
+			self.loaded[path] = loader(path)
+		self.source_paths.append(path)
+		return self.loaded[path]
+
+	def __load_aero_coeffs(self, path):
+		# index into the aerodynamic coefficient bank, which is built once every component is made
+		self.__load(path, load_aero_coeffs)
+		if path not in self.aero_paths:
+			self.aero_paths.append(path)
+		return self.aero_paths.index(path)
+
+	def __make_aero_bank(self):
+		try:
+			self.aero_bank = make_aero_bank([self.loaded[path] for path in self.aero_paths])
+		except Exception as e:
+			print(f'ERROR: failed to make aerodynamic coefficient bank - {e}')
+			return 1
+		return 0
+
 	def get_const(self, key, pos_check=False):
 		if key in self.constants:
 			self.accessed_constants.add(key)
@@ -147,7 +196,7 @@ class Model_6DoF:
 
 	def __make_panel(self, id, id_1, id_2, root):
 		try:
-			aero_coeffs = load_aero_coeffs(root+f'wing_{id}.txt')
+			i_aero = self.__load_aero_coeffs(root+f'wing_{id}.txt')
 		except Exception as e:
 			print(f'ERROR: failed to load panel {id} aerodynamic coefficients - {e}')
 			return None, None, 1
@@ -166,28 +215,28 @@ class Model_6DoF:
 			r_TE_2 = self.get_const('r_TE_'+id_2+'_kt') - self.r_CM
 			r_list = [r_LE_1,r_LE_2,r_TE_1,r_TE_2]
 
-		panel_left = Panel(self, id+'L', r_list, aero_coeffs, rear)
-		panel_right = Panel(self, id+'R', [flipY @ r for r in r_list], aero_coeffs, rear)
+		panel_left = Panel(self, id+'L', r_list, i_aero, rear)
+		panel_right = Panel(self, id+'R', [flipY @ r for r in r_list], i_aero, rear)
 		return panel_left, panel_right, 0
 
 	def __make_hull(self, path_hull, path_aero_coeffs_root):
 		try:
-			vol_area_data = load_volume_area_data(path_hull)
+			vol_area_data = self.__load(path_hull, load_volume_area_data)
 		except Exception as e:
 			print(f'ERROR: failed to load hull volume area data - {e}')
 			return 1
 		try:
-			hull_aero_coeffs = load_aero_coeffs(path_aero_coeffs_root+'hull.txt')
+			i_aero = self.__load_aero_coeffs(path_aero_coeffs_root+'hull.txt')
 		except Exception as e:
 			print(f'ERROR: failed to load hull aerodynamic coefficients - {e}')
 			return 1
 		try:
-			surf_aero_coeffs = load_aero_coeffs(path_aero_coeffs_root+'surf.txt')
+			i_aero_surf = self.__load_aero_coeffs(path_aero_coeffs_root+'surf.txt')
 		except Exception as e:
 			print(f'ERROR: failed to load surfaced aerodynamic coefficients - {e}')
 			return 1
 		try:
-			self.hull = Hull(self, vol_area_data, hull_aero_coeffs, surf_aero_coeffs)
+			self.hull = Hull(self, vol_area_data, i_aero, i_aero_surf)
 		except Exception as e:
 			print(f'ERROR: failed to make hull - {e}')
 			return 1
@@ -195,102 +244,250 @@ class Model_6DoF:
 
 	def __make_wing_roots(self, path_wing_root, path_aero_coeffs_root):
 		try:
-			vol_area_data = load_volume_area_data(path_wing_root)
+			self.__load(path_wing_root, load_volume_area_data)
 		except Exception as e:
 			print(f'ERROR: failed to load wing root volume area data - {e}')
 			return 1
 		try:
-			aero_coeffs = load_aero_coeffs(path_aero_coeffs_root+'wing_root.txt')
+			i_aero = self.__load_aero_coeffs(path_aero_coeffs_root+'wing_root.txt')
 		except Exception as e:
 			print(f'ERROR: failed to load wing root aerodynamic coefficients - {e}')
 			return 1
-		wr_L = WingRoot(self, vol_area_data, aero_coeffs, True)
-		wr_R = WingRoot(self, vol_area_data, aero_coeffs, False)
+		wr_L = WingRoot(self, i_aero, True)
+		wr_R = WingRoot(self, i_aero, False)
 		self.wing_roots = (wr_L, wr_R)
 		return 0
 
-	def __make_propulsor(self, path_propulsor):
+	def __make_hydrostatics(self, path_hull, path_wing_root):
+		# hull and wing root grids merged into one table, kept with the loaded data for the model artifact
+		hydrostatics_key = (path_hull, path_wing_root)
+		hydrostatics = self.loaded.get('hydrostatics')
+		if hydrostatics is not None and tuple(hydrostatics[0]) == hydrostatics_key:
+			self.hydrostatics = hydrostatics[1]
+			return 0
 		try:
-			prop_data = load_propulsor_data(path_propulsor)
+			self.hydrostatics = merge_volume_area(self.loaded[path_hull], self.loaded[path_wing_root])
 		except Exception as e:
-			print(f'ERROR: failed to load propulsor data - {e}')
+			print(f'ERROR: failed to merge hull and wing root volume area data - {e}')
 			return 1
-		propulsor_d = np.load(path_propulsor)['d']
+		self.loaded['hydrostatics'] = (hydrostatics_key, self.hydrostatics)
+		return 0
+
+	def __make_propulsor(self, path_propulsor, path_thrust_torque_coeffs):
+		# equilibrium table (.npz), or a four quadrant fourier series solved directly at runtime
+		prop_data = None
+		fourier_coeffs = None
+		propulsor_d = None
+		if is_fourier_propulsor(path_propulsor):
+			try:
+				fourier_coeffs = self.__load(path_propulsor, load_fourier_coeffs)
+			except Exception as e:
+				print(f'ERROR: failed to load propeller fourier coefficients - {e}')
+				return 1
+		else:
+			try:
+				prop_data, propulsor_d = self.__load(path_propulsor,
+											lambda path: (load_propulsor_data(path), float(np.load(path)['d'])))
+			except Exception as e:
+				print(f'ERROR: failed to load propulsor data - {e}')
+				return 1
+		thrust_torque_coeffs = None
+		if path_thrust_torque_coeffs is not None:
+			try:
+				thrust_torque_coeffs = self.__load(path_thrust_torque_coeffs, load_thrust_torque_coeffs)
+			except Exception as e:
+				print(f'ERROR: failed to load propeller thrust torque coefficients - {e}')
+				return 1
 		propeller_d = self.get_const('d')
-		if propulsor_d != propeller_d:
+		if propulsor_d is not None and propulsor_d != propeller_d:
 			print(f'ERROR: propeller/propulsor diameter mismatch - {self.get_const('d')} vs {propeller_d}')
 		try:
-			self.propulsor = Propulsor(self, prop_data)
+			self.propulsor = Propulsor(self, prop_data, thrust_torque_coeffs, fourier_coeffs)
 		except Exception as e:
 			print(f'ERROR: failed to make propulsor - {e}')
 			return 1
 		return 0
 
-	def calc_state_dot(self):
-		(self.Cb0, self.C0b, self.Cb_ra, self.Cra_b, self.C0_ra, 
-   			self.r_ra_world) = calc_base_rot_mats(self.Phi, self.psi_ra, self.r_ra, self.r)
-		self.query = calc_base_query(self.C0b, self.r_CM, self.r, self.Phi)
+	def calc_state_dot(self, diagnostics=True):
+		if diagnostics:
+			self.calc_diagnostics(force=True)
+			return
+		# lean mode: derivatives only, component telemetry fields are left untouched
+		state_dot = calc_state_dot_fused(self.get_state(), self.get_input(), self.packed)
+		self.U_dot, self.omega_dot, self.Phi_dot, self.r_dot = state_dot[0:3], state_dot[3:6], state_dot[6:9], state_dot[9:12]
+		if self.propulsor.dynamic:
+			self.propulsor.I_dot, self.propulsor.omega_p_dot = state_dot[12], state_dot[13]
+
+	def calc_diagnostics(self, force=False, parts=None):
+		# parts: the diagnostics_parts to evaluate, all by default, the state derivatives once every part is done
+		#	base frames always, anything already evaluated at the current state and input is kept
+		diagnostics_key = np.concatenate((self.get_state(), self.get_input()))
+		if force or not np.array_equal(diagnostics_key, self.diagnostics_key):
+			self.diagnostics_key = diagnostics_key
+			self.diagnostics_done = set()
+
+			(self.Cb0, self.C0b, self.Cb_ra, self.Cra_b, self.C0_ra, 
+				self.r_ra_world) = calc_base_rot_mats(self.Phi, self.psi_ra, self.r_ra, self.r)
+			self.query = calc_base_query(self.C0b, self.r_CM, self.r, self.Phi)
+			self.vol_area = query_hydrostatics(self.hydrostatics, self.query)
+
+		parts = set(diagnostics_parts if parts is None else parts)
+		if 'propulsor' in parts:
+			parts.add('hull')
+		for part in diagnostics_parts:
+			if part not in parts or part in self.diagnostics_done:
+				continue
+			if part == 'panels':
+				for panel in self.panels.values():
+					panel.calc_force_moments()
+			elif part == 'wing_roots':
+				for wr in self.wing_roots:
+					wr.calc_force_moments()
+			elif part == 'hull':
+				self.hull.calc_force_moments()
+			else:
+				self.propulsor.calc_force_moments()
+			self.diagnostics_done.add(part)
 
-		F, M = zero3.copy(), zero3.copy()
+		if len(self.diagnostics_done) < len(diagnostics_parts) or 'state_dot' in self.diagnostics_done:
+			return
+		self.diagnostics_done.add('state_dot')
 
+		F, M = zero3.copy(), zero3.copy()
 		for panel in self.panels.values():
-			panel.calc_force_moments()
 			F += panel.F
 			M += panel.M
-
 		for wr in self.wing_roots:
-			wr.calc_force_moments()
 			F += wr.F_b + wr.F_f
 			M += wr.M_b + wr.M_f
-		
-		self.hull.calc_force_moments()
 		F += self.hull.F_h + self.hull.F_b + self.hull.F_surf
 		M += self.hull.M_h + self.hull.M_b + self.hull.M_surf
-
-		self.propulsor.calc_force_moments()
 		F += self.propulsor.F
 		M += self.propulsor.M
 
 		(self.U_dot, self.omega_dot, self.Phi_dot, self.r_dot, 
    			self.H) = calc_state_dot(F,M, self.Cb0, self.C0b, self.m, self.g, self.Ib, self.Ib_inv, self.U, self.omega, self.Phi)
 
+	def calc_state_dot_fused(self, state, input):
+		# contiguous float64 arguments keep numba on a single specialization
+		return calc_state_dot_fused(np.ascontiguousarray(state, dtype=np.float64), input, self.packed)
+
+	def calc_state_dot_batch(self, states, inputs):
+		states = np.ascontiguousarray(states, dtype=np.float64)
+		if states.ndim != 2 or states.shape[1] != self.n_states:
+			raise ValueError(f'expected states of shape (N, {self.n_states}), got {states.shape}')
+		inputs = np.ascontiguousarray(np.broadcast_to(inputs, (len(states), 2)), dtype=np.float64)
+		return calc_state_dot_batch(states, inputs, self.packed)
+
+	def calc_jacobian(self, state, input, central=True):
+		return calc_jacobian_fused(np.ascontiguousarray(state, dtype=np.float64), input, self.packed, central)
+
+	def linearize(self, state=None, input=None, central=True):
+		# A = d(state_dot)/d(state), B = d(state_dot)/d(psi_ra, V), at the current state and input by default
+		state = np.ascontiguousarray(self.get_state() if state is None else state, dtype=np.float64)
+		input = np.ascontiguousarray(self.get_input() if input is None else input, dtype=np.float64)
+		return (calc_jacobian_fused(state, input, self.packed, central),
+		  calc_input_jacobian_fused(state, input, self.packed, central))
+
+	def linearize_batch(self, states, inputs, central=True):
+		states = np.ascontiguousarray(states, dtype=np.float64)
+		if states.ndim != 2 or states.shape[1] != self.n_states:
+			raise ValueError(f'expected states of shape (N, {self.n_states}), got {states.shape}')
+		inputs = np.ascontiguousarray(np.broadcast_to(inputs, (len(states), 2)), dtype=np.float64)
+		return calc_linearization_batch(states, inputs, self.packed, central)
+
+	@property
+	def n_states(self):
+		return 14 if self.propulsor.dynamic else 12
+
 	def get_state(self):
-		return np.concatenate((self.U, self.omega, self.Phi, self.r))
+		return np.concatenate((self.U, self.omega, self.Phi, self.r, self.propulsor.get_state()))
 	def get_state_dot(self):
-		return np.concatenate((self.U_dot, self.omega_dot, self.Phi_dot, self.r_dot))
+		return np.concatenate((self.U_dot, self.omega_dot, self.Phi_dot, self.r_dot, self.propulsor.get_state_dot()))
 	def set_state(self, state):
 		self.U = state[0:3]
 		self.omega = state[3:6]
 		self.Phi = state[6:9]
 		self.Phi[2] %= 2*np.pi
 		self.r = state[9:12]
+		self.propulsor.set_state(state[12:14])
 	
 	def get_input(self):
-		return np.array([self.psi_ra, self.propulsor.get_input()])
+		return np.array([self.psi_ra, self.propulsor.get_input()], dtype=np.float64)
 	def set_input(self, input):
 		self.psi_ra = input[0]
 		self.propulsor.set_input(input[1])
 
-@njit(cache=True)
-def calc_state_dot(F,M, Cb0,C0b, m,g, Ib,Ib_inv, U,omega,Phi):
-	F = F.astype(np.float64)
-	M = M.astype(np.float64)
-	U = U.astype(np.float64)
-	omega = omega.astype(np.float64)
-
-	F_g = Cb0 @ np.array([0.0, 0.0, m*g])
-	F += F_g
-
-	U_dot = F/m - cross(omega, U)
-	omega_dot = Ib_inv @ (M - cross(omega, Ib @ omega))
-	H = calc_H(Phi)
-	Phi_dot = H @ omega
-	r_dot = C0b @ U
-	return U_dot, omega_dot, Phi_dot, r_dot, H
-
-def make_default():
-	return Model_6DoF('params/model_constants.txt','params/hull_data_regular_grid.npz','params/left_wing_root_data_regular_grid.npz',
-			'params/sample aero coeffs/','params/propulsor data/FlipSky-85165-150_B4-70-14_10.npz')
+def artifact_path(paths, cache_root=artifact_cache_root, grid_dtypes=None):
+	key = hashlib.sha256(repr((paths, sorted(grid_dtypes.items())) if grid_dtypes else paths).encode()).hexdigest()
+	return os.path.join(cache_root, f'model_{key[:16]}.rbma')
+
+def cast_grids(loaded, paths, grid_dtypes):
+	# grid values at another storage precision, by grid: 'hull', 'wing_root', 'hydrostatics', 'propulsor'
+	#	the hull grid is only used for the waterline, lookups during a run go through hydrostatics and propulsor
+	loaded = dict(loaded)
+	for name, dtype in grid_dtypes.items():
+		if name == 'hull':
+			loaded[paths[1]] = cast_grid(loaded[paths[1]], dtype)
+		elif name == 'wing_root':
+			loaded[paths[2]] = cast_grid(loaded[paths[2]], dtype)
+		elif name == 'hydrostatics':
+			key, table = loaded['hydrostatics']
+			loaded['hydrostatics'] = (key, cast_grid(table, dtype))
+		elif name == 'propulsor':
+			if not is_fourier_propulsor(paths[4]):
+				table, d = loaded[paths[4]]
+				loaded[paths[4]] = (cast_grid(table, dtype), d)
+		else:
+			raise ValueError(f'unknown grid "{name}"')
+	return loaded
+
+def make_mapped(paths, path):
+	# model over an artifact (parsed sources and waterline, memory mapped), None when missing or stale
+	#	the mapping is copy on write, so every process reading the artifact shares its pages through the page cache
+	try:
+		artifact = load_artifact(path)
+	except Exception as e:
+		print(f'WARNING: failed to load model artifact "{path}" - {e}')
+		return None
+	if artifact is None:
+		return None
+	print(f'INFO: loaded model artifact "{path}"')
+	model = Model_6DoF(*paths, loaded=artifact[0])
+	model.artifact_path = path
+	return model
+
+def make_cached(*paths, cache_root=artifact_cache_root, grid_dtypes=None):
+	# model from its compiled artifact when fresh, rebuilt from the sources and written back otherwise
+	#	grid_dtypes: storage precision per grid, e.g. {'hydrostatics': 'float32'}, see cast_grids
+	grid_dtypes = {name: np.dtype(dtype).name for name, dtype in (grid_dtypes or {}).items()}
+	path = artifact_path(paths, cache_root, grid_dtypes)
+	model = make_mapped(paths, path)
+	if model is not None:
+		return model
+	model = Model_6DoF(*paths)
+	try:
+		save_artifact(path, cast_grids(model.loaded, paths, grid_dtypes), model.source_paths)
+		print(f'INFO: saved model artifact "{path}"')
+	except Exception as e:
+		print(f'ERROR: failed to save model artifact - {e}')
+		return model
+	# uncast, the tables are the ones just written, so workers can map the artifact and this model is kept
+	if all(dtype == 'float64' for dtype in grid_dtypes.values()):
+		model.artifact_path = path
+		return model
+	# cast, rebuilt over the written artifact, so a miss runs on the same (mapped, cast) tables as a hit
+	return make_mapped(paths, path) or model
+
+def make_default(dynamic_propulsor=False, cached=True, direct_propulsor=False, grid_dtypes=None):
+	# dynamic propulsor: motor current and shaft speed as states 12, 13 instead of the equilibrium table
+	# direct propulsor: the equilibrium solved from the propeller fourier series and motor constants, no table
+	path_thrust_torque_coeffs = 'params/4 quad prop data/thrust torque coeffs/B4-70-14.txt' if dynamic_propulsor else None
+	path_propulsor = ('params/4 quad prop data/fourier coeffs/B4-70-14.txt' if direct_propulsor else
+				   'params/propulsor data/FlipSky-85165-150_B4-70-14_10.npz')
+	paths = ('params/model_constants.txt','params/hull_data_regular_grid.npz','params/left_wing_root_data_regular_grid.npz',
+		  'params/sample aero coeffs/', path_propulsor, path_thrust_torque_coeffs)
+	return make_cached(*paths, grid_dtypes=grid_dtypes) if cached else Model_6DoF(*paths)
 
 def main():
 	import cProfile
@@ -1,55 +1,115 @@
 import numpy as np
+from numba import njit
+
+# Wageningen B-series open water polynomials, KT and KQ as sums of C * J^s * (P/D)^t * (AE/AO)^u * Z^v
+#	one design (AE/AO, P/D, Z) collapses each sum to a cubic in J (calc_b_series_poly), evaluated in horner form
+#	the regression covers the first quadrant only, 0 <= J <= b_series_J_max
+
+# Coefficients and Exponents for KT
+C_T = np.array([
+	0.00880496, -0.204554, 0.166351, 0.158114, -0.147581, -0.481497, 0.415437,
+	0.0144043, -0.0530054, 0.0143481, 0.0606826, -0.0125894, 0.0109689, -0.133698,
+	0.00638407, -0.00132718, 0.168496, -0.0507214, 0.0854559, -0.0504475, 0.010465,
+	-0.00648272, -0.00841728, 0.0168424, -0.00102296, -0.0317791, 0.018604,
+	-0.00410798, -0.000606848, -0.0049819, 0.0025983, -0.000560528, -0.00163652,
+	-0.000328787, 0.000116502, 0.000690904, 0.00421749, 0.0000565229, -0.00146564
+])
+s_T, t_T, u_T, v_T = [np.array(x, dtype=np.int64) for x in [
+	[0, 1, 0, 0, 2, 1, 0, 0, 2, 0, 1, 0, 1, 0, 0, 2, 3, 0, 2, 3, 1, 2, 0, 1, 3, 0, 1, 0, 0, 1, 2, 3, 1, 1, 2, 0, 0, 3, 0],
+	[0, 0, 1, 2, 0, 1, 2, 0, 0, 1, 1, 0, 0, 3, 6, 6, 0, 0, 0, 0, 6, 6, 3, 3, 3, 3, 0, 2, 0, 0, 0, 0, 2, 6, 6, 0, 3, 6, 3],
+	[0, 0, 0, 0, 1, 1, 1, 0, 0, 0, 0, 1, 1, 0, 0, 0, 1, 2, 2, 2, 2, 2, 0, 0, 0, 1, 2, 2, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 2],
+	[0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2]
+]]
+
+# Coefficients and Exponents for KQ
+C_Q = np.array([
+	0.00379368, 0.00886523, -0.032241, 0.00344778, -0.0408811, -0.108009, -0.0885381,
+	0.188561, -0.00370871, 0.00513696, 0.0209449, 0.00474319, -0.00723408, 0.00438388,
+	-0.0269403, 0.0558082, 0.0161886, 0.00318086, 0.015896, 0.0471729, 0.0196283,
+	-0.0502782, -0.030055, 0.0417122, -0.0397722, -0.00350024, -0.0106854, 0.00110903,
+	-0.000313912, 0.0035985, -0.00142121, -0.00383637, 0.0126803, -0.00318278, 0.00334268,
+	-0.00183491, 0.000112451, -0.0000297228, 0.000269551, 0.00083265, 0.00155334,
+	0.000302683, -0.0001843, -0.000425399, 0.0000869243, -0.0004659, 0.0000554194
+])
+s_Q, t_Q, u_Q, v_Q = [np.array(x, dtype=np.int64) for x in [
+	[0, 2, 1, 0, 0, 1, 2, 0, 1, 0, 1, 2, 2, 1, 0, 3, 0, 1, 0, 1, 3, 0, 3, 2, 0, 0, 3, 3, 0, 3, 0, 1, 0, 2, 0, 1, 3, 3, 1, 2, 0, 0, 0, 0, 3, 0, 1],
+	[0, 0, 1, 2, 1, 1, 1, 2, 0, 1, 1, 1, 0, 1, 2, 0, 3, 3, 0, 0, 0, 1, 1, 2, 3, 6, 0, 3, 6, 0, 6, 0, 2, 3, 6, 1, 2, 6, 0, 0, 2, 6, 0, 3, 3, 6, 6],
+	[0, 0, 0, 0, 1, 1, 1, 1, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 2, 2, 2, 2, 0, 0, 0, 1, 1, 2, 2, 2, 2, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2, 2],
+	[0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2]
+]]
+
+b_series_J_max = 1.6		# upper end of the regression data
+
+@njit(cache=True)
+def calc_powers(x, n):
+	out = np.empty(n+1)
+	out[0] = 1.0
+	for i in range(n):
+		out[i+1] = out[i]*x
+	return out
+
+@njit(cache=True)
+def calc_b_series_poly(AE_AO, P_D, Z):
+	# [4, 2] coefficients of J^0..J^3 for KT, KQ, powers of the design parameters computed once
+	P_D_pow = calc_powers(P_D, 6)
+	AE_AO_pow = calc_powers(AE_AO, 2)
+	Z_pow = calc_powers(Z, 2)
+	poly = np.zeros((4, 2))
+	for i in range(len(C_T)):
+		poly[s_T[i],0] += C_T[i]*P_D_pow[t_T[i]]*AE_AO_pow[u_T[i]]*Z_pow[v_T[i]]
+	for i in range(len(C_Q)):
+		poly[s_Q[i],1] += C_Q[i]*P_D_pow[t_Q[i]]*AE_AO_pow[u_Q[i]]*Z_pow[v_Q[i]]
+	return poly
+
+@njit(cache=True)
+def calc_b_series_coeffs(poly, J):
+	# KT, KQ and their slopes wrt J
+	KT = KQ = dKT = dKQ = 0.0
+	for s in range(3, -1, -1):
+		dKT = dKT*J + KT
+		dKQ = dKQ*J + KQ
+		KT = KT*J + poly[s,0]
+		KQ = KQ*J + poly[s,1]
+	return KT, KQ, dKT, dKQ
+
+@njit(cache=True)
+def calc_b_series_coeffs_batch(poly, J):
+	# [n, 4] KT, KQ, dKT/dJ, dKQ/dJ for one design
+	out = np.empty((len(J), 4))
+	for i in range(len(J)):
+		out[i,0], out[i,1], out[i,2], out[i,3] = calc_b_series_coeffs(poly, J[i])
+	return out
+
+@njit(cache=True)
+def calc_b_series_grid(J, P_D, AE_AO, Z):
+	# KT, KQ over the (J, P/D, AE/AO, Z) grid [n_J, n_P_D, n_AE_AO, n_Z, 2]
+	out = np.empty((len(J), len(P_D), len(AE_AO), len(Z), 2))
+	for j in range(len(P_D)):
+		for k in range(len(AE_AO)):
+			for l in range(len(Z)):
+				poly = calc_b_series_poly(AE_AO[k], P_D[j], Z[l])
+				for i in range(len(J)):
+					out[i,j,k,l,0], out[i,j,k,l,1], _, _ = calc_b_series_coeffs(poly, J[i])
+	return out
 
 def b_series_coeff(AE_AO, P_D, J, Z):
-    """
-    Calculates Wageningen B-Series Thrust (KT) and Torque (KQ) coefficients.
-    
-    Inputs:
-        AE_AO: Expanded area ratio (Ae/Ao)
-        P_D:   Pitch-diameter ratio (P/D)
-        J:     Advance coefficient (Va / nD) - can be an array
-        Z:     Blade count
-    """
-    J = np.atleast_1d(J)
-    
-    # Coefficients and Exponents for KT
-    C_T = np.array([
-        0.00880496, -0.204554, 0.166351, 0.158114, -0.147581, -0.481497, 0.415437, 
-        0.0144043, -0.0530054, 0.0143481, 0.0606826, -0.0125894, 0.0109689, -0.133698, 
-        0.00638407, -0.00132718, 0.168496, -0.0507214, 0.0854559, -0.0504475, 0.010465, 
-        -0.00648272, -0.00841728, 0.0168424, -0.00102296, -0.0317791, 0.018604, 
-        -0.00410798, -0.000606848, -0.0049819, 0.0025983, -0.000560528, -0.00163652, 
-        -0.000328787, 0.000116502, 0.000690904, 0.00421749, 0.0000565229, -0.00146564
-    ])
-    s_T, t_T, u_T, v_T = [np.array(x) for x in [
-        [0, 1, 0, 0, 2, 1, 0, 0, 2, 0, 1, 0, 1, 0, 0, 2, 3, 0, 2, 3, 1, 2, 0, 1, 3, 0, 1, 0, 0, 1, 2, 3, 1, 1, 2, 0, 0, 3, 0],
-        [0, 0, 1, 2, 0, 1, 2, 0, 0, 1, 1, 0, 0, 3, 6, 6, 0, 0, 0, 0, 6, 6, 3, 3, 3, 3, 0, 2, 0, 0, 0, 0, 2, 6, 6, 0, 3, 6, 3],
-        [0, 0, 0, 0, 1, 1, 1, 0, 0, 0, 0, 1, 1, 0, 0, 0, 1, 2, 2, 2, 2, 2, 0, 0, 0, 1, 2, 2, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 2],
-        [0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2]
-    ]]
-
-    # Coefficients and Exponents for KQ
-    C_Q = np.array([
-        0.00379368, 0.00886523, -0.032241, 0.00344778, -0.0408811, -0.108009, -0.0885381, 
-        0.188561, -0.00370871, 0.00513696, 0.0209449, 0.00474319, -0.00723408, 0.00438388, 
-        -0.0269403, 0.0558082, 0.0161886, 0.00318086, 0.015896, 0.0471729, 0.0196283, 
-        -0.0502782, -0.030055, 0.0417122, -0.0397722, -0.00350024, -0.0106854, 0.00110903, 
-        -0.000313912, 0.0035985, -0.00142121, -0.00383637, 0.0126803, -0.00318278, 0.00334268, 
-        -0.00183491, 0.000112451, -0.0000297228, 0.000269551, 0.00083265, 0.00155334, 
-        0.000302683, -0.0001843, -0.000425399, 0.0000869243, -0.0004659, 0.0000554194
-    ])
-    s_Q, t_Q, u_Q, v_Q = [np.array(x) for x in [
-        [0, 2, 1, 0, 0, 1, 2, 0, 1, 0, 1, 2, 2, 1, 0, 3, 0, 1, 0, 1, 3, 0, 3, 2, 0, 0, 3, 3, 0, 3, 0, 1, 0, 2, 0, 1, 3, 3, 1, 2, 0, 0, 0, 0, 3, 0, 1],
-        [0, 0, 1, 2, 1, 1, 1, 2, 0, 1, 1, 1, 0, 1, 2, 0, 3, 3, 0, 0, 0, 1, 1, 2, 3, 6, 0, 3, 6, 0, 6, 0, 2, 3, 6, 1, 2, 6, 0, 0, 2, 6, 0, 3, 3, 6, 6],
-        [0, 0, 0, 0, 1, 1, 1, 1, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 2, 2, 2, 2, 0, 0, 0, 1, 1, 2, 2, 2, 2, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2, 2],
-        [0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2]
-    ]]
-
-    # Vectorized calculation
-    KT = np.sum(C_T[:, None] * (J**s_T[:, None]) * (P_D**t_T[:, None]) * (AE_AO**u_T[:, None]) * (Z**v_T[:, None]), axis=0)
-    KQ = np.sum(C_Q[:, None] * (J**s_Q[:, None]) * (P_D**t_Q[:, None]) * (AE_AO**u_Q[:, None]) * (Z**v_Q[:, None]), axis=0)
-    
-    return KT, KQ
+	"""
+	Calculates Wageningen B-Series Thrust (KT) and Torque (KQ) coefficients.
+
+	Inputs:
+		AE_AO: Expanded area ratio (Ae/Ao)
+		P_D:   Pitch-diameter ratio (P/D)
+		J:     Advance coefficient (Va / nD) - can be an array
+		Z:     Blade count
+	"""
+	J = np.atleast_1d(np.asarray(J, dtype=np.float64))
+	out = calc_b_series_coeffs_batch(calc_b_series_poly(float(AE_AO), float(P_D), float(Z)), J.ravel())
+	return out[:,0].reshape(J.shape), out[:,1].reshape(J.shape)
+
+def parse_b_series_name(name):
+	# 'B4-70-14' -> (AE/AO 0.70, P/D 1.4, Z 4), the B-series naming of the propeller data sets
+	Z, AE_AO, P_D = name.lstrip('Bb').split('-')
+	return float(AE_AO)/100, float(P_D)/10, int(Z)
 
 if __name__ == '__main__':
-    print(b_series_coeff(0.6, 1.4, [0.4,1], 3))
\ No newline at end of file
+	print(b_series_coeff(0.6, 1.4, [0.4,1], 3))
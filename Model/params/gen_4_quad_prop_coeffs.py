@@ -17,6 +17,21 @@ def calc_4_quad_propeller_coeffs(beta, coeff):
 	C_T_C_Q = (cos_matrix @ A + sin_matrix @ B) @ np.array([[0.01, 0], [0, -0.001]])
 	return C_T_C_Q.squeeze()
 
+def calc_4_quad_propeller_coeffs_grad(beta, coeff):
+	# C_T^*, C_Q^* and their derivatives wrt beta for any beta shape, [..., 2] each
+	k = coeff[:, 0]
+	A = coeff[:, [1,3]]
+	B = coeff[:, [2,4]]
+	scale = np.array([0.01, -0.001])
+
+	beta_matrix = np.asarray(beta)[...,None]*k
+	cos_matrix = np.cos(beta_matrix)
+	sin_matrix = np.sin(beta_matrix)
+
+	C_T_C_Q = (cos_matrix @ A + sin_matrix @ B)*scale
+	dC_T_C_Q = ((-sin_matrix*k) @ A + (cos_matrix*k) @ B)*scale
+	return C_T_C_Q, dC_T_C_Q
+
 def load_fourrier_coeffs(path_coeffs):
 	cols = ['K','T-A(k)','T-B(k)','Q-A(k)','Q-B(k)']
 	try:
@@ -1,82 +1,241 @@
 import numpy as np
 import matplotlib.pyplot as plt
+import multiprocessing as mp
+import os
+import sys
 import time
 
-from scipy.optimize import fsolve
-
 import gen_4_quad_prop_coeffs as FourQuad
+import b_series_coeff as BSeries
+sys.path.append('.')		# run from Model/, for the shared utils
+from utils.cli_utils import get_arg
+
+# propulsor equilibrium tables for load_propulsor_data, one per (motor, propeller, propeller diameter)
+#	run from Model/: python params/gen_propulsor_data.py [--motor=...] [--d=0.10,0.11,0.12] [--points=100,100] [--plot=1]
+#	propellers: four quadrant fourier data sets [--prop=B4-70-14], and/or B-series polynomial designs by name
+#	[--b_series=B4-70-14,B3-55-10] or as the product of [--Z=3,4,5] [--AE_AO=0.55,0.7] [--P_D=0.8,1.0,1.2], --prop= skips fourier
+#	grid_results[rho, vA, V]: rotational speed n (rev/s), thrust T (N), torque Q (Nm), current I (A)
+#	the speed equilibrium is solved by newton over a whole rho slice at once, kept inside a bracket so cells
+#	where the current jumps (torque changing sign) still settle
+
+motors = {
+	# KV (RPM/V), Kt (Nm/A), no load current I0 (A), resistance R0 (Ω)
+	'FlipSky-85165-150': (150, 0.0689, 2.7, 0.0582),
+}
+
+def calc_fourier_thrust_torque(n, rho,vA, d, f_coeffs):
+	# thrust, torque and the torque slope dQ/dn
+	vRot = 0.7*np.pi*n*d
+	vR2 = vRot**2 + vA**2
+	beta = np.atan2(vA,vRot+1e-6)
+	CT_CQ, dCT_CQ = FourQuad.calc_4_quad_propeller_coeffs_grad(beta, f_coeffs)
+	T = 1/2*CT_CQ[...,0]*rho*(np.pi/4*d**2)*vR2
+	Q = 1/2*CT_CQ[...,1]*rho*(np.pi/4*d**3)*vR2
+
+	dvRot = 0.7*np.pi*d
+	dbeta = -vA/((vRot+1e-6)**2 + vA**2)*dvRot
+	dQ = 1/2*rho*(np.pi/4*d**3)*(dCT_CQ[...,1]*dbeta*vR2 + CT_CQ[...,1]*2*vRot*dvRot)
+	return T, Q, dQ
+
+def calc_b_series_thrust_torque(n, rho,vA, d, poly):
+	# KT, KQ with J clamped into the regression range, reverse rotation mirrored (T(-n,-vA) = -T(n,vA))
+	#	J = vA/(n*d) holds for both signs of n, thrust and torque vanish at n = 0 (no windmilling drag)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		J = np.where(n != 0, vA/(n*d), 0.0)
+	J_clip = np.clip(J, 0, BSeries.b_series_J_max)
+	coeffs = BSeries.calc_b_series_coeffs_batch(poly, np.ravel(J_clip)).reshape(np.shape(J) + (4,))
+	KT, KQ = coeffs[...,0], coeffs[...,1]
+	dKQ = np.where(J == J_clip, coeffs[...,3], 0.0)
+	T = np.sign(n)*KT*rho*n**2*d**4
+	Q = np.sign(n)*KQ*rho*n**2*d**5
+	dQ = rho*d**5*np.abs(n)*(2*KQ - J_clip*dKQ)
+	return T, Q, dQ
+
+def get_params(n, rho,vA, d, propeller, motor):
+	# thrust, torque, current and the current slope dI/dn, propeller ('fourier', f_coeffs) or ('b_series', poly)
+	kind, data = propeller
+	_, Kt, I0, _ = motor
+	if kind == 'fourier':
+		T, Q, dQ = calc_fourier_thrust_torque(n, rho,vA, d, data)
+	else:
+		T, Q, dQ = calc_b_series_thrust_torque(n, rho,vA, d, data)
+	I = Q/Kt + np.copysign(I0, Q)
+	return T, Q, I, dQ/Kt
+
+def solve_speed(rho, vA, V, d, propeller, motor, tol=1e-10, max_iter=100):
+	# n where the motor speed from the back emf matches, over whole arrays
+	#	residual falls from + to - with n, newton steps leaving the bracket are replaced by bisection
+	#	only the cells still iterating are evaluated, most settle in a few steps
+	KV, _, _, R0 = motor
+	Ke = 60/(2*np.pi*KV)
+	shape = np.broadcast(rho, vA, V).shape
+	rho, vA, V = (np.broadcast_to(x, shape).ravel() for x in (rho, vA, V))
+
+	def residual(n, k):
+		_, _, I, dI = get_params(n, rho[k],vA[k], d, propeller, motor)
+		return (V[k] - I*R0)/(Ke*2*np.pi) - n, -R0*dI/(Ke*2*np.pi) - 1
+
+	n = V/(Ke*2*np.pi)		# no load speed
+	step = np.maximum(1.0, 0.1*np.abs(n))
+	lo, hi = n - step, n + step
+	k = np.arange(len(n))
+	for _ in range(60):
+		f_lo, f_hi = residual(lo[k], k)[0], residual(hi[k], k)[0]
+		expand_lo, expand_hi = f_lo < 0, f_hi > 0
+		step[k] *= 2
+		lo[k[expand_lo]] -= step[k[expand_lo]]
+		hi[k[expand_hi]] += step[k[expand_hi]]
+		k = k[expand_lo | expand_hi]
+		if len(k) == 0:
+			break
+
+	iterations = np.zeros(len(n), dtype=np.int64)
+	f, df = residual(n, slice(None))
+	k = np.arange(len(n))
+	for _ in range(max_iter):
+		lo[k] = np.where(f > 0, n[k], lo[k])
+		hi[k] = np.where(f < 0, n[k], hi[k])
+		scale = tol*np.maximum(1.0, np.abs(n[k]))
+		active = (np.abs(f) > scale) & (hi[k] - lo[k] > scale)
+		k, f, df = k[active], f[active], df[active]
+		if len(k) == 0:
+			break
+		with np.errstate(divide='ignore', invalid='ignore'):
+			n_newton = n[k] - f/df
+		outside = ~((n_newton > lo[k]) & (n_newton < hi[k]))
+		n[k] = np.where(outside, (lo[k] + hi[k])/2, n_newton)
+		iterations[k] += 1
+		f, df = residual(n[k], k)
+	return n.reshape(shape), residual(n, slice(None))[0].reshape(shape), iterations.reshape(shape)
+
+def calc_rho_slice(rho, vA_range, V_range, d, propeller, motor):
+	# [n_vA, n_V, 4] table slice and the per cell residual (rev/s) and iteration count
+	vA, V = np.meshgrid(vA_range, V_range, indexing='ij')
+	n, residual, iterations = solve_speed(rho, vA, V, d, propeller, motor)
+	T, Q, I, _ = get_params(n, rho,vA, d, propeller, motor)
+	return np.stack((n, T, Q, I), axis=-1), residual, iterations
+
+def init_worker(rho_range, vA_range, V_range, configs):
+	global worker_args
+	worker_args = (rho_range, vA_range, V_range, configs)
+
+def run_slice(task):
+	k, i = task
+	rho_range, vA_range, V_range, configs = worker_args
+	motor, _, propeller, d = configs[k]
+	return k, i, calc_rho_slice(rho_range[i], vA_range, V_range, d, propeller, motors[motor])
+
+def gen_propulsor_tables(rho_range, vA_range, V_range, configs, workers=None):
+	# one (table, residual, iterations) per (motor, propeller name, propeller, d) config,
+	#	rho slices of every config over a process pool
+	shape = (len(rho_range), len(vA_range), len(V_range))
+	results = [(np.empty(shape + (4,)), np.empty(shape), np.empty(shape, dtype=np.int64)) for _ in configs]
+	tasks = [(k, i) for k in range(len(configs)) for i in range(len(rho_range))]
+	workers = min(workers or os.cpu_count() or 1, len(tasks))
+	init_args = (rho_range, vA_range, V_range, configs)
+
+	def store(k, i, slice_results):
+		for result, result_slice in zip(results[k], slice_results):
+			result[i] = result_slice
+
+	if workers <= 1:
+		init_worker(*init_args)
+		for k, i, slice_results in map(run_slice, tasks):
+			store(k, i, slice_results)
+	else:
+		with mp.Pool(workers, initializer=init_worker, initargs=init_args) as pool:
+			for k, i, slice_results in pool.imap_unordered(run_slice, tasks):
+				store(k, i, slice_results)
+	return results
+
+def report_convergence(table, residual, iterations, rho_range):
+	# cells left with a residual have the torque changing sign inside the final bracket,
+	#	the current jumps by 2*I0 there and the speed settles at zero torque
+	for i, rho in enumerate(rho_range):
+		jump = np.abs(residual[i]) > 1e-6*np.maximum(1.0, np.abs(table[i,:,:,0]))
+		max_residual = np.max(np.abs(residual[i][~jump]), initial=0.0)
+		print(f'INFO: rho={rho:g}: iterations mean {np.mean(iterations[i]):.1f} max {np.max(iterations[i])}, '
+			f'max residual {max_residual:.1e} rev/s, {np.sum(jump)} cell(s) on the current jump')
+
+def get_list(name, default):
+	return [item for item in get_arg(name, default).split(',') if item]
+
+def load_propellers():
+	# (name, ('fourier', f_coeffs) or ('b_series', poly)), None on a load error
+	propellers = []
+	for prop in get_list('prop', 'B4-70-14'):
+		f_coeffs = FourQuad.load_fourrier_coeffs(f'./params/4 quad prop data/fourier coeffs/{prop}.txt')
+		if f_coeffs is None:
+			return None
+		propellers.append((prop, ('fourier', f_coeffs)))
+	designs = [BSeries.parse_b_series_name(name) for name in get_list('b_series', '')]
+	sweep = [get_list(key, '') for key in ('AE_AO', 'P_D', 'Z')]
+	if all(sweep):
+		designs += [(float(AE_AO), float(P_D), int(Z)) for AE_AO in sweep[0] for P_D in sweep[1] for Z in sweep[2]]
+	elif any(sweep):
+		print('ERROR: a B-series sweep needs --AE_AO, --P_D and --Z')
+		return None
+	for AE_AO, P_D, Z in designs:
+		poly = BSeries.calc_b_series_poly(AE_AO, P_D, float(Z))
+		propellers.append((f'B{Z}-{AE_AO*100:g}-{P_D*10:g}_poly', ('b_series', poly)))
+	return propellers
 
 def main():
-	prop_path = './params/4 quad prop data/fourier coeffs/B4-70-14.txt'
-	KV = 150		# motor speed constant (RPM/V)
-	Kt = 0.0689		# motor torque constant (Nm/A)
-	I0 = 2.7		# no load current (A)
-	R0 = 0.0582		# motor resistance (Ω)
-
-	d = 0.10		# propeller diameter (m)
-	
-	output_path = f'./params/propulsor data/FlipSky-85165-150_B4-70-14_{int(d*100)}.npz'
-	
-	Ke = 60/(2*np.pi*KV)
+	output_dir = get_arg('output_dir', './params/propulsor data/')
+	motor_names = get_list('motor', 'FlipSky-85165-150')
+	d_list = [float(d) for d in get_list('d', '0.10,0.11,0.12')]		# propeller diameters (m)
+	workers = get_arg('workers', 0) or None
 
-	plot = True
-	export = True
+	plot = bool(get_arg('plot', 0))
+	export = bool(get_arg('export', 1))
 
-	f_coeffs = FourQuad.load_fourrier_coeffs(prop_path)
+	unknown = [motor for motor in motor_names if motor not in motors]
+	if unknown:
+		print(f'ERROR: unknown motor(s) {unknown}, known {list(motors)}')
+		return
 
+	propellers = load_propellers()
+	if propellers is None:
+		return
+
+	n_vA, n_V = map(int, get_arg('points', '100,100').split(','))
 	rho_range = np.array([0.8, 1.4, 995, 1100])
-	vA_range = np.linspace(-20,20,100)
-	V_range = np.linspace(-55,55,100)
-
-	table = np.zeros((len(rho_range), len(vA_range), len(V_range), 4))
-
-	tik = time.perf_counter_ns()
-	
-	def get_params(n, rho,vA):
-		vRot = 0.7*np.pi*n*d
-		vR2 = vRot**2 + vA**2
-		beta = np.atan2(vA,vRot+1e-6)
-		CT_CQ = FourQuad.calc_4_quad_propeller_coeffs(beta, f_coeffs)
-		T = 1/2*CT_CQ[:,0]*rho*(np.pi/4*d**2)*vR2
-		Q = 1/2*CT_CQ[:,1]*rho*(np.pi/4*d**3)*vR2
-		I = Q/Kt + np.copysign(I0, Q)
-
-		return np.array([T,Q,I])
-
-	def residual(n, rho,vA,V):
-		_,_,I = get_params(n, rho,vA)
-		n_calc = (V-I*R0)/(Ke*2*np.pi)
-		return n_calc - n
-
-	for i,rho in enumerate(rho_range):
-		for j,vA in enumerate(vA_range):
-			vA_vec = np.full(V_range.shape, vA)
-			n_guess = V_range/(Ke*2*np.pi)
-			sol = fsolve(residual, n_guess, args=(rho,vA_vec,V_range))
-			table[i,j, :,0] = sol # type: ignore
-			table[i,j, :,1:4] = get_params(sol, rho,vA).T # type: ignore
-
-	tok = time.perf_counter_ns()
-	print(f'INFO: finished calculating in {(tok-tik)/10e9:.2f} s')
+	vA_range = np.linspace(-20,20,n_vA)
+	V_range = np.linspace(-55,55,n_V)
+
+	configs = [(motor, prop, propeller, d) for motor in motor_names for prop, propeller in propellers for d in d_list]
+
+	tik = time.perf_counter()
+	results = gen_propulsor_tables(rho_range, vA_range, V_range, configs, workers)
+	print(f'INFO: finished calculating {len(configs)} table(s) in {time.perf_counter()-tik:.2f} s')
 
 	if export:
-		try:
-			np.savez(output_path, grid_results=table, rho_range=rho_range, vA_range=vA_range, V_range=V_range, d=d)
-			print(f'INFO: Successfully exported to "{output_path}"')
-		except Exception as e:
-			print(f'ERROR: Failed to export - {e}')
+		os.makedirs(output_dir, exist_ok=True)
+	for (motor, prop, _, d), (table, residual, iterations) in zip(configs, results):
+		output_path = os.path.join(output_dir, f'{motor}_{prop}_{round(d*100)}.npz')
+		print(f'INFO: {motor} {prop} d={d:g} m')
+		report_convergence(table, residual, iterations, rho_range)
+
+		if export:
+			try:
+				np.savez(output_path, grid_results=table, rho_range=rho_range, vA_range=vA_range, V_range=V_range, d=d,
+					residual=residual, iterations=iterations)
+				print(f'INFO: Successfully exported to "{output_path}"')
+			except Exception as e:
+				print(f'ERROR: Failed to export - {e}')
+
+		if plot:
+			for i,rho in enumerate(rho_range):
+				vA_grid, V_grid = np.meshgrid(vA_range, V_range, indexing='ij')
+
+				plt.figure()
+				plt.pcolormesh(vA_grid, V_grid, table[i,:,:,0], shading='auto', cmap='magma')
+				plt.colorbar(label='Rotational Speed $n$ [rev/s]')
+				plt.xlabel('$v_A$ [m/s]')
+				plt.ylabel('Voltage $V$ [V]')
+				plt.title(f'Propulsor Operating Speed ({prop}, $rho$={rho}, d={d})')
 
 	if plot:
-		for i,rho in enumerate(rho_range):
-			vA_grid, V_grid = np.meshgrid(vA_range, V_range, indexing='ij')
-
-			plt.figure()
-			plt.pcolormesh(vA_grid, V_grid, table[i,:,:,0], shading='auto', cmap='magma')
-			plt.colorbar(label='Rotational Speed $n$ [rev/s]')
-			plt.xlabel('$v_A$ [m/s]')
-			plt.ylabel('Voltage $V$ [V]')
-			plt.title(f'Propulsor Operating Speed ($rho$={rho})')
-		
 		plt.show()
 
-if __name__ == '__main__': main()
\ No newline at end of file
+if __name__ == '__main__': main()
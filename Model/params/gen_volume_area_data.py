@@ -0,0 +1,158 @@
+import numpy as np
+import multiprocessing as mp
+import os
+import sys
+import time
+from math import sin, cos, sqrt
+from numba import njit
+
+sys.path.append('.')		# run from Model/, for the shared utils
+from utils.cli_utils import get_arg
+
+# volume area grids for load_volume_area_data from a closed triangle mesh in the keel transom frame (X front, Y right, Z down)
+#	run from Model/: python params/gen_volume_area_data.py [--mesh=...] [--output=...] [--roll=0,60] [--points=26,31,31]
+#	grid_results[z, pitch, roll]: submerged volume, wetted area, volume center[3], wetted area center[3] (keel transom frame)
+#	z is the world depth of the frame origin, pitch and roll in degrees, as in calc_base_query
+
+def load_stl(path, scale=1.0):
+	# triangles [n,3,3], binary or ascii
+	with open(path, 'rb') as file:
+		data = file.read()
+	n_binary = int.from_bytes(data[80:84], 'little') if len(data) >= 84 else -1
+	if len(data) == 84 + 50*n_binary:
+		record = np.dtype([('normal', '<f4', 3), ('vertices', '<f4', (3,3)), ('attribute', '<u2')])
+		tris = np.frombuffer(data, dtype=record, count=n_binary, offset=84)['vertices'].astype(np.float64)
+	else:
+		vertices = [line.split()[1:4] for line in data.decode().splitlines() if line.strip().startswith('vertex')]
+		tris = np.array(vertices, dtype=np.float64).reshape(-1, 3, 3)
+	return np.ascontiguousarray(tris*scale)
+
+def count_open_edges(tris, decimals=7):
+	# edges used by a single triangle, fine above the highest waterline (e.g. an open deck)
+	_, index = np.unique(np.round(tris, decimals).reshape(-1, 3), axis=0, return_inverse=True)
+	index = index.reshape(-1, 3)
+	edges = np.sort(np.concatenate((index[:,[0,1]], index[:,[1,2]], index[:,[2,0]])), axis=1)
+	_, counts = np.unique(edges, axis=0, return_counts=True)
+	return int(np.sum(counts == 1))
+
+@njit(cache=True)
+def calc_volume_area(tris, z, pitch, roll):
+	# every triangle clipped to the submerged side, angles in radians
+	#	volume from tetrahedra with their apex on the waterplane, so the open cut adds nothing
+	c = np.array([-sin(pitch), cos(pitch)*sin(roll), cos(pitch)*cos(roll)])		# world z of a body vector, row 2 of C0b
+	apex = -z*c
+	poly = np.empty((4,3))
+	out = np.zeros(8)
+	for t in range(len(tris)):
+		n = 0
+		for i in range(3):
+			p = tris[t,i]
+			q = tris[t,(i+1)%3]
+			d_p = z + c[0]*p[0] + c[1]*p[1] + c[2]*p[2]
+			d_q = z + c[0]*q[0] + c[1]*q[1] + c[2]*q[2]
+			if d_p >= 0:
+				for j in range(3):
+					poly[n,j] = p[j] - apex[j]
+				n += 1
+			if (d_p >= 0) != (d_q >= 0):
+				f = d_p/(d_p - d_q)
+				for j in range(3):
+					poly[n,j] = p[j] + (q[j] - p[j])*f - apex[j]
+				n += 1
+		# fan of the clipped polygon, relative to the apex
+		for k in range(1, n-1):
+			a0, a1, a2 = poly[0,0], poly[0,1], poly[0,2]
+			b0, b1, b2 = poly[k,0], poly[k,1], poly[k,2]
+			e0, e1, e2 = poly[k+1,0], poly[k+1,1], poly[k+1,2]
+			vol = (a0*(b1*e2 - b2*e1) + a1*(b2*e0 - b0*e2) + a2*(b0*e1 - b1*e0))/6
+			u0, u1, u2 = b0 - a0, b1 - a1, b2 - a2
+			v0, v1, v2 = e0 - a0, e1 - a1, e2 - a2
+			area = sqrt((u1*v2 - u2*v1)**2 + (u2*v0 - u0*v2)**2 + (u0*v1 - u1*v0)**2)/2
+			out[0] += vol
+			out[1] += area
+			for j in range(3):
+				out[2+j] += vol*(4*apex[j] + poly[0,j] + poly[k,j] + poly[k+1,j])/4
+				out[5+j] += area*(3*apex[j] + poly[0,j] + poly[k,j] + poly[k+1,j])/3
+	if out[0] > 0:
+		out[2:5] /= out[0]
+	else:
+		out[2:5] = 0.0
+	if out[1] > 0:
+		out[5:8] /= out[1]
+	return out
+
+@njit(cache=True)
+def calc_pitch_slice(tris, z_range, pitch, roll_range):
+	# [n_z, n_roll, 8] at one pitch, degrees
+	out = np.empty((len(z_range), len(roll_range), 8))
+	for i in range(len(z_range)):
+		for k in range(len(roll_range)):
+			out[i,k] = calc_volume_area(tris, z_range[i], pitch*np.pi/180, roll_range[k]*np.pi/180)
+	return out
+
+def init_worker(tris, z_range, roll_range):
+	global worker_args
+	worker_args = (tris, z_range, roll_range)
+
+def run_pitch(j_pitch):
+	j, pitch = j_pitch
+	tris, z_range, roll_range = worker_args
+	return j, calc_pitch_slice(tris, z_range, pitch, roll_range)
+
+def gen_volume_area_grid(tris, z_range, pitch_range, roll_range, workers=None):
+	# grid_results [n_z, n_pitch, n_roll, 8], pitch slices over a process pool
+	grid = np.empty((len(z_range), len(pitch_range), len(roll_range), 8))
+	tasks = list(enumerate(pitch_range))
+	workers = min(workers or os.cpu_count() or 1, len(tasks))
+	init_args = (tris, z_range, roll_range)
+	if workers <= 1:
+		init_worker(*init_args)
+		for j, grid_slice in map(run_pitch, tasks):
+			grid[:,j] = grid_slice
+	else:
+		with mp.Pool(workers, initializer=init_worker, initargs=init_args) as pool:
+			for j, grid_slice in pool.imap_unordered(run_pitch, tasks):
+				grid[:,j] = grid_slice
+	return grid
+
+def get_range(name, default, n):
+	lo, hi = map(float, get_arg(name, default).split(','))
+	return np.linspace(lo, hi, n)
+
+def main():
+	mesh_path = get_arg('mesh', './visualization/resources/RBird_Hull_Remesh.stl')
+	output_path = get_arg('output', './params/hull_data_regular_grid.npz')
+	scale = get_arg('scale', 1.0)			# mesh units to m
+	workers = get_arg('workers', 0) or None
+
+	# symmetric bodies only need roll >= 0, the model mirrors the rest
+	n_z, n_pitch, n_roll = map(int, get_arg('points', '26,31,31').split(','))
+	z_range = get_range('z', '-0.1,0.4', n_z)
+	pitch_range = get_range('pitch', '-30,30', n_pitch)
+	roll_range = get_range('roll', '0,60', n_roll)
+
+	tris = load_stl(mesh_path, scale)
+	open_edges = count_open_edges(tris)
+	print(f'INFO: loaded {len(tris)} triangles from "{mesh_path}"')
+	if open_edges > 0:
+		print(f'WARNING: {open_edges} open edge(s), volumes are only valid while the openings stay dry')
+	# the signed tetrahedra assume outward wound triangles, an inward wound mesh is negative fully submerged
+	volume = calc_volume_area(tris, 1.0 - np.min(tris[:,:,2]), 0.0, 0.0)[0]
+	if volume < 0:
+		print(f'WARNING: inward wound triangles (submerged volume {volume:.4g}), flipping the winding')
+		tris = np.ascontiguousarray(tris[:,::-1])
+	elif volume == 0:
+		print(f'ERROR: mesh encloses no volume, check "{mesh_path}" and its scale')
+		return
+
+	tik = time.perf_counter()
+	grid = gen_volume_area_grid(tris, z_range, pitch_range, roll_range, workers)
+	print(f'INFO: finished calculating {grid.shape[:3]} points in {time.perf_counter()-tik:.2f} s')
+
+	try:
+		np.savez(output_path, grid_results=grid, z_range=z_range, pitch_range=pitch_range, roll_range=roll_range)
+		print(f'INFO: Successfully exported to "{output_path}"')
+	except Exception as e:
+		print(f'ERROR: Failed to export - {e}')
+
+if __name__ == '__main__': main()
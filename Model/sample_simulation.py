@@ -4,20 +4,20 @@ import time
 
 from utils.utils import *
 import model_RBird
+from trim import load_trim_table
 
-model = model_RBird.make_default()
+model = model_RBird.make_default(dynamic_propulsor=True)
 
 def get_state_dots(t, states):
-	model.set_state(states)
-	model.set_input(get_inputs(t))
-	model.calc_state_dot()
-	return model.get_state_dot()
+	return model.calc_state_dot_fused(states, get_inputs(t))
 
 def get_inputs(t):
 	return np.zeros(2)
 
 t_span = (0, 10)
-states0 = model.get_state()
+# start from trim for the initial inputs when a table is cached, skipping the settling transient
+trim_table = load_trim_table(model)
+states0 = model.get_state() if trim_table is None else trim_table.get_state(get_inputs(0)[1], get_inputs(0)[0])
 
 print('INFO: solving ODE...')
 tik = time.perf_counter()
@@ -1,93 +1,284 @@
+import time
+startup_tik = time.perf_counter()
 import asyncio
+import collections
 import websockets
 import json
 import numpy as np
 
 import os
+import sys
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
 os.environ['PYTHONWARNINGS'] = 'ignore'
-import pygame
 
-import model_RBird as model_RB
-from simulation import Simulation
+from warmup import StartupReport, warm_up
+from sim_worker import SimulationWorker, FrameScheduler, LoopLatency
+
+# the model, numba, scipy and pygame load after the server is listening, see start_sim
+report = StartupReport(startup_tik)
+report.mark('imports')
 
 # --- Simulation Logic --
 
-sim = Simulation(model_RB.make_default())
-sockets = set()
+sim = None
+worker = None
+# 20 fixed ticks per second, each given 80% of its period to integrate, missed ticks caught up while within budget
+scheduler = FrameScheduler(tick_rate=20, budget=0.8, policy='catch_up')
+sim_ready = asyncio.Event()
+latency = LoopLatency()
+
+class Client:
+	# a connection's telemetry settings and outgoing queue, json with every channel on every frame until it asks otherwise
+	#	its own sender task drains the queue, so a slow or stalled client only delays itself, telemetry frames beyond
+	#	max_pending drop the oldest one (latest state wins), build messages and replies are never dropped
+	def __init__(self, socket, max_pending=2, window=200):
+		self.socket = socket
+		self.encoding = 'json'
+		# subscribed channel mask (None, all) and rate in Hz (None, every frame)
+		self.channels = None
+		self.rate = None
+		self.next_send = 0.0
+		self.max_pending = max_pending
+		# (message, droppable, queued at)
+		self.pending = collections.deque()
+		self.pending_frames = 0
+		self.ready = asyncio.Event()
+		self.lagging = False
+		# queued until handed to the transport, over the recent window, counts since connecting
+		self.latencies = collections.deque(maxlen=window)
+		self.sent = 0
+		self.dropped = 0
+		self.max_depth = 0
+		self.task = None
+
+	def get_address(self):
+		address = self.socket.remote_address
+		return f'{address[0]}:{address[1]}' if address else 'unknown'
+
+	def is_due(self, now):
+		if self.rate is None:
+			return True
+		# frames come on the tick timeline, so a frame within a quarter tick of the slot takes it
+		if now < self.next_send - 0.25/scheduler.tick_rate:
+			return False
+		self.next_send = max(self.next_send, now - 1/self.rate) + 1/self.rate
+		return True
+
+	def send(self, message, droppable=False):
+		# never blocks, the sender task picks it up
+		if droppable and self.pending_frames >= self.max_pending:
+			for i, (_, pending_droppable, _) in enumerate(self.pending):
+				if pending_droppable:
+					del self.pending[i]
+					break
+			self.pending_frames -= 1
+			self.dropped += 1
+			if not self.lagging:
+				print(f'WARNING: client {self.get_address()} lagging, dropping telemetry frames')
+			self.lagging = True
+		self.pending.append((message, droppable, time.perf_counter()))
+		self.pending_frames += droppable
+		self.max_depth = max(self.max_depth, len(self.pending))
+		self.ready.set()
+
+	async def run(self):
+		try:
+			while True:
+				await self.ready.wait()
+				self.ready.clear()
+				while self.pending:
+					message, droppable, queued = self.pending.popleft()
+					self.pending_frames -= droppable
+					await self.socket.send(message)
+					self.latencies.append(time.perf_counter() - queued)
+					self.sent += 1
+				if self.lagging:
+					print(f'INFO: client {self.get_address()} caught up, {self.dropped} frame(s) dropped so far')
+				self.lagging = False
+		except (websockets.ConnectionClosed, asyncio.CancelledError):
+			pass
+
+	def summary(self):
+		# ms, send latency over the recent window, a stalled send shows as the age of the oldest queued message
+		latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+		pending = list(self.pending)
+		return {
+			'address': self.get_address(),
+			'encoding': self.encoding,
+			'depth': len(pending),
+			'oldest': (time.perf_counter() - pending[0][2])*1e3 if pending else 0.0,
+			'max_depth': self.max_depth,
+			'sent': self.sent,
+			'dropped': self.dropped,
+			'latency_mean': float(np.mean(latencies))*1e3,
+			'latency_p99': float(np.percentile(latencies, 99))*1e3,
+			'latency_max': float(np.max(latencies))*1e3
+		}
+
+	def print(self):
+		stats = self.summary()
+		print(f'INFO: client {stats["address"]} ({stats["encoding"]}) - queue depth {stats["depth"]} '
+			f'(max {stats["max_depth"]}, oldest {stats["oldest"]:.0f} ms), {stats["sent"]} sent, {stats["dropped"]} dropped, '
+			f'send latency mean {stats["latency_mean"]:.2f} ms, p99 {stats["latency_p99"]:.2f} ms, max {stats["latency_max"]:.2f} ms')
+
+clients = {}
+
+def update_subscriptions():
+	# the worker fills only the union of the subscribed channels, as often as the fastest subscriber needs
+	subscribed = list(clients.values())
+	if not subscribed or any(client.channels is None for client in subscribed):
+		worker.channels = None
+	else:
+		channels = 0
+		for client in subscribed:
+			channels |= client.channels
+		worker.channels = channels
+	if not subscribed or any(client.rate is None for client in subscribed):
+		worker.publish_rate = None
+	else:
+		worker.publish_rate = max(client.rate for client in subscribed)
+
+def subscribe(client, channels, rate):
+	from simulation import get_channel_mask, telem_channels
+	unknown = [channel for channel in channels or [] if channel not in telem_channels]
+	if unknown:
+		print(f'WARNING: unknown telemetry channel(s) requested - {unknown}')
+		return
+	client.channels = None if channels is None else get_channel_mask(channels)
+	client.rate = None if rate is None else float(rate)
+	client.next_send = 0.0
+	update_subscriptions()
+	# a frame with the new channels for everyone, also while paused
+	worker.refresh()
 
-async def broadcast_telem():
-	for socket in sockets:
-		await socket.send(sim.telem)
+# set from the simulation thread when a frame is published, see notify_frame
+frame_ready = asyncio.Event()
+build_pending = False
+forced_pending = False
+
+def notify_frame(build, forced):
+	global build_pending, forced_pending
+	build_pending = build_pending or build
+	forced_pending = forced_pending or forced
+	frame_ready.set()
+
+async def broadcast_loop():
+	# fans the latest published frame out to the queue of every client due for one, serialised once per encoding and
+	#	channel set, frames published meanwhile are skipped, frames answering commands go to every client
+	global build_pending, forced_pending
+	try:
+		while True:
+			await frame_ready.wait()
+			frame_ready.clear()
+			build = sim.build_telem if build_pending else None
+			forced = forced_pending
+			build_pending = forced_pending = False
+			seq, frame, mask = sim.read_frame()
+			now = time.perf_counter()
+			telems = {}
+			for client in list(clients.values()):
+				if not (client.is_due(now) or forced or build is not None):
+					continue
+				key = (client.encoding, mask if client.channels is None else mask & client.channels)
+				if key not in telems:
+					telems[key] = sim.encode_telem(seq, frame, key[1], key[0])
+				if build is not None:
+					client.send(build)
+				client.send(telems[key], droppable=True)
+	except asyncio.CancelledError:
+		print('INFO: broadcast terminated')
+
+def start_sim():
+	# heavy startup stages, run off the event loop so connections are accepted meanwhile
+	global sim
+	with report.stage('import model'):
+		import model_RBird as model_RB
+		from simulation import Simulation
+	with report.stage('load model'):
+		model = model_RB.make_default(dynamic_propulsor=True)
+	with report.stage('simulation'):
+		# motor current and shaft speed integrated as states, multirate splitting keeps the frame cost low
+		sim = Simulation(model, method='IMEX')
+	# the active method ahead of the first frame, the rest in the background from main
+	warm_up(model, [sim.method], report)
+	with report.stage('joystick'):
+		link_controller()
 
 # --- Joystick Link ---
-pygame.init()
-pygame.joystick.init()
 controller = None
 
-if pygame.joystick.get_count() == 0:
-	print(f'INFO: no controller detected')
-else:
-	try:
-		controller = pygame.joystick.Joystick(0)
-		controller.init()
-		if not controller.get_init():
-			print(f'ERROR: controller initialization failed')
-		else:	
-			print(f'INFO: controller linked - "{controller.get_name()}"')
-	except Exception as e:
-		print(f'ERROR: controller link failed - {e}')
+def link_controller():
+	global controller
+	import pygame
+	pygame.init()
+	pygame.joystick.init()
+
+	if pygame.joystick.get_count() == 0:
+		print(f'INFO: no controller detected')
+	else:
+		try:
+			controller = pygame.joystick.Joystick(0)
+			controller.init()
+			if not controller.get_init():
+				print(f'ERROR: controller initialization failed')
+			else:	
+				print(f'INFO: controller linked - "{controller.get_name()}"')
+		except Exception as e:
+			print(f'ERROR: controller link failed - {e}')
 # --- Simulation Handlers ---
-async def pause_sim():
-	sim.pause()
+# queued to the simulation thread, each followed by a published frame
+def pause_sim():
 	print(f'INFO: pausing simulation')
-	sim.set_telemetry()
-	
-	await broadcast_telem()
+	worker.submit(sim.pause)
 
-async def resume_sim():
-	sim.resume()
+def resume_sim():
 	print(f'INFO: resuming simulation')
+	worker.submit(sim.resume)
 
-async def reset_sim():
-	print(f'INFO: resetting simulation')
-	sim.reset()
-	
-	await broadcast_telem()
+def reset_sim(trim=False):
+	print(f'INFO: resetting simulation{" to trim" if trim else ""}')
+	worker.submit(sim.reset, trim)
 
-async def reinit_sim():
+def reinit_sim():
 	print(f'INFO: re-initializing simulation')
-	sim.pause()
-	sim.set_model(model_RB.make_default())
+	worker.submit(reinit, build=True)
 
-	sim.model.calc_state_dot()
-	sim.set_telemetry()
+def step_sim(dt):
+	print(f'INFO: stepping simulation by {dt} second(s)')
+	worker.submit(sim.step, dt)
 
-	for socket in sockets:
-		await socket.send(sim.build_telem)
-		await socket.send(sim.telem)
+def set_method(input_method):
+	worker.submit(apply_method, input_method)
 
-async def step_sim(dt):
-	print(f'INFO: stepping simulation by {dt} second(s)')
-	sim.step(dt)
+def set_state(state, value):
+	worker.submit(apply_state, state, value)
 
-	sim.model.calc_state_dot()
-	sim.set_telemetry()
+def export_telem():
+	worker.submit(write_telem)
 
-	await broadcast_telem()
+# --- Simulation Thread Commands ---
+def reinit():
+	sim.pause()
+	import model_RBird as model_RB
+	sim.set_model(model_RB.make_default(dynamic_propulsor=True))
 
-async def set_method(input_method):
+def apply_method(input_method):
 	method = [m for m in sim.valid_methods if m.casefold() == input_method.casefold()]
 	if len(method) == 1:
 		sim.method = method[0]
 		print(f'INFO: setting integration method to {sim.method}')
 	else:
 		print(f'WARNING: invalid integration method requested - {input_method}')
-	
-	sim.set_telemetry()
-	await broadcast_telem()
 
-async def export_telem():
+def apply_state(state, value):
+	if state in ('U', 'omega', 'Phi', 'r'): sim.reset_solver()
+	if state == 'U': sim.model.U = np.array([value['x'],value['y'],value['z']])
+	elif state == 'omega': sim.model.omega = np.array([value['x'],value['y'],value['z']])*np.pi/180
+	elif state == 'Phi': sim.model.Phi = np.array([value['x'],value['y'],value['z']])*np.pi/180
+	elif state == 'r': sim.model.r = np.array([value['x'],value['y'],value['z']/100])
+	elif state == 'rate': sim.base_rate = value
+
+def write_telem():
 	try:
 		sim.set_formatted_telem()
 		path = f'telem/telem_{sim.elapsed:.4f}.txt'
@@ -102,10 +293,14 @@ async def export_telem():
 
 # --- Network Handlers ---
 async def handler(socket: websockets.ServerConnection):
-	sockets.add(socket)
+	client = Client(socket)
+	clients[socket] = client
+	client.task = asyncio.create_task(client.run())
 	print(f'INFO: connected to {socket.remote_address}')
-	await socket.send(sim.build_telem)
-	await socket.send(sim.telem)
+	await sim_ready.wait()
+	update_subscriptions()
+	client.send(sim.build_telem)
+	client.send(sim.read_telem(), droppable=True)
 	try:
 		async for message in socket:
 			data = json.loads(message)
@@ -113,39 +308,33 @@ async def handler(socket: websockets.ServerConnection):
 				dataType = data['type']
 				if dataType == 'set':
 					state, value = data['state'], data['value']
-					if state == 'U': sim.model.U = np.array([value['x'],value['y'],value['z']])
-					elif state == 'omega': sim.model.omega = np.array([value['x'],value['y'],value['z']])*np.pi/180
-					elif state == 'Phi': sim.model.Phi = np.array([value['x'],value['y'],value['z']])*np.pi/180
-					elif state == 'r': sim.model.r = np.array([value['x'],value['y'],value['z']/100])
-					elif state == 'rate': sim.base_rate = value
-					elif state == 'method': await set_method(value)
+					if state in ('U', 'omega', 'Phi', 'r', 'rate'): set_state(state, value)
+					elif state == 'method': set_method(value)
 					elif state == 'input':
-						psi_ra = -value['x']*sim.model.psi_ra_max
-						V = value['y']*sim.model.V_max
-						if sim.is_running():
-							sim.input_queued = True
-							sim.psi_ra = psi_ra
-							sim.V = V
-						else:
-							sim.model.psi_ra = psi_ra
-							sim.model.propulsor.V = V
+						worker.set_input(-value['x']*sim.model.psi_ra_max, value['y']*sim.model.V_max)
 					else: print(f'WARNING: unknown state set request - {state} = {value}')
-					if not sim.is_running():
-						sim.model.calc_state_dot()
-						sim.set_telemetry()
-
-						await broadcast_telem()
 				elif dataType == 'sim':
-					if sim.is_running(): await pause_sim()
-					else: await resume_sim()
+					if sim.is_running(): pause_sim()
+					else: resume_sim()
 				elif dataType == 'step':
-					await step_sim(data['dt'])
+					step_sim(data['dt'])
 				elif dataType == 'export':
-					await export_telem()
+					export_telem()
 				elif dataType == 'reset':
-					await reset_sim()
+					reset_sim(data.get('trim', False))
 				elif dataType == 'reinit':
-					await reinit_sim()
+					reinit_sim()
+				elif dataType == 'encoding':
+					if data['value'] in ('json', 'binary'):
+						client.encoding = data['value']
+						client.send(sim.read_telem(client.encoding, client.channels), droppable=True)
+					else:
+						print(f'WARNING: unknown telemetry encoding requested - {data["value"]}')
+				elif dataType == 'subscribe':
+					subscribe(client, data.get('channels'), data.get('rate'))
+				elif dataType == 'stats':
+					client.send(json.dumps({'type': 'stats', 'loop_latency': latency.summary(),
+						'frames': scheduler.summary(), 'clients': [other.summary() for other in clients.values()]}))
 				else:
 					print(f'WARNING: unknown data received - {data}')
 			except Exception as e:
@@ -153,33 +342,16 @@ async def handler(socket: websockets.ServerConnection):
 	except websockets.ConnectionClosed:
 		pass
 	finally:
-		sockets.remove(socket)
+		del clients[socket]
+		client.task.cancel()
+		if worker is not None:
+			update_subscriptions()
 		print(f'INFO: lost connection to {socket.remote_address}')
-		if not sockets and sim.is_running():
-			sim.pause()
+		if not clients and sim.is_running():
+			worker.submit(sim.pause)
 			print(f'INFO: no remaining sockets, pausing simulation')
 
 # --- Background Loops ---
-async def simulation_loop():
-	loop_rate = 100
-	step_rate = 20
-	try:
-		while True:
-			# step and transmit telemetry
-			if sim.get_dt() > 1/step_rate:
-				if sim.is_running(): 
-					sim.step()
-
-				if sim.is_running() or controller:
-					sim.model.calc_state_dot()
-					sim.set_telemetry()
-
-					await broadcast_telem()
-			await asyncio.sleep(1/loop_rate)
-	except asyncio.CancelledError:
-		print('INFO: simulation terminated')
-	except Exception as e:
-		print(f'ERROR: simulation error - {e}')
 
 async def console_loop():
 	sentinel = ['q', 'quit', 'stop', 'exit']
@@ -193,28 +365,39 @@ async def console_loop():
 		# console commands
 		if cmd == 'pause' or cmd == 'p':
 			if sim.is_running():
-				await pause_sim()
+				pause_sim()
 			else:
 				print('INFO: simulation already paused')
 		elif cmd == 'resume':
 			if sim.is_running():
 				print(f'INFO: simulation already running')
 			else:
-				await resume_sim()
+				resume_sim()
 		elif cmd == 'reset':
-			await reset_sim()
+			reset_sim()
+		elif cmd == 'trim':
+			reset_sim(True)
 		elif cmd == 'reinit':
-			await reinit_sim()
+			reinit_sim()
 		elif cmd == 'export':
-			await export_telem()
+			export_telem()
 		elif cmd == 'step':
-			await step_sim(0.01)
+			step_sim(0.01)
 		elif cmd == 'method':
 			print(f'INFO: current integration method - {sim.method}')
 		elif cmd == 'time':
 			print(f'INFO: current elapsed time - {sim.elapsed:.4f}')
 		elif cmd == 'status':
 			print(f'INFO: Simulation {"running" if sim.is_running() else "paused"} at time {sim.elapsed:.4f}')
+		elif cmd == 'latency':
+			latency.print()
+		elif cmd == 'frames':
+			scheduler.print()
+		elif cmd == 'clients':
+			if not clients:
+				print('INFO: no connected clients')
+			for client in list(clients.values()):
+				client.print()
 		elif len(tokens) == 2:
 			cmd = tokens[0]
 			arg = tokens[1]
@@ -222,12 +405,18 @@ async def console_loop():
 				try:
 					dt = float(arg)
 					if 1e-4 <= dt <= 0.1:
-						await step_sim(dt)
+						step_sim(dt)
 					else:
 						print(f'ERROR: invalid time step - {arg}')
 				except:
 					print(f'ERROR: nonfloat time step - {arg}')
-			elif cmd == 'method': await set_method(arg)
+			elif cmd == 'method': set_method(arg)
+			elif cmd == 'policy': worker.submit(scheduler.set_policy, arg)
+			elif cmd == 'budget':
+				try:
+					worker.submit(scheduler.set_budget, float(arg))
+				except ValueError:
+					print(f'ERROR: nonfloat frame budget - {arg}')
 			else:
 				print(f'WARNING: unknown augmented command received - {cmd} - {arg}')
 		else:
@@ -235,6 +424,7 @@ async def console_loop():
 
 async def controller_loop():
 	if controller is None: return
+	import pygame
 	loop_rate = 100
 	try:
 		while True:
@@ -247,13 +437,7 @@ async def controller_loop():
 			
 			psi_ra = -yaw*sim.model.psi_ra_max
 			V = (-1 if reverse==1 else 1)*throttle*sim.model.V_max
-			if sim.is_running():
-				sim.input_queued = True
-				sim.psi_ra = psi_ra # type: ignore
-				sim.V = V # type: ignore
-			else:
-				sim.model.psi_ra = psi_ra
-				sim.model.propulsor.V = V
+			worker.set_input(psi_ra, V)
 			await asyncio.sleep(1/loop_rate)
 	except asyncio.CancelledError:
 		print('INFO: controller link terminated')
@@ -262,11 +446,25 @@ async def controller_loop():
 
 # --- Entry Point ---
 async def main():
+	global worker
+	# the python side of a frame (diagnostics, telemetry) holds the gil, a short switch interval bounds how long
+	#	the event loop waits for it
+	sys.setswitchinterval(0.001)
 	port = 9000
+	latency_task = asyncio.create_task(latency.run())
 	async with websockets.serve(handler, '127.0.0.1', port):
 		print(f'INFO: simulation server started on port {port}')
+		report.mark('websocket server')
+		await asyncio.to_thread(start_sim)
+		loop = asyncio.get_running_loop()
+		worker = SimulationWorker(sim, scheduler, on_publish=lambda build, forced: loop.call_soon_threadsafe(notify_frame, build, forced))
+		worker.stream = controller is not None
+		worker.start()
+		sim_ready.set()
+		report.print()
+		warm_task = asyncio.create_task(asyncio.to_thread(warm_up, sim.model, sim.valid_methods))
 
-		sim_task = asyncio.create_task(simulation_loop())
+		broadcast_task = asyncio.create_task(broadcast_loop())
 		controller_task = asyncio.create_task(controller_loop())
 
 		try:
@@ -274,10 +472,15 @@ async def main():
 		except asyncio.CancelledError:
 			print(f'\fINFO: terminating')
 		finally:
-			sim_task.cancel()
+			broadcast_task.cancel()
 			controller_task.cancel()
+			latency_task.cancel()
 			await controller_task
-			results = await asyncio.gather(sim_task, return_exceptions=True)
+			await asyncio.to_thread(worker.stop)
+			print('INFO: simulation terminated')
+			scheduler.print()
+			latency.print()
+			results = await asyncio.gather(broadcast_task, latency_task, warm_task, return_exceptions=True)
 			results = list(filter(None, results))
 			if results:
 				print(f'INFO: termination completed with {len(results)} error(s) - {results}')
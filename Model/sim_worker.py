@@ -0,0 +1,265 @@
+import asyncio
+import collections
+import queue
+import threading
+import time
+
+import numpy as np
+
+frame_policies = ['catch_up', 'drop']
+
+class FrameScheduler:
+	# fixed ticks of base_rate/tick_rate simulation seconds on an absolute wall clock timeline, one frame per wakeup
+	#	a frame runs the ticks due since the previous one while they fit its compute budget (a fraction of the period)
+	#	behind schedule, 'catch_up' reruns up to max_catch_up missed ticks and 'drop' skips them all, ticks left
+	#	over are dropped so the simulation falls behind real time instead of spiralling, the timeline never shifts
+	def __init__(self, tick_rate=20, budget=0.8, policy='catch_up', max_catch_up=4, window=200):
+		self.tick_rate = tick_rate
+		self.budget = budget
+		self.policy = policy
+		self.max_catch_up = max_catch_up
+		self.deadline = time.perf_counter()
+		self.behind = False
+		self.last_frame = None
+		# per frame (wakeup jitter, compute, wall interval, simulation time advanced) over the recent window
+		self.samples = collections.deque(maxlen=window)
+		self.frames = 0
+		self.ticks = 0
+		self.dropped = 0
+		self.overruns = 0
+
+	def set_policy(self, policy):
+		if policy in frame_policies:
+			self.policy = policy
+			print(f'INFO: setting frame policy to {policy}')
+		else:
+			print(f'WARNING: invalid frame policy requested - {policy}')
+
+	def set_budget(self, budget):
+		self.budget = min(max(budget, 0.05), 1.0)
+		print(f'INFO: setting frame budget to {self.budget:.2f} of the {1e3/self.tick_rate:.1f} ms period')
+
+	def get_timeout(self):
+		return max(0.0, self.deadline - time.perf_counter())
+
+	def advance(self, now):
+		# ticks due at now (at least one), the deadline moves past now on the same timeline
+		period = 1/self.tick_rate
+		due = 1 + int((now - self.deadline)/period)
+		self.deadline += due*period
+		return due
+
+	def idle(self, now):
+		# paused, frames keep their timeline for streaming and the first running frame counts from here
+		self.advance(now)
+		self.last_frame = None
+		self.behind = False
+
+	def run_frame(self, sim, now):
+		period = 1/self.tick_rate
+		jitter = now - self.deadline
+		due = self.advance(now)
+		allowed = 1 if self.policy == 'drop' else min(due, 1 + self.max_catch_up)
+		budget = self.budget*period
+		span = sim.base_rate*period
+		ran = 0
+		while ran < allowed:
+			sim.step(span)
+			ran += 1
+			spent = time.perf_counter() - now
+			# integration failures pause, and another tick of the same cost would not fit
+			if not sim.is_running() or spent*(ran + 1)/ran > budget:
+				break
+		compute = time.perf_counter() - now
+		dropped = due - ran
+
+		interval = now - self.last_frame if self.last_frame is not None else period
+		self.last_frame = now
+		self.samples.append((jitter, compute, interval, ran*span))
+		self.frames += 1
+		self.ticks += ran
+		self.dropped += dropped
+		self.overruns += compute > budget
+		sim.rate = self.get_real_time_factor()
+
+		if dropped and not self.behind:
+			print(f'WARNING: frame behind schedule, dropped {dropped} tick(s) ({compute*1e3:.1f} ms compute, '
+				f'{budget*1e3:.1f} ms budget)')
+		elif not dropped and self.behind:
+			print(f'INFO: frames back on schedule, simulation rate {sim.rate:.2f}')
+		self.behind = dropped > 0
+
+	def get_real_time_factor(self):
+		# simulation seconds per wall second over the recent window
+		samples = np.array(list(self.samples)).reshape(-1, 4)
+		return float(np.sum(samples[:,3])/np.sum(samples[:,2])) if len(samples) else 0.0
+
+	def summary(self):
+		# ms, jitter and compute over the recent window, counts since start
+		samples = np.array(list(self.samples)).reshape(-1, 4)
+		if not len(samples):
+			samples = np.zeros((1, 4))
+		return {
+			'tick_rate': self.tick_rate,
+			'policy': self.policy,
+			'budget': self.budget*1e3/self.tick_rate,
+			'frames': self.frames,
+			'ticks': self.ticks,
+			'dropped': self.dropped,
+			'overruns': self.overruns,
+			'jitter_mean': float(np.mean(samples[:,0]))*1e3,
+			'jitter_p99': float(np.percentile(samples[:,0], 99))*1e3,
+			'jitter_max': float(np.max(samples[:,0]))*1e3,
+			'compute_mean': float(np.mean(samples[:,1]))*1e3,
+			'compute_max': float(np.max(samples[:,1]))*1e3,
+			'real_time_factor': self.get_real_time_factor()
+		}
+
+	def print(self):
+		stats = self.summary()
+		print(f'INFO: {stats["frames"]} frame(s) at {stats["tick_rate"]} Hz, {stats["policy"]} policy, '
+			f'{stats["budget"]:.1f} ms budget - {stats["ticks"]} tick(s), {stats["dropped"]} dropped, '
+			f'{stats["overruns"]} overrun(s)')
+		print(f'INFO: recent frames - jitter mean {stats["jitter_mean"]:.2f} ms, p99 {stats["jitter_p99"]:.2f} ms, '
+			f'max {stats["jitter_max"]:.2f} ms, compute mean {stats["compute_mean"]:.2f} ms, max {stats["compute_max"]:.2f} ms, '
+			f'real time factor {stats["real_time_factor"]:.2f}')
+
+class SimulationWorker:
+	# owns the simulation on its own thread, the event loop only queues commands and reads published telemetry
+	#	the compiled integrators release the gil, so a frame integrates while the loop keeps serving sockets
+	def __init__(self, sim, scheduler: FrameScheduler=None, on_publish=None):
+		self.sim = sim
+		self.scheduler = FrameScheduler() if scheduler is None else scheduler
+		# called on the worker thread after every published frame, with whether the build message changed and whether
+		#	the frame answers a command (sent to every client regardless of its rate)
+		self.on_publish = on_publish
+		# publish every frame while paused too, e.g. with a controller linked
+		self.stream = False
+		# union of the subscribed telemetry channel masks (None, all) and the fastest subscribed rate (None, every frame)
+		self.channels = None
+		self.publish_rate = None
+		self.last_publish = -np.inf
+		self.commands = queue.SimpleQueue()
+		self.thread = threading.Thread(target=self.run, name='simulation', daemon=True)
+
+	def start(self):
+		self.thread.start()
+
+	def stop(self):
+		self.commands.put(None)
+		self.thread.join()
+
+	def submit(self, command, *args, build=False):
+		# command(*args) on the worker thread, followed by a published frame
+		self.commands.put((command, args, build))
+
+	def refresh(self):
+		# a frame for every client, e.g. once subscriptions change
+		self.submit(lambda: None)
+
+	def set_input(self, psi_ra, V):
+		# latest wins, applied at the next step while running
+		self.commands.put((None, (psi_ra, V), False))
+
+	def apply_input(self, psi_ra, V):
+		sim = self.sim
+		if sim.is_running():
+			sim.input_queued = True
+			sim.psi_ra = psi_ra
+			sim.V = V
+			return False
+		changed = sim.model.psi_ra != psi_ra or sim.model.propulsor.V != V
+		sim.model.psi_ra = psi_ra
+		sim.model.propulsor.V = V
+		# paused and not streaming, the new inputs only show with a frame of their own
+		return changed and not self.stream
+
+	def publish(self, build=False, forced=True):
+		now = time.perf_counter()
+		# frames no subscriber is due for are not even filled, within a quarter period of a tick
+		period = 0.0 if self.publish_rate is None else 1/self.publish_rate - 0.25/self.scheduler.tick_rate
+		if not forced and now - self.last_publish < period:
+			return
+		self.last_publish = now
+		self.sim.set_telemetry(self.channels)
+		if self.on_publish is not None:
+			self.on_publish(build, forced)
+
+	def run(self):
+		sim, scheduler = self.sim, self.scheduler
+		while True:
+			# blocks until the next frame deadline unless a command comes in first
+			try:
+				command = self.commands.get(timeout=scheduler.get_timeout())
+			except queue.Empty:
+				command = ()
+			# drain everything queued, one frame for the whole batch
+			publish, build, forced = False, False, False
+			while command != ():
+				if command is None:
+					return
+				fun, args, rebuild = command
+				try:
+					if fun is None:
+						if self.apply_input(*args):
+							publish, forced = True, True
+					else:
+						fun(*args)
+						publish, build, forced = True, build or rebuild, True
+				except Exception as e:
+					print(f'ERROR: simulation command failed - {e}')
+				try:
+					command = self.commands.get_nowait()
+				except queue.Empty:
+					command = ()
+
+			now = time.perf_counter()
+			if now >= scheduler.deadline:
+				try:
+					if sim.is_running():
+						scheduler.run_frame(sim, now)
+					else:
+						scheduler.idle(now)
+				except Exception as e:
+					print(f'ERROR: simulation error, pausing - {e}')
+					sim.reset_solver()
+					sim.pause()
+				publish |= sim.is_running() or self.stream
+			if publish:
+				self.publish(build, forced)
+
+class LoopLatency:
+	# event loop responsiveness, a periodic wakeup is late by as long as the loop was blocked meanwhile
+	def __init__(self, interval=0.005, window=2000):
+		self.interval = interval
+		self.samples = collections.deque(maxlen=window)
+		self.count = 0
+		self.max = 0.0
+
+	async def run(self):
+		try:
+			while True:
+				tik = time.perf_counter()
+				await asyncio.sleep(self.interval)
+				late = time.perf_counter() - tik - self.interval
+				self.samples.append(late)
+				self.count += 1
+				self.max = max(self.max, late)
+		except asyncio.CancelledError:
+			pass
+
+	def summary(self):
+		# ms, over the recent window and (max) since start
+		samples = np.array(self.samples) if self.samples else np.zeros(1)
+		return {
+			'samples': self.count,
+			'mean': float(np.mean(samples))*1e3,
+			'p99': float(np.percentile(samples, 99))*1e3,
+			'window_max': float(np.max(samples))*1e3,
+			'max': self.max*1e3
+		}
+
+	def print(self):
+		stats = self.summary()
+		print(f'INFO: event loop latency over the last {len(self.samples)} wakeups - mean {stats["mean"]:.2f} ms, '
+			f'p99 {stats["p99"]:.2f} ms, max {stats["window_max"]:.2f} ms ({stats["max"]:.2f} ms since start)')
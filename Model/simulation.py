@@ -1,43 +1,94 @@
 import numpy as np
-from scipy.integrate import solve_ivp
 import json
 import time
+from types import SimpleNamespace
 
 from model_RBird import Model_6DoF
+import integrators
+from trim import load_trim_table
+
+# telemetry channels in frame order, each a contiguous segment of the frame, status goes out with every frame
+telem_channels = ['hull', 'panels', 'wing_roots', 'propulsor', 'pose', 'status', 'solver']
+# diagnostics pass parts a channel reads, the pose needs the base frames only
+telem_channel_parts = {'hull': ['hull'], 'panels': ['panels'], 'wing_roots': ['wing_roots'], 'propulsor': ['propulsor']}
+
+def get_channel_mask(channels):
+	# bit i set for telem_channels[i], unknown channels raise ValueError
+	mask = 1 << telem_channels.index('status')
+	for channel in channels:
+		mask |= 1 << telem_channels.index(channel)
+	return mask
+
+all_channels = get_channel_mask(telem_channels)
+
+# radau and bdf retry rejected attempts inside step() and only count evaluations, jacobians and factorisations publicly
+#	the rejections are recovered from their private step state, read here only, so another scipy version degrades the
+#	count to None (null in telemetry) instead of failing the frame
+def probe_rejections(solver, method):
+	# solver state before a step, None when unavailable
+	try:
+		factorised = (solver.LU_real if method == 'Radau' else solver.LU) is not None
+		return solver.t, solver.h_abs, solver.nlu, solver.njev, factorised
+	except AttributeError:
+		return None
+
+def count_rejections(solver, method, probe):
+	# rejected attempts of the step taken since probe, None when unknown
+	#	every retry factorises again (radau twice), as do a step starting without a factorisation and a newton retry on a
+	#	refreshed jacobian (radau refreshes it after a step too), bdf keeps its factorisation on a failed error test
+	#	though, which only shows as a step shorter than the halvings of its failed newton attempts, once per step
+	if probe is None:
+		return None
+	t, h_abs, nlu, njev, factorised = probe
+	try:
+		refreshed = solver.njev - njev - (method == 'Radau' and solver.current_jac)
+		rejected = (solver.nlu - nlu)//(2 if method == 'Radau' else 1) - (not factorised) - refreshed
+	except AttributeError:
+		return None
+	if method == 'BDF' and solver.t - t < h_abs*0.5**rejected*(1 - 1e-6):
+		rejected += 1
+	return rejected
 
 class Simulation:
-	def __init__(self, model: Model_6DoF):
+	def __init__(self, model: Model_6DoF, method='RK45'):
+		# requested simulation seconds per wall second, and the rate actually achieved (set by the frame scheduler)
 		self.base_rate = 1
 		self.rate = 1
-		self.rate_restore = 0.2
-		self.rate_boundary = 0.98
 
 		self.time_last = 0
 		self.pause()
 
-		self.method = 'RK45'
-		self.valid_methods = ['RK45','RK23','Radau','BDF']
+		self.method = method
+		self.compiled_methods = ['RK4','SIEuler','DOPRI5','IMEX']
+		self.valid_methods = ['RK45','RK23','Radau','BDF'] + self.compiled_methods
+		self.implicit_methods = ['Radau','BDF']
+		self.fused = True
+
+		# compiled integrators
+		self.fixed_dt = 0.002
+		self.fixed_remainder = 0.0
+		self.rtol = 1e-3
+		self.atol = 1e-6
+		self.max_steps = 10000
+		# multirate splitting, rigid body steps of imex_dt, motor substeps inside each half step
+		self.imex_dt = 0.005
+		self.motor_substeps = 2
+
+		# persistent integrator state, carried across frames, restarts are counted since construction
+		self.solver_stats = {'steps': 0, 'rejected': 0, 'nfev': 0, 'h': 0.0, 'resets': 0}
+		self.reset_solver()
+
+		# cached steady states for resets, loaded per model
+		self.trim_table = None
+
+		# published telemetry frames, monotonic across models so readers never mistake a new frame for an old one
+		self.telem_seq = 0
+		self.telem_front = None
+		# binary frame layout, bumped per model, and the wire type of its fields (the frame itself is float64)
+		self.telem_layout = 0
+		self.telem_dtype = 'float32'
 
 		self.set_model(model)
-		def check_state(t, state):
-			criterion = [
-				np.abs(state[0]) < 20,					# u
-				np.abs(state[1]) < 20,					# v
-				np.abs(state[2]) < 20,					# w
-
-				np.abs(state[3]) < 2*np.pi,				# p
-				np.abs(state[4]) < 2*np.pi,				# q
-				np.abs(state[5]) < 2*np.pi,				# r
-
-				np.abs(state[6]) < 60/180*np.pi,		# phi
-				np.abs(state[7]) < 45/180*np.pi,		# theta
-				
-				np.abs(state[11]) < 3,					# z
-			]
-			return all(criterion)
-		
-		check_state.terminal = True
-		self.__check_state = check_state
 
 		self.input_queued = False
 		self.V = 0.0
@@ -48,16 +99,24 @@ class Simulation:
 	def set_model(self, model: Model_6DoF):
 		self.elapsed = 0
 		self.model = model
-		self.model.calc_state_dot()
-		self.__set_build_telem()
+		self.reset_solver()
+		self.trim_table = load_trim_table(model)
+		if self.trim_table is None:
+			print(f'INFO: no cached trim table, build one with "python trim.py{" --dynamic" if model.propulsor.dynamic else ""}"')
 		self.__init_telem()
+		self.__set_build_telem()
 		self.set_telemetry()
 
 	def __get_state_dot(self, t, state):
+		if self.fused:
+			return self.model.calc_state_dot_fused(state, self.model.get_input())
 		self.model.set_state(state)
 		self.model.calc_state_dot()
 		return self.model.get_state_dot()
 
+	def __get_jacobian(self, t, state):
+		return self.model.calc_jacobian(state, self.model.get_input(), central=False)
+
 	def pause(self):
 		self.__running = False
 
@@ -68,55 +127,157 @@ class Simulation:
 	def is_running(self):
 		return self.__running
 
-	def reset(self):
+	def reset(self, trim=False):
 		self.elapsed = 0
+		self.reset_solver()
 		self.pause()
-		self.model.set_state(np.zeros(14))
-		self.model.set_input(np.zeros(2))
-		self.model.calc_state_dot()
+		if trim and self.trim_table is not None:
+			# steady state for the current inputs instead of rest
+			input = self.model.get_input()
+			self.model.set_state(self.trim_table.get_state(input[1], input[0]))
+		else:
+			if trim:
+				print(f'WARNING: no trim table loaded, resetting to rest')
+			self.model.set_state(np.zeros(14))
+			self.model.set_input(np.zeros(2))
 		self.set_telemetry()
 
 	def step(self,dt: float=np.nan):
+		# dt in simulation seconds, a fixed tick from the frame scheduler or a manual step while paused
+		#	running without one, the wall time since the last step at base_rate
 		if self.input_queued:
 			self.input_queued = False
 			self.model.propulsor.V = self.V
 			self.model.psi_ra = self.psi_ra
 		if self.__running:
-			if not np.isnan(dt):
-				print(f'WARNING: simulation step of {dt} requested while running')
 			time_now = time.perf_counter()
-			dt = (time_now - self.time_last)
+			if np.isnan(dt):
+				dt = (time_now - self.time_last)*self.base_rate
 			self.time_last = time_now
 		elif np.isnan(dt):
 			return
-		self.rate = min(self.rate, self.base_rate)
-		res = solve_ivp(self.__get_state_dot, [0,dt*self.rate], self.model.get_state(), events=self.__check_state, 
-				  method=self.method)
-		if self.__running:
-			time_now = time.perf_counter()
-			solve_dt = time_now-self.time_last
-			self.time_last = time_now
-			if solve_dt >= dt:
-				self.rate = min(dt/solve_dt, self.rate)
-				print(f'WARNING: integration exceeded buffer time, slowing simulation rate to {self.rate:.2f}')
-			elif self.rate < self.rate_boundary * self.base_rate:
-				self.rate = self.base_rate*self.rate_restore + self.rate*(1-self.rate_restore)
-				if self.rate > self.rate_boundary * self.base_rate:
-					self.rate = self.base_rate
-				print(f'INFO: restoring simulation rate to {self.rate:.2f}')
+		res = self.__advance(dt)
 		if res.status == -1:
 			print(f'WARNING: integration failed, pausing')
+			self.reset_solver()
 			self.pause()
 		elif res.status == 0:
-			print(f'INFO: {len(res.t)} timesteps taken with {self.method}')
+			print(f'INFO: {res.n_accepted} timesteps ({res.n_rejected} rejected) taken with {self.method}')
 			self.model.set_state(res.y[:,-1])
-			self.elapsed += dt*self.rate
+			self.elapsed += res.t[-1]
+			self.solver_state = self.model.get_state()
 		else:
 			print(f'WARNING: integration aborted by state check, pausing')
+			self.reset_solver()
 			self.pause()
 
 		return res
 
+	def reset_solver(self):
+		self.solver = None
+		self.solver_method = None
+		self.solver_state = None
+		self.solver_input = None
+		self.fixed_remainder = 0.0
+		self.h_dopri = 0.0
+		self.state_dot_dopri = np.empty(0)
+
+	def __advance(self, span):
+		state = self.model.get_state()
+		input = self.model.get_input()
+		# external state overwrite or method change restarts the integrator, input changes only drop cached stages
+		restart = self.solver_method != self.method or not np.array_equal(state, self.solver_state)
+		reseed = restart or not np.array_equal(input, self.solver_input)
+		self.solver_method = self.method
+		self.solver_input = input
+		self.solver_state = state
+
+		if self.method in self.compiled_methods:
+			res = self.__advance_compiled(state, input, span, restart, reseed)
+		else:
+			res = self.__advance_scipy(state, span, restart, reseed)
+		self.solver_stats = {
+			'steps': res.n_accepted,
+			'rejected': res.n_rejected,
+			'nfev': res.nfev,
+			'h': res.h,
+			'resets': self.solver_stats['resets'] + int(restart)
+		}
+		return res
+
+	def __advance_scipy(self, state, span, restart, reseed):
+		if restart or self.solver is None:
+			self.solver = self.__make_solver(state)
+		elif reseed:
+			# keep the accepted step size, restart stages from the current state
+			self.solver = self.__make_solver(state, self.solver.step_size)
+		nfev = self.solver.nfev
+		t0 = self.elapsed
+		t_target = t0 + span
+		n_accepted = 0
+		n_rejected = 0
+		status = 0
+		implicit = self.method in self.implicit_methods
+		while self.solver.t < t_target:
+			probe = probe_rejections(self.solver, self.method) if implicit and n_rejected is not None else None
+			self.solver.step()
+			if self.solver.status == 'failed':
+				status = -1
+				break
+			n_accepted += 1
+			if implicit and n_rejected is not None:
+				rejected = count_rejections(self.solver, self.method, probe)
+				n_rejected = None if rejected is None else n_rejected + rejected
+			if not integrators.check_state(self.solver.y):
+				status = 1
+				break
+		if status == 0 and span > 0:
+			state_target = self.solver.y if self.solver.t == t_target else self.solver.dense_output()(t_target)
+		else:
+			state_target = self.solver.y
+		nfev = self.solver.nfev - nfev
+		if not implicit:
+			# explicit runge kutta, every attempt costs n_stages evaluations
+			n_stages = getattr(self.solver, 'n_stages', None)
+			n_rejected = nfev//n_stages - n_accepted if n_stages else None
+		return SimpleNamespace(t=np.array([0, span if status == 0 else self.solver.t - t0]), y=np.column_stack((state, state_target)),
+						status=status, success=status >= 0, nfev=nfev, n_accepted=n_accepted, n_rejected=n_rejected,
+						h=self.solver.step_size or 0.0)
+
+	def __make_solver(self, state, first_step=None):
+		# scipy is imported on the first scipy method solve only
+		import scipy.integrate
+		options = {'jac': self.__get_jacobian} if self.method in self.implicit_methods else {}
+		return getattr(scipy.integrate, self.method)(self.__get_state_dot, self.elapsed, state, np.inf, first_step=first_step,
+										 rtol=self.rtol, atol=self.atol, **options)
+
+	def __advance_compiled(self, state, input, span, restart, reseed):
+		if self.method == 'DOPRI5':
+			if restart:
+				self.h_dopri = 0.0
+			if reseed:
+				self.state_dot_dopri = np.empty(0)
+			(t, traj, status, self.h_dopri, self.state_dot_dopri, n_accepted, n_rejected, 
+				nfev) = integrators.integrate_dopri5(state, self.state_dot_dopri, input, self.model.packed, span, self.h_dopri,
+										 self.rtol, self.atol, self.max_steps)
+			h = self.h_dopri
+		else:
+			# whole fixed steps only, the remainder carries over to the next call
+			h = self.imex_dt if self.method == 'IMEX' else self.fixed_dt
+			span += self.fixed_remainder
+			n_steps = int(span/h)
+			self.fixed_remainder = span - n_steps*h
+			if self.method == 'IMEX':
+				traj, status = integrators.integrate_imex(state, input, self.model.packed, h, n_steps, self.motor_substeps)
+			else:
+				integrate = integrators.integrate_rk4 if self.method == 'RK4' else integrators.integrate_semi_implicit_euler
+				traj, status = integrate(state, input, self.model.packed, h, n_steps)
+			t = np.arange(len(traj))*h
+			n_accepted, n_rejected = len(traj)-1, 0
+			nfev = n_accepted*(1 if self.method == 'SIEuler' else 4)
+		return SimpleNamespace(t=t, y=traj.T, status=status, success=status >= 0, nfev=nfev,
+						n_accepted=n_accepted, n_rejected=n_rejected, h=h)
+
 	def get_dt(self):
 		return time.perf_counter()-self.time_last
 	
@@ -146,26 +307,72 @@ class Simulation:
 			'psi_ra_max': self.model.psi_ra_max,
 			'methods': self.valid_methods,
 			'method': self.method,
+			'telem_schema': self.get_telem_schema()
 		}
 		self.build_telem = json.dumps(self.__build_telem)
 
 	def __init_telem(self):
-		panel_telems = {}
+		# flat telemetry frame, one [path, offset, size, kind] field per value of the json message, in its order
+		#	kinds: float, array (flattened row major), bool, int (nan for None), method (index into valid_methods)
+		#	sources copy attr of obj into a field, the status and solver fields are written by set_telemetry
+		fields = {channel: [] for channel in telem_channels}
+		sources = {channel: ([], []) for channel in telem_channels}
+		offsets = [0]
+		def add(channel, path, obj=None, attr=None, size=1, kind='float'):
+			offset = offsets[0]
+			offsets[0] += size
+			fields[channel].append([path, offset, size, kind])
+			if obj is not None:
+				scalars, arrays = sources[channel]
+				if kind == 'array':
+					arrays.append((offset, offset + size, obj, attr))
+				else:
+					scalars.append((offset, obj, attr))
+
+		def add_fields(channel, path, obj, attrs):
+			for name, attr, size in attrs:
+				is_bool = isinstance(getattr(obj, attr), (bool, np.bool_))
+				add(channel, path + [name], obj, attr, size, 'array' if size > 1 else 'bool' if is_bool else 'float')
+
+		hull = self.model.hull
+		add_fields('hull', ['hull', 'surf'], hull, [('alpha', 'alpha_surf', 1), ('beta', 'beta_surf', 1),
+			('U_mag', 'U_mag_surf', 1), ('L', 'L_surf', 1), ('D', 'D_surf', 1), ('F', 'F_surf', 3), ('M', 'M_surf', 3),
+			('Cbw', 'Cbw_surf', 9)])
+		add_fields('hull', ['hull'], hull, [('alpha', 'alpha', 1), ('beta', 'beta', 1), ('area', 'area', 1), ('vol', 'vol', 1),
+			('area_center', 'area_center', 3), ('vol_center', 'vol_center', 3), ('U_mag', 'U_mag', 1), ('L', 'L_h', 1),
+			('D', 'D_h', 1), ('F_h', 'F_h', 3), ('M_h', 'M_h', 3), ('F_b', 'F_b', 3), ('M_b', 'M_b', 3), ('Cbw', 'Cbw', 9)])
 		for panel in self.model.panels.values():
-			panel_telems[panel.id] = {}
-		self.raw_telem = {
-			'type': 'telem',
-			'hull': {
-				'surf': {}
-			},
-			'panels': panel_telems,
-			'wing_roots': {
-				'0': {},
-				'1': {}
-			},
-			'propulsor': {}
-		}
-		self.telem = json.dumps(self.raw_telem)
+			add_fields('panels', ['panels', panel.id], panel, [(attr, attr, size) for attr, size in [('alpha', 1),
+				('beta', 1), ('f', 1), ('one_lower', 1), ('r_qc_fC', 3), ('U_mag', 1), ('L', 1), ('D', 1), ('F', 3), ('M', 3),
+				('Cbw', 9)]])
+		for wr in sorted(self.model.wing_roots, key=lambda wr: not wr.left):
+			add_fields('wing_roots', ['wing_roots', str(int(not wr.left))], wr, [(attr, attr, size) for attr, size in [
+				('alpha', 1), ('beta', 1), ('area', 1), ('vol', 1), ('area_center', 3), ('vol_center', 3), ('U_mag', 1),
+				('L', 1), ('D', 1), ('F_f', 3), ('M_f', 3), ('F_b', 3), ('M_b', 3), ('Cbw', 9)]])
+		add_fields('propulsor', ['propulsor'], self.model.propulsor, [(attr, attr, size) for attr, size in [('fp', 1),
+			('V', 1), ('n', 1), ('T', 1), ('Q', 1), ('I', 1), ('F', 3), ('M', 3), ('Cra_w', 9), ('converged', 1)]])
+		add_fields('pose', [], self.model, [(attr, attr, size) for attr, size in [('U', 3), ('omega', 3), ('Phi', 3),
+			('r', 3), ('psi_ra', 1), ('C0b', 9), ('Cra_b', 9), ('query', 3)]])
+		self.telem_status = offsets[0]
+		add('status', ['running'], kind='bool')
+		add('status', ['rate'])
+		add('status', ['method'], kind='method')
+		self.telem_solver = offsets[0]
+		for name in ['steps', 'rejected', 'nfev', 'h', 'resets']:
+			add('solver', ['solver', name], kind='float' if name == 'h' else 'int')
+
+		self.telem_layout += 1
+		self.telem_fields = fields
+		# (start, end, scalar sources, array sources) per channel, in telem_channels order
+		self.telem_segments = []
+		for channel in telem_channels:
+			channel_fields = fields[channel]
+			start = channel_fields[0][1]
+			self.telem_segments.append((start, start + sum(field[2] for field in channel_fields), *sources[channel]))
+		# double buffered, set_telemetry fills the back frame then publishes it with its channel mask as telem_front
+		#	and bumps telem_seq, other threads only copy the front frame (read_frame), no locks on either side
+		#	the previous front stays published until the first frame of a new model is filled
+		self.telem_buffers = [np.zeros(offsets[0]), np.zeros(offsets[0])]
 
 		def format_dict(input_dict):
 			formatted_dict = {}
@@ -184,90 +391,103 @@ class Simulation:
 			return formatted_dict
 		self.__format_dict = format_dict
 
+	def get_telem_schema(self):
+		# sent once in the build message, binary frames are a 16 byte header (uint32 layout, frame sequence, channel
+		#	mask, zero) followed by the segments of the channels in the mask, in order, as telem_dtype little endian
+		channels = []
+		for channel, (start, end, _, _) in zip(telem_channels, self.telem_segments):
+			channels.append({
+				'name': channel,
+				'size': end - start,
+				'fields': [[path, offset - start, size, kind] for path, offset, size, kind in self.telem_fields[channel]]
+			})
+		return {
+			'layout': self.telem_layout,
+			'dtype': self.telem_dtype,
+			'channels': channels,
+			'notes': {'solver.rejected': 'rejected attempts per frame, BDF counts repeated failed error tests within one '
+				'step once, null when the scipy solver does not expose them'}
+		}
+
+	@property
+	def raw_telem(self):
+		_, frame, mask = self.read_frame()
+		return self.decode_telem(frame, mask)
+
+	@property
+	def telem(self):
+		return self.read_telem()
+
+	def read_frame(self):
+		# after publishing, the writer refills the buffer being read, so retry if a newer frame came out meanwhile
+		while True:
+			seq = self.telem_seq
+			frame, mask = self.telem_front
+			frame = frame.copy()
+			if self.telem_seq == seq:
+				return seq, frame, mask
+
+	def read_telem(self, encoding='json', channels=None):
+		seq, frame, mask = self.read_frame()
+		return self.encode_telem(seq, frame, mask if channels is None else mask & channels, encoding)
+
+	def encode_telem(self, seq, frame, mask, encoding='json'):
+		if encoding == 'binary':
+			header = np.array([self.telem_layout, seq & 0xFFFFFFFF, mask, 0], dtype='<u4')
+			values = np.concatenate([frame[start:end] for i, (start, end, _, _) in enumerate(self.telem_segments)
+							if mask >> i & 1])
+			return header.tobytes() + values.astype(np.dtype(self.telem_dtype).newbyteorder('<'), copy=False).tobytes()
+		return json.dumps(self.decode_telem(frame, mask))
+
+	def decode_telem(self, frame, mask=all_channels):
+		# the nested json message of the channels in mask
+		telem = {'type': 'telem'}
+		for i, channel in enumerate(telem_channels):
+			if not mask >> i & 1:
+				continue
+			for path, offset, size, kind in self.telem_fields[channel]:
+				node = telem
+				for key in path[:-1]:
+					node = node.setdefault(key, {})
+				if kind == 'array':
+					value = frame[offset:offset + size].tolist()
+				elif kind == 'bool':
+					value = bool(frame[offset])
+				elif kind == 'int':
+					value = None if np.isnan(frame[offset]) else int(frame[offset])
+				elif kind == 'method':
+					value = self.valid_methods[int(frame[offset])]
+				else:
+					value = float(frame[offset])
+				node[path[-1]] = value
+		return telem
+
 	def set_formatted_telem(self):
+		# every channel, whatever the subscriptions left out of the last frame
+		self.set_telemetry()
 		self.formatted_telem = json.dumps(self.__format_dict(self.raw_telem), indent=2)
 
-	def set_telemetry(self):
-		for panel in self.model.panels.values():
-			panel_telem = self.raw_telem['panels'][panel.id]
-			panel_telem['alpha'] = panel.alpha
-			panel_telem['beta'] = panel.beta
-			panel_telem['f'] = panel.f
-			panel_telem['one_lower'] = panel.one_lower
-			panel_telem['r_qc_fC'] = panel.r_qc_fC.tolist()
-			panel_telem['U_mag'] = panel.U_mag
-			panel_telem['L'] = panel.L
-			panel_telem['D'] = panel.D
-			panel_telem['F'] = panel.F.tolist()
-			panel_telem['M'] = panel.M.tolist()
-			panel_telem['Cbw'] = panel.Cbw.flatten().tolist()
-		
-		hull = self.model.hull
-		hull_telem = self.raw_telem['hull']
-		hull_telem['alpha'] = hull.alpha
-		hull_telem['beta'] = hull.beta
-		hull_telem['area'] = hull.area
-		hull_telem['vol'] = hull.vol
-		hull_telem['area_center'] = hull.area_center.tolist()
-		hull_telem['vol_center'] = hull.vol_center.tolist()
-		hull_telem['U_mag'] = hull.U_mag
-		hull_telem['L'] = hull.L_h
-		hull_telem['D'] = hull.D_h
-		hull_telem['F_h'] = hull.F_h.tolist()
-		hull_telem['M_h'] = hull.M_h.tolist()
-		hull_telem['F_b'] = hull.F_b.tolist()
-		hull_telem['M_b'] = hull.M_b.tolist()
-		hull_telem['Cbw'] = hull.Cbw.flatten().tolist()
-
-		surf_telem = hull_telem['surf']
-		surf_telem['alpha'] = hull.alpha_surf
-		surf_telem['beta'] = hull.beta_surf
-		surf_telem['U_mag'] = hull.U_mag_surf
-		surf_telem['L'] = hull.L_surf
-		surf_telem['D'] = hull.D_surf
-		surf_telem['F'] = hull.F_surf.tolist()
-		surf_telem['M'] = hull.M_surf.tolist()
-		surf_telem['Cbw'] = hull.Cbw_surf.flatten().tolist()
-
-		for wr in self.model.wing_roots:
-			wr_telem = self.raw_telem['wing_roots'][str(int(not wr.left))]
-			wr_telem['alpha'] = wr.alpha
-			wr_telem['beta'] = wr.beta
-			wr_telem['area'] = wr.area
-			wr_telem['vol'] = wr.vol
-			wr_telem['area_center'] = wr.area_center.tolist()
-			wr_telem['vol_center'] = wr.vol_center.tolist()
-			wr_telem['U_mag'] = wr.U_mag
-			wr_telem['L'] = wr.L
-			wr_telem['D'] = wr.D
-			wr_telem['F_f'] = wr.F_f.tolist()
-			wr_telem['M_f'] = wr.M_f.tolist()
-			wr_telem['F_b'] = wr.F_b.tolist()
-			wr_telem['M_b'] = wr.M_b.tolist()
-			wr_telem['Cbw'] = wr.Cbw.flatten().tolist()
-		
-		p = self.model.propulsor
-		p_telem = self.raw_telem['propulsor']
-		p_telem['fp'] = p.fp
-		p_telem['V'] = p.V
-		p_telem['n'] = p.n
-		p_telem['T'] = p.T
-		p_telem['Q'] = p.Q
-		p_telem['I'] = p.I
-		p_telem['F'] = p.F.tolist()
-		p_telem['M'] = p.M.tolist()
-		p_telem['Cra_w'] = p.Cra_w.flatten().tolist()
-		
-		self.raw_telem['U'] = self.model.U.tolist()
-		self.raw_telem['omega'] = self.model.omega.tolist()
-		self.raw_telem['Phi'] = self.model.Phi.tolist()
-		self.raw_telem['r'] = self.model.r.tolist()
-		self.raw_telem['psi_ra'] = self.model.psi_ra
-		self.raw_telem['C0b'] = self.model.C0b.flatten().tolist()
-		self.raw_telem['Cra_b'] = self.model.Cra_b.flatten().tolist()
-		self.raw_telem['query'] = self.model.query.tolist()
-
-		self.raw_telem['running'] = self.__running
-		self.raw_telem['rate'] = self.rate
-		self.raw_telem['method'] = self.method
-		self.telem = json.dumps(self.raw_telem)
\ No newline at end of file
+	def set_telemetry(self, channels=None):
+		# only the channels in the mask (all by default, status always), and only the diagnostics parts they read
+		mask = all_channels if channels is None else channels | get_channel_mask([])
+		parts = [part for i, channel in enumerate(telem_channels) if mask >> i & 1 for part in telem_channel_parts.get(channel, [])]
+		# diagnostics pass at the current (last accepted) state, skipped if nothing changed
+		self.model.calc_diagnostics(parts=parts)
+		telem = self.telem_buffers[(self.telem_seq + 1) & 1]
+
+		# straight from the components into the frame, no intermediate python objects
+		for i, (_, _, scalars, arrays) in enumerate(self.telem_segments):
+			if not mask >> i & 1:
+				continue
+			for offset, obj, attr in scalars:
+				telem[offset] = getattr(obj, attr)
+			for start, end, obj, attr in arrays:
+				telem[start:end] = getattr(obj, attr).ravel()
+
+		telem[self.telem_status:self.telem_status + 3] = (self.__running, self.rate, self.valid_methods.index(self.method))
+		if mask >> telem_channels.index('solver') & 1:
+			stats = self.solver_stats
+			telem[self.telem_solver:self.telem_solver + 5] = (stats['steps'],
+				np.nan if stats['rejected'] is None else stats['rejected'], stats['nfev'], stats['h'], stats['resets'])
+		self.telem_front = (telem, mask)
+		self.telem_seq += 1
@@ -0,0 +1,224 @@
+import numpy as np
+import os
+import sys
+import time
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+from model_RBird import Model_6DoF
+import model_RBird
+import integrators
+from utils.param_utils import hash_files
+
+# trim unknowns: (u, v, w, phi, theta, z, psi_dot), plus (I, omega_p) for dynamic propulsors
+#	steady turn at psi_dot: body rates follow from the attitude, heading and horizontal position are free
+# residuals: U_dot, omega_dot, z_dot, plus the motor derivatives scaled by L and J (volts, newton metres)
+
+trim_tol = 1e-8			# max residual for a converged trim point
+settle_time = 5.0		# settling integration when newton fails from the guess (s)
+settle_dt = 0.002
+trim_cache_root = 'cache/trim/'
+
+def trim_to_state(x, n_states):
+	u, v, w, phi, theta, z, psi_dot = x[:7]
+	state = np.zeros(n_states)
+	state[0:3] = u, v, w
+	state[3:6] = psi_dot*np.array([-np.sin(theta), np.sin(phi)*np.cos(theta), np.cos(phi)*np.cos(theta)])
+	state[6:8] = phi, theta
+	state[11] = z
+	state[12:] = x[7:]
+	return state
+
+def state_to_trim(state):
+	phi, theta = state[6], state[7]
+	psi_dot = (state[4]*np.sin(phi) + state[5]*np.cos(phi))/np.cos(theta)
+	return np.concatenate((state[0:3], [phi, theta, state[11], psi_dot], state[12:]))
+
+def trim_residual(x, input, model: Model_6DoF):
+	state_dot = model.calc_state_dot_fused(trim_to_state(x, model.n_states), input)
+	residual = np.concatenate((state_dot[0:6], state_dot[11:12]))
+	if model.propulsor.dynamic:
+		residual = np.concatenate((residual, state_dot[12:14]*np.array([model.propulsor.L_m, model.propulsor.J_m])))
+	return residual
+
+def solve_trim(model: Model_6DoF, V, psi_ra, guess=None):
+	# newton (levenberg-marquardt) from the guess, falling back to settling the dynamics then polishing
+	#	guess: state to start from, rest at the waterline otherwise
+	#	returns (state, converged, residual)
+	input = np.array([psi_ra, V], dtype=np.float64)
+	if guess is None:
+		guess = np.zeros(model.n_states)
+		guess[11] = model.hull.z0
+
+	from scipy.optimize import least_squares
+	def polish(state):
+		sol = least_squares(trim_residual, state_to_trim(state), args=(input, model), method='lm',
+					  xtol=1e-12, ftol=1e-12, max_nfev=200)
+		state = trim_to_state(sol.x, model.n_states)
+		residual = np.max(np.abs(sol.fun))
+		return state, bool(residual < trim_tol and integrators.check_state(state)), residual
+
+	state, converged, residual = polish(guess)
+	if not converged:
+		traj, status = integrators.integrate_rk4(np.ascontiguousarray(guess, dtype=np.float64), input, model.packed,
+										   settle_dt, int(settle_time/settle_dt))
+		if status == 0:
+			settled = polish(traj[-1])
+			if settled[1] or settled[2] < residual:
+				state, converged, residual = settled
+	return state, converged, residual
+
+class TrimTable:
+	def __init__(self, key, V_range, psi_ra_range, states, converged, residuals):
+		self.key = key
+		self.V_range = V_range
+		self.psi_ra_range = psi_ra_range
+		self.states = states				# [n_V, n_psi_ra, n_states]
+		self.converged = converged			# [n_V, n_psi_ra]
+		self.residuals = residuals			# [n_V, n_psi_ra]
+
+	def save(self, path):
+		directory = os.path.dirname(path)
+		if directory and not os.path.exists(directory):
+			os.makedirs(directory, exist_ok=True)
+		np.savez(path, key=self.key, V_range=self.V_range, psi_ra_range=self.psi_ra_range, states=self.states,
+			converged=self.converged, residuals=self.residuals)
+
+	@staticmethod
+	def load(path):
+		data = np.load(path)
+		return TrimTable(str(data['key']), data['V_range'], data['psi_ra_range'], data['states'], data['converged'],
+				   data['residuals'])
+
+	def get_state(self, V, psi_ra):
+		# bilinear between converged grid points, nearest converged point otherwise, None if there is none
+		if not self.converged.any():
+			return None
+		V = np.clip(V, self.V_range[0], self.V_range[-1])
+		psi_ra = np.clip(psi_ra, self.psi_ra_range[0], self.psi_ra_range[-1])
+		i = np.clip(np.searchsorted(self.V_range, V) - 1, 0, len(self.V_range) - 2)
+		j = np.clip(np.searchsorted(self.psi_ra_range, psi_ra) - 1, 0, len(self.psi_ra_range) - 2)
+		if self.converged[i:i+2, j:j+2].all():
+			d_V = (V - self.V_range[i])/(self.V_range[i+1] - self.V_range[i])
+			d_psi = (psi_ra - self.psi_ra_range[j])/(self.psi_ra_range[j+1] - self.psi_ra_range[j])
+			s = self.states
+			return ((s[i,j]*(1-d_V) + s[i+1,j]*d_V)*(1-d_psi) +
+		   			(s[i,j+1]*(1-d_V) + s[i+1,j+1]*d_V)*d_psi)
+		dist_V = (self.V_range[:,None] - V)/np.ptp(self.V_range)
+		dist_psi = (self.psi_ra_range[None,:] - psi_ra)/max(np.ptp(self.psi_ra_range), 1e-12)
+		dist = np.where(self.converged, dist_V**2 + dist_psi**2, np.inf)
+		i, j = np.unravel_index(np.argmin(dist), dist.shape)
+		return self.states[i,j].copy()
+
+def sweep_column(model: Model_6DoF, V_range, psi_ra):
+	# continuation in V outwards from the point closest to rest, each solve starts from the last converged one
+	states = np.zeros((len(V_range), model.n_states))
+	converged = np.zeros(len(V_range), dtype=np.bool_)
+	residuals = np.zeros(len(V_range))
+	i0 = int(np.argmin(np.abs(V_range)))
+	guess_0 = None
+	for branch in (range(i0, len(V_range)), range(i0-1, -1, -1)):
+		guess = guess_0
+		for i in branch:
+			states[i], converged[i], residuals[i] = solve_trim(model, V_range[i], psi_ra, guess)
+			if converged[i]:
+				guess = states[i]
+				if i == i0:
+					guess_0 = guess
+	return states, converged, residuals
+
+# worker processes build their own model from the constructor paths
+worker_model = None
+
+def init_worker(paths, artifact_path):
+	# over the parent's model artifact when it has one, parsed from the sources otherwise
+	global worker_model
+	with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+		worker_model = (artifact_path and model_RBird.make_mapped(paths, artifact_path)) or Model_6DoF(*paths)
+
+def sweep_column_worker(V_range, psi_ra):
+	return sweep_column(worker_model, V_range, psi_ra)
+
+def sweep_trim(model: Model_6DoF, V_range, psi_ra_range, workers=None):
+	# one psi_ra column per task, V continuation inside each
+	tik = time.perf_counter()
+	workers = min(workers or os.cpu_count() or 1, len(psi_ra_range))
+	if workers <= 1:
+		columns = [sweep_column(model, V_range, psi_ra) for psi_ra in psi_ra_range]
+	else:
+		with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(model.paths, model.artifact_path)) as executor:
+			columns = list(executor.map(sweep_column_worker, [V_range]*len(psi_ra_range), psi_ra_range))
+	states = np.stack([c[0] for c in columns], axis=1)
+	converged = np.stack([c[1] for c in columns], axis=1)
+	residuals = np.stack([c[2] for c in columns], axis=1)
+	print(f'INFO: trim sweep of {converged.size} points ({converged.sum()} converged) with {workers} worker(s) in '
+	   f'{time.perf_counter()-tik:.2f} s')
+	return TrimTable(trim_key(model, V_range, psi_ra_range), V_range, psi_ra_range, states, converged, residuals)
+
+def default_ranges(model: Model_6DoF):
+	return np.linspace(0, model.V_max, 12), np.linspace(-model.psi_ra_max, model.psi_ra_max, 7)
+
+def trim_key(model: Model_6DoF, V_range, psi_ra_range):
+	return hash_files(model.source_paths, model.n_states, np.asarray(V_range, dtype=np.float64),
+				   np.asarray(psi_ra_range, dtype=np.float64), trim_tol, settle_time)
+
+def trim_path(key, cache_root=trim_cache_root):
+	return os.path.join(cache_root, f'trim_{key[:16]}.npz')
+
+def load_trim_table(model: Model_6DoF, V_range=None, psi_ra_range=None, cache_root=trim_cache_root):
+	# cached table for the current sources and grid, None if missing or stale
+	if V_range is None or psi_ra_range is None:
+		V_range, psi_ra_range = default_ranges(model)
+	key = trim_key(model, V_range, psi_ra_range)
+	path = trim_path(key, cache_root)
+	if not os.path.exists(path):
+		return None
+	try:
+		table = TrimTable.load(path)
+	except Exception as e:
+		print(f'WARNING: failed to load trim table "{path}" - {e}')
+		return None
+	if table.key != key:
+		print(f'WARNING: stale trim table "{path}"')
+		return None
+	# get_state has nothing to offer without a converged point, callers fall back to rest as without a table
+	if not table.converged.any():
+		print(f'WARNING: trim table "{path}" has no converged point, ignoring it')
+		return None
+	print(f'INFO: loaded trim table "{path}"')
+	return table
+
+def get_trim_table(model: Model_6DoF, V_range=None, psi_ra_range=None, workers=None, cache_root=trim_cache_root):
+	if V_range is None or psi_ra_range is None:
+		V_range, psi_ra_range = default_ranges(model)
+	table = load_trim_table(model, V_range, psi_ra_range, cache_root)
+	if table is not None:
+		return table
+	table = sweep_trim(model, V_range, psi_ra_range, workers)
+	if not table.converged.any():
+		print(f'ERROR: no trim point converged, not saving the trim table')
+		return table
+	path = trim_path(table.key, cache_root)
+	try:
+		table.save(path)
+		print(f'INFO: saved trim table "{path}"')
+	except Exception as e:
+		print(f'ERROR: failed to save trim table - {e}')
+	return table
+
+def main():
+	dynamic_propulsor = '--dynamic' in sys.argv
+	model = model_RBird.make_default(dynamic_propulsor)
+	table = get_trim_table(model)
+	np.set_printoptions(precision=3, suppress=True, linewidth=200)
+	print(f'{"V [V]":>8}{"psi_ra [deg]":>14}{"u [m/s]":>10}{"theta [deg]":>13}{"phi [deg]":>11}{"z [m]":>9}{"r [rad/s]":>11}')
+	for i, V in enumerate(table.V_range):
+		for j, psi_ra in enumerate(table.psi_ra_range):
+			if not table.converged[i,j]:
+				print(f'{V:>8.2f}{psi_ra*180/np.pi:>14.2f}{"-":>10}')
+				continue
+			s = table.states[i,j]
+			print(f'{V:>8.2f}{psi_ra*180/np.pi:>14.2f}{s[0]:>10.3f}{s[7]*180/np.pi:>13.2f}{s[6]*180/np.pi:>11.2f}'
+		 		f'{s[11]:>9.3f}{s[5]:>11.3f}')
+
+if __name__ == '__main__': main()
@@ -0,0 +1,119 @@
+import numpy as np
+import json
+import os
+import struct
+
+from utils.param_utils import hash_files
+
+# single file model artifact: parsed sources as contiguous arrays behind a small json header
+#	layout: magic, version (uint32), header length (uint64), header (utf-8 json), arrays at artifact_align offsets
+#	header: nested structure of the parsed data, arrays replaced by {"array": index}, tuples by {"tuple": [...]}
+artifact_magic = b'RBMA'
+artifact_version = 3
+artifact_align = 64
+prefix_format = '<4sIQ'
+
+def encode(obj, arrays):
+	if isinstance(obj, np.ndarray):
+		arrays.append(np.ascontiguousarray(obj))
+		return {'array': len(arrays) - 1}
+	if isinstance(obj, tuple):
+		return {'tuple': [encode(item, arrays) for item in obj]}
+	if isinstance(obj, list):
+		return [encode(item, arrays) for item in obj]
+	if isinstance(obj, dict):
+		return {'dict': [[encode(key, arrays), encode(value, arrays)] for key, value in obj.items()]}
+	if isinstance(obj, (bool, np.bool_)):
+		return bool(obj)
+	if isinstance(obj, (int, np.integer)):
+		return int(obj)
+	if isinstance(obj, (float, np.floating)):
+		return float(obj)
+	if isinstance(obj, str):
+		return obj
+	raise TypeError(f'unsupported artifact entry type {type(obj).__name__}')
+
+def decode(node, arrays):
+	if isinstance(node, dict):
+		if 'array' in node:
+			return arrays[node['array']]
+		if 'tuple' in node:
+			return tuple(decode(item, arrays) for item in node['tuple'])
+		return {decode(key, arrays): decode(value, arrays) for key, value in node['dict']}
+	if isinstance(node, list):
+		return [decode(item, arrays) for item in node]
+	return node
+
+def get_stamps(paths):
+	# cheap change detection ahead of hashing
+	return [[path, os.stat(path).st_size, os.stat(path).st_mtime_ns] for path in paths]
+
+def save_artifact(path, data, source_paths):
+	source_paths = sorted(set(source_paths))
+	arrays = []
+	tree = encode(data, arrays)
+	layout = []
+	offset = 0
+	for array in arrays:
+		offset = -(-offset // artifact_align)*artifact_align
+		layout.append([array.dtype.str, list(array.shape), offset])
+		offset += array.nbytes
+	header = json.dumps({
+		'key': hash_files(source_paths, artifact_version),
+		'sources': get_stamps(source_paths),
+		'layout': layout,
+		'tree': tree
+	}).encode()
+	data_start = -(-(struct.calcsize(prefix_format) + len(header)) // artifact_align)*artifact_align
+
+	directory = os.path.dirname(path)
+	if directory and not os.path.exists(directory):
+		os.makedirs(directory, exist_ok=True)
+	# written aside and renamed, a reader never sees a partial artifact
+	path_tmp = f'{path}.{os.getpid()}.tmp'
+	with open(path_tmp, 'wb') as file:
+		file.write(struct.pack(prefix_format, artifact_magic, artifact_version, len(header)))
+		file.write(header)
+		for array, (_, _, array_offset) in zip(arrays, layout):
+			file.seek(data_start + array_offset)
+			file.write(array.tobytes())
+		file.truncate(data_start + offset)
+	os.replace(path_tmp, path)
+
+def read_header(path):
+	with open(path, 'rb') as file:
+		prefix = file.read(struct.calcsize(prefix_format))
+		magic, version, header_len = struct.unpack(prefix_format, prefix)
+		if magic != artifact_magic or version != artifact_version:
+			raise ValueError(f'not a version {artifact_version} model artifact')
+		header = json.loads(file.read(header_len))
+	data_start = -(-(len(prefix) + header_len) // artifact_align)*artifact_align
+	return header, data_start
+
+def check_artifact(header):
+	# fresh when every source is unchanged, by size and mtime, then by content hash
+	sources = header['sources']
+	paths = [path for path, _, _ in sources]
+	try:
+		if get_stamps(paths) == sources:
+			return True
+		return hash_files(paths, artifact_version) == header['key']
+	except OSError:
+		return False
+
+def load_artifact(path):
+	# parsed data and source paths, None when missing or stale
+	#	arrays are copy-on-write views of one memory map, pages are read on first touch
+	if not os.path.exists(path):
+		return None
+	header, data_start = read_header(path)
+	if not check_artifact(header):
+		return None
+	buffer = np.memmap(path, dtype=np.uint8, mode='c')
+	arrays = []
+	for dtype, shape, offset in header['layout']:
+		dtype = np.dtype(dtype)
+		count = int(np.prod(shape))
+		start = data_start + offset
+		arrays.append(np.asarray(buffer[start:start + count*dtype.itemsize]).view(dtype).reshape(shape))
+	return decode(header['tree'], arrays), [path for path, _, _ in header['sources']]
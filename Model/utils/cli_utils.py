@@ -0,0 +1,8 @@
+import sys
+
+def get_arg(name, default):
+	# --name=value, converted to the type of default
+	for arg in sys.argv[1:]:
+		if arg.startswith(f'--{name}='):
+			return type(default)(arg.split('=', 1)[1])
+	return default
@@ -0,0 +1,278 @@
+import numpy as np
+from numba import njit
+
+# regular grid table over n axes with C channels, one numba type for any n:
+#	(values, lo, inv_res, shape, strides, corners, breaks, break_offsets, uniform, cubic)
+#	values:			[n_points, C], axes flattened in C order
+#	lo, inv_res:	grid origin and inverse spacing per axis (uniform axes)
+#	shape, strides:	points per axis and flat stride per axis (in rows of values)
+#	corners:		flat offsets of the 2^n cell corners, bit j set for the upper point along axis j
+#	breaks:			every axis' breakpoints concatenated, axis j at break_offsets[j]:break_offsets[j+1]
+#	uniform:		per axis, located arithmetically when set, by bisection on the breakpoints otherwise
+#	cubic:			monotone cubic (tensor product of 1D pchip) instead of multilinear
+# linear mode extrapolates the edge cells, cubic mode holds the edge values
+
+uniform_tol = 1e-9		# relative spacing deviation still treated as uniform
+
+def make_grid_table(ranges, values, cubic=False):
+	ranges = [np.asarray(r, dtype=np.float64) for r in ranges]
+	values = np.asarray(values, dtype=np.float64)
+	n = len(ranges)
+	shape = np.array([len(r) for r in ranges], dtype=np.int64)
+	if tuple(values.shape[:n]) != tuple(shape):
+		raise ValueError(f'grid values of shape {values.shape} do not match the axes {tuple(shape)}')
+	if np.any(shape < 2):
+		raise ValueError('every axis needs at least 2 points')
+	for j, r in enumerate(ranges):
+		if np.any(np.diff(r) <= 0):
+			raise ValueError(f'axis {j} is not strictly increasing')
+	n_channels = int(np.prod(values.shape[n:]))
+	values = np.ascontiguousarray(values.reshape(-1, n_channels))
+
+	strides = np.ones(n, dtype=np.int64)
+	for j in range(n-2, -1, -1):
+		strides[j] = strides[j+1]*shape[j+1]
+	corners = np.zeros(2**n, dtype=np.int64)
+	for k in range(2**n):
+		for j in range(n):
+			if (k >> j) & 1:
+				corners[k] += strides[j]
+
+	lo = np.array([r[0] for r in ranges])
+	res = np.array([(r[-1] - r[0])/(len(r) - 1) for r in ranges])
+	uniform = np.array([np.max(np.abs(np.diff(r) - h)) <= uniform_tol*abs(h) for r, h in zip(ranges, res)], dtype=np.bool_)
+	breaks = np.concatenate(ranges)
+	break_offsets = np.concatenate(([0], np.cumsum(shape))).astype(np.int64)
+	return values, lo, 1/res, shape, strides, corners, breaks, break_offsets, uniform, bool(cubic)
+
+def merge_breaks(*ranges):
+	# sorted union of breakpoints, points closer than uniform_tol of the span taken as one
+	breaks = np.sort(np.concatenate([np.asarray(r, dtype=np.float64) for r in ranges]))
+	keep = np.concatenate(([True], np.diff(breaks) > uniform_tol*(breaks[-1] - breaks[0])))
+	return breaks[keep]
+
+def set_cubic(table, cubic):
+	return table[:9] + (bool(cubic),)
+
+def cast_grid(table, dtype):
+	# values stored at another precision (float32 halves the footprint), lookups still return float64
+	return (np.ascontiguousarray(table[0], dtype=dtype),) + tuple(table[1:])
+
+def get_ranges(table):
+	breaks, break_offsets = table[6], table[7]
+	return [breaks[a:b] for a, b in zip(break_offsets[:-1], break_offsets[1:])]
+
+# the helpers are inlined, a call taking the table tuple costs a reference count per array
+@njit(cache=True, inline='always')
+def locate(table, query, work):
+	# cell index, fraction and inverse cell width per axis into work[:n], work[n:2n], work[2n:3n]
+	#	returns the flat row of the lower corner
+	_, lo, inv_res, shape, strides, _, breaks, break_offsets, uniform, _ = table
+	n = len(shape)
+	row = 0
+	for j in range(n):
+		if uniform[j]:
+			u = (query[j] - lo[j])*inv_res[j]
+			i = min(max(int(np.floor(u)), 0), shape[j]-2)
+			work[n+j] = u - i
+			work[2*n+j] = inv_res[j]
+		else:
+			# bisection in place, np.searchsorted on a slice costs more than the whole lookup
+			start = break_offsets[j]
+			lower, upper = start, break_offsets[j+1]
+			while lower < upper:
+				mid = (lower + upper)//2
+				if breaks[mid] <= query[j]:
+					lower = mid + 1
+				else:
+					upper = mid
+			i = min(max(lower - start - 1, 0), shape[j]-2)
+			inv_h = 1/(breaks[start+i+1] - breaks[start+i])
+			work[n+j] = (query[j] - breaks[start+i])*inv_h
+			work[2*n+j] = inv_h
+		work[j] = i
+		row += i*strides[j]
+	return row
+
+@njit(cache=True, inline='always')
+def interp_linear(table, row, work, out, grad, with_grad):
+	values, _, _, shape, _, corners, _, _, _, _ = table
+	n = len(shape)
+	n_channels = values.shape[1]
+	for c in range(n_channels):
+		out[c] = 0.0
+	if with_grad:
+		grad[:,:] = 0.0
+	# corner weights by doubling into work[3n:], bit j of the corner picks d[j] over 1 - d[j]
+	w0 = 3*n
+	work[w0] = 1.0
+	size = 1
+	for j in range(n):
+		d = work[n+j]
+		for k in range(size):
+			work[w0+k+size] = work[w0+k]*d
+			work[w0+k] *= 1 - d
+		size *= 2
+	for k in range(len(corners)):
+		w = work[w0+k]
+		r = row + corners[k]
+		for c in range(n_channels):
+			out[c] += w*values[r,c]
+		if with_grad:
+			for j in range(n):
+				dw = work[2*n+j] if (k >> j) & 1 else -work[2*n+j]
+				for m in range(n):
+					if m != j:
+						dw *= work[n+m] if (k >> m) & 1 else 1 - work[n+m]
+				for c in range(n_channels):
+					grad[c,j] += dw*values[r,c]
+
+@njit(cache=True)
+def pchip_slope(h0, h1, delta0, delta1):
+	# weighted harmonic mean of the neighbouring secants, zero at extrema (Fritsch-Carlson, as scipy's pchip)
+	if delta0*delta1 <= 0:
+		return 0.0
+	w0 = 2*h1 + h0
+	w1 = h1 + 2*h0
+	return (w0 + w1)/(w0/delta0 + w1/delta1)
+
+@njit(cache=True)
+def pchip_end_slope(h0, h1, delta0, delta1):
+	# one sided three point slope at a grid edge, limited to stay monotone (as scipy's pchip)
+	m = ((2*h0 + h1)*delta0 - h0*delta1)/(h0 + h1)
+	if np.sign(m) != np.sign(delta0):
+		return 0.0
+	if np.sign(delta0) != np.sign(delta1) and abs(m) > 3*abs(delta0):
+		return 3*delta0
+	return m
+
+@njit(cache=True)
+def hermite_monotone(p0, p1, p2, p3, t, h0, h1, h2, has_left, has_right, derivative):
+	# on [p1, p2] from the 4 point stencil, a missing outer point takes the edge slope (linear on 2 point axes)
+	delta0 = (p1 - p0)/h0
+	delta1 = (p2 - p1)/h1
+	delta2 = (p3 - p2)/h2
+	if has_left:
+		m1 = pchip_slope(h0, h1, delta0, delta1)
+	else:
+		m1 = pchip_end_slope(h1, h2, delta1, delta2) if has_right else delta1
+	if has_right:
+		m2 = pchip_slope(h1, h2, delta1, delta2)
+	else:
+		m2 = pchip_end_slope(h1, h0, delta1, delta0) if has_left else delta1
+	t2 = t*t
+	if derivative:
+		return ((6*t2 - 6*t)*(p1 - p2)/h1 + (3*t2 - 4*t + 1)*m1 + (3*t2 - 2*t)*m2)
+	t3 = t2*t
+	return (2*t3 - 3*t2 + 1)*p1 + (t3 - 2*t2 + t)*h1*m1 + (-2*t3 + 3*t2)*p2 + (t3 - t2)*h1*m2
+
+@njit(cache=True)
+def interp_cubic(table, work, out, grad, with_grad):
+	values, _, inv_res, shape, strides, _, breaks, break_offsets, uniform, _ = table
+	n = len(shape)
+	n_channels = values.shape[1]
+	t = np.empty(n)
+	h = np.empty((n, 3))
+	has_left = np.empty(n, dtype=np.bool_)
+	has_right = np.empty(n, dtype=np.bool_)
+	for j in range(n):
+		i = int(work[j])
+		t[j] = min(max(work[n+j], 0.0), 1.0)
+		has_left[j] = i > 0
+		has_right[j] = i + 2 < shape[j]
+		if uniform[j]:
+			h[j,:] = 1/inv_res[j]
+		else:
+			bp = breaks[break_offsets[j]:break_offsets[j+1]]
+			h[j,1] = bp[i+1] - bp[i]
+			h[j,0] = bp[i] - bp[i-1] if has_left[j] else h[j,1]
+			h[j,2] = bp[i+2] - bp[i+1] if has_right[j] else h[j,1]
+
+	# 4^n stencil, last axis fastest, outer points clamped to the grid
+	n_stencil = 4**n
+	stencil = np.empty((n_stencil, n_channels))
+	for k in range(n_stencil):
+		r = 0
+		rem = k
+		for j in range(n-1, -1, -1):
+			i = min(max(int(work[j]) - 1 + rem % 4, 0), shape[j]-1)
+			rem //= 4
+			r += i*strides[j]
+		stencil[k] = values[r]
+
+	# one reduction for the value, one more per axis for the gradient
+	block = np.empty((n_stencil, n_channels))
+	for deriv_axis in range(-1, n if with_grad else 0):
+		block[:] = stencil
+		size = n_stencil
+		for j in range(n-1, -1, -1):
+			size //= 4
+			for m in range(size):
+				for c in range(n_channels):
+					block[m,c] = hermite_monotone(block[4*m,c], block[4*m+1,c], block[4*m+2,c], block[4*m+3,c], t[j],
+									  h[j,0], h[j,1], h[j,2], has_left[j], has_right[j], j == deriv_axis)
+		for c in range(n_channels):
+			if deriv_axis < 0:
+				out[c] = block[0,c]
+			else:
+				grad[c,deriv_axis] = block[0,c]
+
+@njit(cache=True)
+def make_work(table):
+	# scratch for interp_grid_into, allocate once per batch
+	n = len(table[3])
+	return np.empty(3*n + len(table[5]))
+
+@njit(cache=True, inline='always')
+def interp_grid_into(table, query, out, grad, with_grad, work):
+	# cell indices are held exactly as floats in the scratch
+	row = locate(table, query, work)
+	if table[9]:
+		interp_cubic(table, work, out, grad, with_grad)
+	else:
+		interp_linear(table, row, work, out, grad, with_grad)
+
+@njit(cache=True)
+def interp_grid(table, query):
+	# channels at one point
+	out = np.empty(table[0].shape[1])
+	interp_grid_into(table, query, out, np.empty((0, 0)), False, make_work(table))
+	return out
+
+@njit(cache=True)
+def interp_grid_grad(table, query):
+	# channels and their gradient [C, n] at one point
+	out = np.empty(table[0].shape[1])
+	grad = np.empty((table[0].shape[1], len(table[3])))
+	interp_grid_into(table, query, out, grad, True, make_work(table))
+	return out, grad
+
+@njit(cache=True, nogil=True)
+def interp_grid_batch(table, queries):
+	# channels at each row of queries [N, n]
+	out = np.empty((len(queries), table[0].shape[1]))
+	dummy = np.empty((0, 0))
+	work = make_work(table)
+	# mode branch outside the loop, a cubic call inside it keeps the linear path from being optimised
+	if table[9]:
+		for i in range(len(queries)):
+			locate(table, queries[i], work)
+			interp_cubic(table, work, out[i], dummy, False)
+	else:
+		for i in range(len(queries)):
+			interp_linear(table, locate(table, queries[i], work), work, out[i], dummy, False)
+	return out
+
+@njit(cache=True, nogil=True)
+def interp_grid_grad_batch(table, queries):
+	out = np.empty((len(queries), table[0].shape[1]))
+	grad = np.empty((len(queries), table[0].shape[1], len(table[3])))
+	work = make_work(table)
+	if table[9]:
+		for i in range(len(queries)):
+			locate(table, queries[i], work)
+			interp_cubic(table, work, out[i], grad[i], True)
+	else:
+		for i in range(len(queries)):
+			interp_linear(table, locate(table, queries[i], work), work, out[i], grad[i], True)
+	return out, grad
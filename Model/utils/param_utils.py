@@ -1,7 +1,16 @@
 import numpy as np
-import pandas as pd
+import hashlib
+import os
 from numba import njit
 
+from utils.interp_utils import make_grid_table, merge_breaks, get_ranges, cast_grid, interp_grid, interp_grid_grad, interp_grid_batch
+
+# volume area grid channels: vol, area, vol_center[3], area_center[3]
+vol_area_channels = 8
+vol_area_mirrored = [3, 6]		# y of the centers, negated on a mirrored body
+# merged hydrostatics table, vol_area_channels per body in this order
+block_hull, block_wing_root_L, block_wing_root_R = 0, 1, 2
+
 @njit(cache=True)
 def clip(val,a,b):
 	return max(min(val,b),a)
@@ -57,41 +66,60 @@ def load_constants(path_constants, debug=False):
 				print(f'DEBUG: line ({line_num}) - key: {f"{key}":<12}\tvalue: {f"{value}":<12}\tvalueStr: {valueStr}')
 	return constants
 
+def hash_files(paths, *extra):
+	# content hash of every file (order independent) plus any extra keys, e.g. solver settings
+	digest = hashlib.sha256()
+	for path in sorted(paths):
+		with open(path, 'rb') as file:
+			digest.update(os.path.basename(path).encode())
+			digest.update(hashlib.sha256(file.read()).digest())
+	for key in extra:
+		digest.update(np.asarray(key).tobytes() if isinstance(key, np.ndarray) else str(key).encode())
+	return digest.hexdigest()
+
 def load_volume_area_data(path_npz):
-	return load_npz_4D(path_npz, 'grid_results','z_range','pitch_range','roll_range')
+	return load_npz_grid(path_npz, 'grid_results', ['z_range','pitch_range','roll_range'])
 
 def load_propulsor_data(path_npz):
-	return load_npz_4D(path_npz, 'grid_results','rho_range','vA_range','V_range')
+	return load_npz_grid(path_npz, 'grid_results', ['rho_range','vA_range','V_range'])
 
-def load_npz_4D(path_npz, w, x,y,z):
+def load_npz_grid(path_npz, key_values, keys_ranges):
 	data = np.load(path_npz)
-	range_x = data[x]
-	range_y = data[y]
-	range_z = data[z]
-	grid_w = data[w]
-	
-	len_x = len(range_x)
-	len_y = len(range_y)
-	len_z = len(range_z)
+	return make_grid_table([data[key] for key in keys_ranges], data[key_values])
 
-	res_x = (max(range_x) - min(range_x))/len_x
-	res_y = (max(range_y) - min(range_y))/len_y
-	res_z = (max(range_z) - min(range_z))/len_z
-	
-	i_max_x = len(range_x) - 2
-	i_max_y = len(range_y) - 2
-	i_max_z = len(range_z) - 2
+def merge_volume_area(hull_data, wing_root_data):
+	# hull and both wing roots over one (z, pitch, roll) grid, a single lookup per evaluation
+	#	the hull grid is mirrored about roll 0 (queried at |roll| before), the right wing root is the left one at -roll,
+	#	both with y negated. axes are the union of the source breakpoints, roll mirrored, so resampling is exact
+	hull_ranges = get_ranges(hull_data)
+	wing_root_ranges = get_ranges(wing_root_data)
+	ranges = [merge_breaks(hull_ranges[0], wing_root_ranges[0]), merge_breaks(hull_ranges[1], wing_root_ranges[1]),
+		   merge_breaks(hull_ranges[2], -hull_ranges[2], wing_root_ranges[2], -wing_root_ranges[2], [0.0])]
+	points = np.stack(np.meshgrid(*ranges, indexing='ij'), axis=-1).reshape(-1, 3)
+	folded = points.copy()
+	folded[:,2] = np.abs(points[:,2])
+	mirrored = points.copy()
+	mirrored[:,2] *= -1
 
-	min_base = np.array([min(range_x), min(range_y), min(range_z)])
-	res = np.array([res_x, res_y, res_z])
+	hull = interp_grid_batch(hull_data, folded)
+	hull[:,vol_area_mirrored] *= np.where(points[:,2] < 0, -1.0, 1.0)[:,None]
+	wing_root_L = interp_grid_batch(wing_root_data, points)
+	wing_root_R = interp_grid_batch(wing_root_data, mirrored)
+	wing_root_R[:,vol_area_mirrored] *= -1
+	values = np.concatenate((hull, wing_root_L, wing_root_R), axis=1)
+	return make_grid_table(ranges, values.reshape(*[len(r) for r in ranges], -1))
 
-	return grid_w, (range_x,range_y,range_z, res_x,res_y,res_z, 
-					   i_max_x,i_max_y,i_max_z, min_base,res)
+@njit(cache=True)
+def query_hydrostatics(hydrostatics, query):
+	# every body's volume area channels [n_bodies, vol_area_channels], split with split_volume_area
+	return interp_grid(hydrostatics, query).reshape(-1, vol_area_channels)
 
 @njit(cache=True)
 def query_volume_area(volume_area, query, r_CM):
-	output = trilinear_interp(volume_area, query)
+	return split_volume_area(interp_grid(volume_area, query), r_CM)
 
+@njit(cache=True)
+def split_volume_area(output, r_CM):
 	vol = output[0]
 	area = output[1]
 	if vol < 1e-6 or area < 1e-6:
@@ -100,37 +128,37 @@ def query_volume_area(volume_area, query, r_CM):
 	area_center = output[5:8] - r_CM
 	return vol, area, vol_center, area_center
 
-@njit(cache=True)
-def trilinear_interp(data, query):
-	x, y, z = query
-	grid_w = data[0]
-	(range_x,range_y,range_z, res_x,res_y,res_z, 
-  		i_max_x,i_max_y,i_max_z, min_base,res) = data[1]
-	
-	i_x, i_y, i_z = ((query-min_base)/res).astype(np.int32)
-
-	i_x = clip(i_x, 0, i_max_x)
-	i_y = clip(i_y, 0, i_max_y)
-	i_z = clip(i_z, 0, i_max_z)
-
-	d_x = (x - range_x[i_x]) / res_x
-	d_y = (y - range_y[i_y]) / res_y
-	d_z = (z - range_z[i_z]) / res_z
-
-	c00 = grid_w[i_x][i_y][i_z]*(1-d_x) + grid_w[i_x+1][i_y][i_z]*d_x
-	c01 = grid_w[i_x][i_y][i_z+1]*(1-d_x) + grid_w[i_x+1][i_y][i_z+1]*d_x
-	c10 = grid_w[i_x][i_y+1][i_z]*(1-d_x) + grid_w[i_x+1][i_y+1][i_z]*d_x
-	c11 = grid_w[i_x][i_y+1][i_z+1]*(1-d_x) + grid_w[i_x+1][i_y+1][i_z+1]*d_x
+def load_aero_coeffs(path):
+	return load_periodic_1D_data(path, ['Alpha','CL','CD'], 'aerodynamic coefficients')
 
-	c0 = c00*(1-d_y) + c10*d_y
-	c1 = c01*(1-d_y) + c11*d_y
+def load_thrust_torque_coeffs(path):
+	return load_periodic_1D_data(path, ['Beta','C_T^*','C_Q^*'], 'thrust torque coefficients')
 
-	return c0*(1-d_z) + c1*d_z
+def load_fourier_coeffs(path):
+	# four quadrant propeller fourier series as dense harmonics [k, (T-A, T-B, Q-A, Q-B)], already scaled to C_T^*, C_Q^*
+	#	same series as calc_4_quad_propeller_coeffs in params/gen_4_quad_prop_coeffs.py
+	import pandas as pd
+	cols = ['K','T-A(k)','T-B(k)','Q-A(k)','Q-B(k)']
+	df = pd.read_csv(path, sep=r'\s+')
+	df = df.apply(pd.to_numeric, errors='coerce')
+	missing_cols = sorted(set(cols) - set(df.columns))
+	if missing_cols:
+		raise Exception(f'missing column(s) {missing_cols}')
+	data = df[cols].dropna().to_numpy()
+	k = data[:,0]
+	if len(k) == 0 or np.any(k < 0) or np.any(k != np.round(k)):
+		raise Exception('harmonics must be non-negative integers')
+	coeffs = np.zeros((int(k.max()) + 1, 4))
+	np.add.at(coeffs, k.astype(np.int64), data[:,1:]*np.array([0.01, 0.01, -0.001, -0.001]))
+	return coeffs
 
-def load_aero_coeffs(path):
-	return load_periodic_1D_data(path, ['Alpha','CL','CD'], 'aerodynamic coefficients')
+def is_fourier_propulsor(path_propulsor):
+	# propulsor given as a fourier coefficient file instead of an equilibrium table, solved directly at runtime
+	return not path_propulsor.endswith('.npz')
 
 def load_periodic_1D_data(path_data, cols, data_name):
+	# pandas only on a model artifact miss
+	import pandas as pd
 	df = pd.read_csv(path_data, sep=r'\s+')
 	df = df.apply(pd.to_numeric, errors='coerce')
 	missing_cols = list(set(cols) - set(df.columns))
@@ -147,9 +175,44 @@ def load_periodic_1D_data(path_data, cols, data_name):
 		input_min = min(data[:,0])
 		input_max = max(data[:,0])
 		period = input_max - input_min
-		res = period/length
+		res = period/(length-1)
 		return data, (length, input_min, input_max, period, res)
 
+def make_aero_bank(coeffs_list):
+	# every (alpha, CL, CD) table resampled onto one uniform periodic alpha grid, at the finest source spacing
+	#	(tables[k, n_alpha+1, 2], alpha_min, period, inv_res, n_alpha), the last row repeats the first
+	#	a source's last row is the periodic repeat of its first, as in query_periodic_1D
+	periods = [meta[3] for _, meta in coeffs_list]
+	period = periods[0]
+	if not np.allclose(periods, period):
+		raise ValueError(f'aerodynamic coefficient periods differ - {periods}')
+	alpha_min = coeffs_list[0][1][1]
+	spacing = min(np.min(np.diff(data[:,0])) for data, _ in coeffs_list)
+	n_alpha = int(np.ceil(period/spacing - 1e-6))
+	alpha = alpha_min + np.arange(n_alpha + 1)*(period/n_alpha)
+	tables = np.empty((len(coeffs_list), n_alpha + 1, 2))
+	for k, (data, _) in enumerate(coeffs_list):
+		for c in range(2):
+			tables[k,:,c] = np.interp(alpha, data[:-1,0], data[:-1,c+1], period=period)
+	return tables, float(alpha_min), float(period), n_alpha/period, n_alpha
+
+@njit(cache=True)
+def query_aero_bank(aero_bank, i, alpha):
+	# CL, CD of table i at alpha [deg]
+	tables, alpha_min, period, inv_res, n_alpha = aero_bank
+	u = ((alpha - alpha_min) % period)*inv_res
+	j = min(int(u), n_alpha - 1)
+	d = u - j
+	return tables[i,j,0]*(1-d) + tables[i,j+1,0]*d, tables[i,j,1]*(1-d) + tables[i,j+1,1]*d
+
+@njit(cache=True)
+def query_aero_bank_batch(aero_bank, i_tables, alphas):
+	# CL, CD [n, 2] of table i_tables[k] at alphas[k]
+	CL_CD = np.empty((len(alphas), 2))
+	for k in range(len(alphas)):
+		CL_CD[k,0], CL_CD[k,1] = query_aero_bank(aero_bank, i_tables[k], alphas[k])
+	return CL_CD
+
 @njit(cache=True)
 def query_periodic_1D(periodic_1d,x):
 	data = periodic_1d[0]
@@ -45,10 +45,26 @@ def cross(a, b):
 		a[0]*b[1] - a[1]*b[0]
 	])
 
+@njit(cache=True)
+def matvec(A, x):
+	return np.array([
+		A[0,0]*x[0] + A[0,1]*x[1] + A[0,2]*x[2],
+		A[1,0]*x[0] + A[1,1]*x[1] + A[1,2]*x[2],
+		A[2,0]*x[0] + A[2,1]*x[1] + A[2,2]*x[2]
+	])
+
+@njit(cache=True)
+def matmul(A, B):
+	C = np.empty((3,3))
+	for i in range(3):
+		for j in range(3):
+			C[i,j] = A[i,0]*B[0,j] + A[i,1]*B[1,j] + A[i,2]*B[2,j]
+	return C
+
 @njit(cache=True)
 def stab_frame(U,omega,r_b_frame,C_loc_b):
 	U_local = U + cross(omega, r_b_frame)
-	U_local_loc_frame = C_loc_b @ U_local
+	U_local_loc_frame = matvec(C_loc_b, U_local)
 	U_mag = mag(U_local)
 	if U_mag < 1e-6:
 		return U_mag, U_local_loc_frame, 0.0, 0.0, np.eye(3)
@@ -64,34 +80,55 @@ def stab_frame(U,omega,r_b_frame,C_loc_b):
 	return U_mag, U_local_loc_frame, alpha, beta, C_loc_stab
 
 @njit(cache=True)
-def calc_lift_drag(U,omega,r_b_frame,C_loc_b,Cb_loc, aero_coeffs, rho,A):
+def calc_lift_drag(U,omega,r_b_frame,C_loc_b,Cb_loc, aero_bank,i_aero, rho,A):
 	U_mag, _, alpha, beta, C_loc_stab = stab_frame(U, omega, r_b_frame, C_loc_b)
-	CL, CD = query_periodic_1D(aero_coeffs, alpha*180/pi)
+	CL, CD = query_aero_bank(aero_bank, i_aero, alpha*180/pi)
 	Q = 1/2*rho*U_mag**2
 	L = Q*CL*A
 	D = Q*CD*A
-	Cb_stab = Cb_loc @ C_loc_stab
-	F = Cb_stab @ np.array([-D, 0.0, -L])
+	Cb_stab = matmul(Cb_loc, C_loc_stab)
+	F = matvec(Cb_stab, np.array([-D, 0.0, -L]))
 	M = cross(r_b_frame, F)
 	return U_mag, alpha, beta, Cb_stab, C_loc_stab, L, D, F, M
 
+@njit(cache=True)
+def calc_lift_drag_batch(U,omega,r_b_frames,C_loc_bs,Cb_locs, aero_bank,i_aeros, rhos,As):
+	# summed lift & drag force moment of every surface, coefficients from one bank lookup
+	n = len(i_aeros)
+	U_mags = np.empty(n)
+	alphas = np.empty(n)
+	Cb_stabs = np.empty((n,3,3))
+	for k in range(n):
+		U_mags[k], _, alpha, _, C_loc_stab = stab_frame(U, omega, r_b_frames[k], C_loc_bs[k])
+		alphas[k] = alpha*180/pi
+		Cb_stabs[k] = matmul(Cb_locs[k], C_loc_stab)
+	CL_CD = query_aero_bank_batch(aero_bank, i_aeros, alphas)
+	F = np.zeros(3)
+	M = np.zeros(3)
+	for k in range(n):
+		Q = 1/2*rhos[k]*U_mags[k]**2
+		F_k = matvec(Cb_stabs[k], np.array([-Q*CL_CD[k,1]*As[k], 0.0, -Q*CL_CD[k,0]*As[k]]))
+		F += F_k
+		M += cross(r_b_frames[k], F_k)
+	return F, M
+
 @njit(cache=True)
 def calc_buoyancy(vol, rho,g, Cb0,r_body):
-	F = Cb0 @ np.array([0.0, 0.0, -rho*vol*g])
+	F = matvec(Cb0, np.array([0.0, 0.0, -rho*vol*g]))
 	M = cross(r_body, F)
 	return F, M
 
 @njit(cache=True)
 def ra_to_body(r, Cb_ra, r_ra):
-	return r_ra + Cb_ra @ r
+	return r_ra + matvec(Cb_ra, r)
 
 @njit(cache=True)
 def ra_to_world(r, C0_ra, r_ra_world):
-	return C0_ra @ r + r_ra_world
+	return matvec(C0_ra, r) + r_ra_world
 
 @njit(cache=True)
 def body_to_world(r, C0b, r_world):
-	return C0b @ r + r_world
+	return matvec(C0b, r) + r_world
 
 @njit(cache=True)
 def calc_base_query(C0b, r_CM, r_world, Phi):
@@ -120,8 +157,8 @@ def calc_base_rot_mats(Phi, psi_ra, r_ra, r):
 		[0.0, 0.0, 1.0]
 	])
 	Cra_b = np.transpose(Cb_ra)
-	C0_ra = C0b @ Cb_ra
-	r_ra_world = C0b @ r_ra + r
+	C0_ra = matmul(C0b, Cb_ra)
+	r_ra_world = matvec(C0b, r_ra) + r
 	return Cb0, C0b, Cb_ra, Cra_b, C0_ra, r_ra_world
 
 @njit(cache=True)
@@ -136,3 +173,62 @@ def calc_H(Phi):
 		[0.0, cphi, -sphi],
 		[0.0, sphi/ctheta, cphi/ctheta]
 	])
+
+@njit(cache=True)
+def calc_H_partials(Phi, omega):
+	# columns d(H @ omega)/d(phi, theta, psi)
+	phi = Phi[0]
+	theta = Phi[1]
+	cphi, ctheta = cos(phi), cos(theta)
+	sphi, stheta = sin(phi), sin(theta)
+	ttheta = stheta/ctheta
+	sec2 = 1/ctheta**2
+	p, q, r = omega[0], omega[1], omega[2]
+	return np.array([
+		[(cphi*q - sphi*r)*ttheta, (sphi*q + cphi*r)*sec2, 0.0],
+		[-sphi*q - cphi*r, 0.0, 0.0],
+		[(cphi*q - sphi*r)/ctheta, (sphi*q + cphi*r)*ttheta/ctheta, 0.0]
+	])
+
+@njit(cache=True)
+def calc_C0b_partials(Phi, U):
+	# columns d(C0b @ U)/d(phi, theta, psi)
+	cphi, ctheta, cpsi = cos(Phi[0]), cos(Phi[1]), cos(Phi[2])
+	sphi, stheta, spsi = sin(Phi[0]), sin(Phi[1]), sin(Phi[2])
+	dCb0_dphi = np.array([
+		[0.0, 0.0, 0.0],
+		[cpsi*stheta*cphi + spsi*sphi, spsi*stheta*cphi - cpsi*sphi, ctheta*cphi],
+		[-cpsi*stheta*sphi + spsi*cphi, -spsi*stheta*sphi - cpsi*cphi, -ctheta*sphi]
+	])
+	dCb0_dtheta = np.array([
+		[-cpsi*stheta, -spsi*stheta, -ctheta],
+		[cpsi*ctheta*sphi, spsi*ctheta*sphi, -stheta*sphi],
+		[cpsi*ctheta*cphi, spsi*ctheta*cphi, -stheta*cphi]
+	])
+	dCb0_dpsi = np.array([
+		[-spsi*ctheta, cpsi*ctheta, 0.0],
+		[-spsi*stheta*sphi - cpsi*cphi, cpsi*stheta*sphi - spsi*cphi, 0.0],
+		[-spsi*stheta*cphi + cpsi*sphi, cpsi*stheta*cphi + spsi*sphi, 0.0]
+	])
+	partials = np.empty((3,3))
+	partials[:,0] = matvec(dCb0_dphi.T, U)
+	partials[:,1] = matvec(dCb0_dtheta.T, U)
+	partials[:,2] = matvec(dCb0_dpsi.T, U)
+	return partials
+
+@njit(cache=True)
+def calc_state_dot(F,M, Cb0,C0b, m,g, Ib,Ib_inv, U,omega,Phi):
+	F = F.astype(np.float64)
+	M = M.astype(np.float64)
+	U = U.astype(np.float64)
+	omega = omega.astype(np.float64)
+
+	F_g = matvec(Cb0, np.array([0.0, 0.0, m*g]))
+	F += F_g
+
+	U_dot = F/m - cross(omega, U)
+	omega_dot = matvec(Ib_inv, M - cross(omega, matvec(Ib, omega)))
+	H = calc_H(Phi)
+	Phi_dot = matvec(H, omega)
+	r_dot = matvec(C0b, U)
+	return U_dot, omega_dot, Phi_dot, r_dot, H
@@ -3,11 +3,15 @@ export class SocketManager {
 		this.socket = null;
 		this.onMessageReceived = onMessageReceived;
 		this.onStatusChange = onStatusChange;
+		// binary telemetry layout from the last build message, frames of any other layout are dropped
+		this.schema = null;
+		this.methods = [];
 	}
 
 	connect(url) {
 		if (this.socket != null) return;
 		this.socket = new WebSocket(url);
+		this.socket.binaryType = 'arraybuffer';
 		this.onStatusChange('Connecting...');
 
 		this.socket.addEventListener('open', () => {
@@ -18,7 +22,17 @@ export class SocketManager {
 		this.socket.addEventListener('message', event => {
 			let data = undefined;
 			try {
-				data = JSON.parse(event.data);
+				if (event.data instanceof ArrayBuffer) {
+					data = this.decodeTelem(event.data);
+					if (data == null) return;
+				} else {
+					data = JSON.parse(event.data);
+					if (data['type'] == 'build' && data['telem_schema']) {
+						this.schema = data['telem_schema'];
+						this.methods = data['methods'];
+						this.send({ type: 'encoding', value: 'binary' });
+					}
+				}
 			} catch (error) {
 				console.error('ERROR: failed to parse data', error, event.data);
 				return;
@@ -39,6 +53,37 @@ export class SocketManager {
 		})
 	}
 
+	decodeTelem(buffer) {
+		// 16 byte header (layout, frame sequence, channel mask, zero) then the segments of the channels in the mask,
+		// rebuilt into the json telemetry message
+		const header = new Uint32Array(buffer, 0, 4);
+		if (this.schema == null || header[0] != this.schema.layout) return null;
+		const values = this.schema.dtype == 'float64' ? new Float64Array(buffer, 16) : new Float32Array(buffer, 16);
+		const msg = { type: 'telem' };
+		let start = 0;
+		this.schema.channels.forEach((channel, i) => {
+			if (!((header[2] >> i) & 1)) return;
+			for (const [path, offset, size, kind] of channel.fields) {
+				let node = msg;
+				for (let j = 0; j < path.length - 1; j++) node = node[path[j]] ??= {};
+				const value = values[start + offset];
+				const key = path[path.length - 1];
+				if (kind == 'array') node[key] = Array.from(values.subarray(start + offset, start + offset + size));
+				else if (kind == 'bool') node[key] = value != 0;
+				else if (kind == 'int') node[key] = Number.isNaN(value) ? null : value;
+				else if (kind == 'method') node[key] = this.methods[value];
+				else node[key] = value;
+			}
+			start += channel.size;
+		});
+		return msg;
+	}
+
+	subscribe(channels, rate) {
+		// telemetry channels (hull, panels, wing_roots, propulsor, pose, solver) and rate in Hz, null for all/every frame
+		this.send({ type: 'subscribe', channels: channels, rate: rate });
+	}
+
 	send(data) {
 		if (this.socket?.readyState === WebSocket.OPEN) {
 			this.socket.send(JSON.stringify(data));
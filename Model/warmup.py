@@ -0,0 +1,69 @@
+import numpy as np
+import time
+import contextlib
+
+class StartupReport:
+	# wall time per startup stage, from the report's creation (ideally the first import) on
+	def __init__(self, tik=None):
+		self.tik = time.perf_counter() if tik is None else tik
+		self.last = self.tik
+		self.stages = []
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		tik = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.stages.append((name, time.perf_counter() - tik))
+			self.last = time.perf_counter()
+
+	def mark(self, name):
+		# everything since the previous stage, e.g. module imports
+		now = time.perf_counter()
+		self.stages.append((name, now - self.last))
+		self.last = now
+
+	def print(self):
+		total = time.perf_counter() - self.tik
+		print(f'INFO: startup report, {total:.3f} s total')
+		for name, duration in self.stages:
+			print(f'\t{name:<36}{duration*1e3:>9.1f} ms')
+
+def get_kernels(model, methods):
+	# (dispatcher, arguments) for every compiled entry point of the simulation methods, typed exactly as called
+	import integrators
+	import kernel_RBird
+	state = np.ascontiguousarray(model.get_state(), dtype=np.float64)
+	input = np.ascontiguousarray(model.get_input(), dtype=np.float64)
+	packed = model.packed
+	kernels = [
+		(kernel_RBird.calc_state_dot_fused, (state, input, packed)),
+		(integrators.check_state, (state,))
+	]
+	if 'Radau' in methods or 'BDF' in methods:
+		kernels.append((kernel_RBird.calc_jacobian_fused, (state, input, packed, False)))
+	if 'RK4' in methods:
+		kernels.append((integrators.integrate_rk4, (state, input, packed, 0.002, 1)))
+	if 'SIEuler' in methods:
+		kernels.append((integrators.integrate_semi_implicit_euler, (state, input, packed, 0.002, 1)))
+	if 'IMEX' in methods:
+		kernels.append((integrators.integrate_imex, (state, input, packed, 0.005, 1, 2)))
+	if 'DOPRI5' in methods:
+		kernels.append((integrators.integrate_dopri5, (state, np.empty(0), input, packed, 0.01, 0.0, 1e-3, 1e-6, 1)))
+	return kernels
+
+def warm_up(model, methods, report: StartupReport=None):
+	# eager compile (or cache load) of each entry point for the argument types it will see, without running it
+	#	a second signature on a kernel afterwards means some call site passes differently typed tables
+	import numba
+	hits, misses = 0, 0
+	for kernel, args in get_kernels(model, methods):
+		signature = tuple(numba.typeof(arg) for arg in args)
+		with report.stage(f'jit {kernel.py_func.__name__}') if report is not None else contextlib.nullcontext():
+			kernel.compile(signature)
+		hits += sum(kernel.stats.cache_hits.values())
+		misses += sum(kernel.stats.cache_misses.values())
+		if len(kernel.signatures) > 1:
+			print(f'WARNING: {kernel.py_func.__name__} specialized {len(kernel.signatures)} times')
+	print(f'INFO: kernels warmed up, {hits} cache hit(s), {misses} compiled')